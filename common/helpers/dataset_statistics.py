@@ -0,0 +1,194 @@
+"""
+Global feature statistics (mean/std-dev per feature dim) of a RETURNN dataset,
+computed in parallel over shards of the segment list.
+
+Same outputs as :class:`i6_core.returnn.dataset.ExtractDatasetMeanStddevJob`,
+so it can directly replace it, e.g. for ``norm_mean``/``norm_std_dev`` of the audio features.
+"""
+
+__all__ = ["ExtractDatasetMeanStddevShardedJob"]
+
+import json
+import os
+import random
+import subprocess
+from typing import Any, Dict, Optional
+
+from sisyphus import Job, Task, tk
+
+import i6_core.util as util
+from i6_core.returnn.config import ReturnnConfig
+
+
+class ExtractDatasetMeanStddevShardedJob(Job):
+    """
+    Like :class:`ExtractDatasetMeanStddevJob`, but:
+
+    - The seq list of the dataset is split into shards, which are processed in parallel tasks.
+      Each task computes count, mean and sum of squared deviations (per feature dim) in float64,
+      and these are combined with the numerically stable parallel algorithm (Chan et al.).
+    - Optionally, only a random fraction of the seqs is used.
+      Then ``out_statistics`` contains the standard error (ratio estimator over seqs)
+      and a 95% confidence bound of the mean.
+
+    The dataset must support the ``segment_file`` option (e.g. OggZipDataset) and ``get_all_tags``.
+    The data key is "data", and the std-dev is the population std-dev, as in RETURNN ``dump-dataset.py --stats``.
+    """
+
+    def __init__(
+        self,
+        dataset: Dict[str, Any],
+        *,
+        num_shards: int = 16,
+        seq_fraction: float = 1.0,
+        random_seed: int = 42,
+        returnn_python_exe: Optional[tk.Path] = None,
+        returnn_root: Optional[tk.Path] = None,
+    ):
+        """
+        :param dataset: RETURNN dataset opts, e.g. from :func:`OggZipDataset.as_returnn_opts`.
+            An existing "segment_file" is used to select the seqs, before sharding.
+        :param num_shards: number of parallel tasks
+        :param seq_fraction: if < 1, only estimate the statistics on this random fraction of the seqs
+        :param random_seed: for the seq selection with seq_fraction
+        :param returnn_python_exe:
+        :param returnn_root:
+        """
+        assert num_shards >= 1 and 0.0 < seq_fraction <= 1.0
+        self.dataset = dataset
+        self.num_shards = num_shards
+        self.seq_fraction = seq_fraction
+        self.random_seed = random_seed
+        self.returnn_python_exe = returnn_python_exe
+        self.returnn_root = returnn_root
+
+        self.out_mean = self.output_var("mean_var")
+        self.out_std_dev = self.output_var("std_dev_var")
+        self.out_mean_file = self.output_path("mean")
+        self.out_std_dev_file = self.output_path("std_dev")
+        self.out_statistics = self.output_path("statistics.json")
+
+        self.rqmt = {"cpu": 1, "mem": 4, "time": 4}
+
+    def tasks(self):
+        yield Task("prepare", rqmt={"cpu": 1, "mem": 4, "time": 1})
+        yield Task("run", rqmt=self.rqmt, args=range(1, self.num_shards + 1))
+        yield Task("merge", mini_task=True)
+
+    def _run_worker(self, config_filename: str, *args: str):
+        worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset_statistics_worker.py")
+        cmd = [
+            util.get_returnn_python_exe(self.returnn_python_exe).get_path(),
+            worker,
+            config_filename,
+            "--returnn-root",
+            util.get_returnn_root(self.returnn_root).get_path(),
+            *args,
+        ]
+        print("$", " ".join(cmd))
+        subprocess.check_call(cmd)
+
+    def prepare(self):
+        """list the seqs and split them into shards"""
+        ReturnnConfig({"dataset": self.dataset}).write("all.config")
+        self._run_worker("all.config", "--list-tags", "all_tags.txt")
+        with open("all_tags.txt") as f:
+            tags = [line.strip() for line in f if line.strip()]
+        num_total_seqs = len(tags)
+        if self.seq_fraction < 1.0:
+            rnd = random.Random(self.random_seed)
+            selected = sorted(rnd.sample(range(num_total_seqs), max(int(round(num_total_seqs * self.seq_fraction)), 2)))
+            tags = [tags[i] for i in selected]
+        print(f"Num seqs: {len(tags)} of {num_total_seqs}")
+        assert len(tags) >= self.num_shards, f"only {len(tags)} seqs for {self.num_shards} shards"
+        with open("num_total_seqs.txt", "w") as f:
+            f.write(f"{num_total_seqs}\n")
+        for shard_idx in range(1, self.num_shards + 1):
+            with open(f"shard.{shard_idx}.segments", "w") as f:
+                # Interleaved, such that the shards have similar lengths (if the seqs are sorted somehow).
+                f.writelines(tag + "\n" for tag in tags[shard_idx - 1 :: self.num_shards])
+            ReturnnConfig(
+                {"dataset": {**self.dataset, "segment_file": os.path.abspath(f"shard.{shard_idx}.segments")}}
+            ).write(f"shard.{shard_idx}.config")
+
+    def run(self, shard_idx: int):
+        """compute the statistics for one shard"""
+        self._run_worker(f"shard.{shard_idx}.config", "--out-stats", f"shard.{shard_idx}.stats.npz")
+
+    def merge(self):
+        """combine the shards and write the outputs"""
+        import numpy
+
+        stats = None
+        for shard_idx in range(1, self.num_shards + 1):
+            with numpy.load(f"shard.{shard_idx}.stats.npz") as shard_stats:
+                shard_stats = dict(shard_stats)
+            stats = shard_stats if stats is None else combine_stats(stats, shard_stats)
+        with open("num_total_seqs.txt") as f:
+            num_total_seqs = int(f.read())
+
+        mean = stats["mean"]
+        var = stats["m2"] / stats["num_frames"]
+        std_dev = numpy.sqrt(var)
+        numpy.savetxt(self.out_mean_file.get_path(), mean)
+        numpy.savetxt(self.out_std_dev_file.get_path(), std_dev)
+        # Scalar statistics over all values, as in ExtractDatasetMeanStddevJob.
+        total_mean = float(numpy.mean(mean))
+        total_var = float(numpy.mean(var) + numpy.mean((mean - total_mean) ** 2))
+        self.out_mean.set(total_mean)
+        self.out_std_dev.set(float(numpy.sqrt(total_var)))
+
+        num_seqs = int(stats["num_seqs"])
+        res = {
+            "num_seqs": num_seqs,
+            "num_total_seqs": num_total_seqs,
+            "num_frames": int(stats["num_frames"]),
+            "mean": total_mean,
+            "std_dev": float(numpy.sqrt(total_var)),
+        }
+        if num_seqs < num_total_seqs:
+            mean_std_err = mean_standard_error(stats, num_total_seqs=num_total_seqs)
+            res["mean_std_err"] = mean_std_err.tolist()
+            res["mean_confidence_bound_95"] = (1.96 * mean_std_err).tolist()
+            # relative to the std-dev, i.e. the error after normalization
+            res["max_normalized_mean_confidence_bound_95"] = float(numpy.max(1.96 * mean_std_err / std_dev))
+        print(json.dumps(res, indent=2))
+        with open(self.out_statistics.get_path(), "w") as f:
+            json.dump(res, f, indent=2)
+            f.write("\n")
+
+
+def combine_stats(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Combines the statistics of two disjoint sets of seqs,
+    see :func:`dataset_statistics_worker.accumulate_seq`.
+    """
+    num_frames = a["num_frames"] + b["num_frames"]
+    delta = b["mean"] - a["mean"]
+    res = {
+        "num_frames": num_frames,
+        "mean": a["mean"] + delta * (b["num_frames"] / num_frames),
+        "m2": a["m2"] + b["m2"] + delta**2 * (a["num_frames"] * b["num_frames"] / num_frames),
+    }
+    for key in ["num_seqs", "sum_seq_len_sq", "sum_seq_sum_sq", "sum_seq_len_sum"]:
+        res[key] = a[key] + b[key]
+    return res
+
+
+def mean_standard_error(stats: Dict[str, Any], *, num_total_seqs: int):
+    """
+    Standard error of the mean per feature dim, when the seqs are a random sample (without replacement).
+    The mean is a ratio estimator (sum over frames / num frames, with random seqs),
+    so we use the variance of the ratio estimator: ``(1 - f) / (m (m - 1) nbar^2) sum_i (S_i - R n_i)^2``,
+    with m seqs, sample fraction f, seq lens n_i, seq sums S_i, mean R, and avg seq len nbar.
+    """
+    import numpy
+
+    m = stats["num_seqs"]
+    mean = stats["mean"]
+    residual_sq_sum = (
+        stats["sum_seq_sum_sq"] - 2 * mean * stats["sum_seq_len_sum"] + mean**2 * stats["sum_seq_len_sq"]
+    )
+    avg_seq_len = stats["num_frames"] / m
+    var = (1.0 - m / num_total_seqs) / (m * (m - 1) * avg_seq_len**2) * numpy.maximum(residual_sq_sum, 0.0)
+    return numpy.sqrt(var)
@@ -0,0 +1,103 @@
+"""
+Worker script for :class:`ExtractDatasetMeanStddevShardedJob`, running in the RETURNN Python environment
+(i.e. this does not import Sisyphus).
+
+Usage::
+
+    python3 dataset_statistics_worker.py <config> --returnn-root <dir> --list-tags <out.txt>
+    python3 dataset_statistics_worker.py <config> --returnn-root <dir> --out-stats <out.npz>
+
+The config contains the dataset opts in "dataset".
+"""
+
+import argparse
+import sys
+import time
+from typing import Dict
+
+
+def accumulate_seq(stats: Dict, x):
+    """
+    :param stats: running statistics, all in float64. modified in-place. keys:
+        num_frames, mean [D], m2 [D] (sum of squared deviations from the mean),
+        and for the standard error of the mean (see :func:`dataset_statistics.mean_standard_error`):
+        num_seqs, sum_seq_len_sq (sum_i n_i^2), sum_seq_sum_sq [D] (sum_i S_i^2), sum_seq_len_sum [D] (sum_i n_i S_i)
+    :param x: data of one seq, [T,D]
+    """
+    import numpy
+
+    x = numpy.asarray(x, dtype=numpy.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    seq_len = x.shape[0]
+    if seq_len == 0:
+        return
+    seq_sum = x.sum(axis=0)
+    seq_mean = seq_sum / seq_len
+    seq_m2 = ((x - seq_mean) ** 2).sum(axis=0)
+    if not stats:
+        stats.update(
+            num_frames=0.0,
+            mean=numpy.zeros_like(seq_mean),
+            m2=numpy.zeros_like(seq_mean),
+            num_seqs=0.0,
+            sum_seq_len_sq=0.0,
+            sum_seq_sum_sq=numpy.zeros_like(seq_mean),
+            sum_seq_len_sum=numpy.zeros_like(seq_mean),
+        )
+    # Parallel algorithm (Chan et al.), combining the running stats with this seq.
+    num_frames = stats["num_frames"] + seq_len
+    delta = seq_mean - stats["mean"]
+    stats["mean"] += delta * (seq_len / num_frames)
+    stats["m2"] += seq_m2 + delta**2 * (stats["num_frames"] * seq_len / num_frames)
+    stats["num_frames"] = num_frames
+    stats["num_seqs"] += 1
+    stats["sum_seq_len_sq"] += float(seq_len) ** 2
+    stats["sum_seq_sum_sq"] += seq_sum**2
+    stats["sum_seq_len_sum"] += seq_len * seq_sum
+
+
+def main():
+    """main"""
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("config")
+    arg_parser.add_argument("--returnn-root", required=True)
+    arg_parser.add_argument("--list-tags", help="write all seq tags to this file")
+    arg_parser.add_argument("--out-stats", help="write the statistics (npz) to this file")
+    arg_parser.add_argument("--data-key", default="data")
+    args = arg_parser.parse_args()
+    assert bool(args.list_tags) != bool(args.out_stats), "need either --list-tags or --out-stats"
+
+    sys.path.insert(0, args.returnn_root)
+    import numpy
+    from returnn.config import Config
+    from returnn.log import log
+    from returnn.datasets import init_dataset
+
+    log.initialize(verbosity=[3])
+    config = Config()
+    config.load_file(args.config)
+    dataset = init_dataset(config.typed_value("dataset"))
+    dataset.init_seq_order(epoch=1)
+
+    if args.list_tags:
+        with open(args.list_tags, "w") as f:
+            f.writelines(tag + "\n" for tag in dataset.get_all_tags())
+        return
+
+    stats = {}
+    start_time = time.time()
+    seq_idx = 0
+    while dataset.is_less_than_num_seqs(seq_idx):
+        dataset.load_seqs(seq_idx, seq_idx + 1)
+        accumulate_seq(stats, dataset.get_data(seq_idx, args.data_key))
+        seq_idx += 1
+        if seq_idx % 1000 == 0:
+            print(f"{seq_idx} seqs, {time.time() - start_time:.1f} secs", flush=True)
+    assert stats, "no data"
+    print(f"Done. {seq_idx} seqs, {int(stats['num_frames'])} frames, {time.time() - start_time:.1f} secs")
+    numpy.savez(args.out_stats, **stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,8 @@ from i6_experiments.common.utils.dump_py_code import PythonCodeDumper
 from i6_experiments.common.utils.diff import collect_diffs
 import os
 import sys
+import time
+import pickle
 import textwrap
 import importlib.util
 
@@ -34,7 +36,13 @@ T = TypeVar("T")
 
 
 # noinspection PyShadowingBuiltins
-def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
+def dependency_boundary(
+    func: Callable[[], T],
+    *,
+    hash: Optional[str],
+    fast_cache: bool = False,
+    paths_check_interval: float = 24 * 60 * 60,
+) -> T:
     """
     It basically returns func(), or some object which has the same hash.
 
@@ -44,6 +52,14 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
     :param hash: sisyphus.hash.short_hash(func()), or None if you do not know this value yet.
         This value is used to verify the hash of the object.
         For new code when the hash is not known yet, you would pass None here, and it will print the hash on stdout.
+    :param fast_cache: if True, additionally store the verified cached object in a binary (pickle) file
+        next to the Python cache file, see :func:`load_obj_from_fast_cache_file`.
+        When the user hash and the Python cache file did not change, this is used directly,
+        without executing the Python cache file and without recomputing the hash.
+        Also, the paths are checked in parallel, and only once per ``paths_check_interval``.
+        The Python cache file stays the source of truth, and the binary file is not meant to be committed.
+    :param paths_check_interval: in seconds, only with ``fast_cache``.
+        If all paths were available at most that long ago, we do not check them again.
     :return: func(), or object with same hash
     """
     hash_via_user = hash
@@ -52,11 +68,29 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
     cached_paths_available = False
 
     cache_fn = get_cache_filename_for_func(func)
+    if fast_cache and hash_via_user and os.path.exists(cache_fn):
+        try:
+            obj_via_cache = load_obj_from_fast_cache_file(cache_fn, hash=hash_via_user)
+            if obj_via_cache is not None and _fast_cache_paths_available(
+                func, obj_via_cache, cache_filename=cache_fn, check_interval=paths_check_interval
+            ):
+                print(
+                    f"Dependency boundary for {func.__qualname__}: using fast cached object with hash {hash_via_user}"
+                )
+                return obj_via_cache
+        except Exception as exc:
+            print(
+                f"Dependency boundary for {func.__qualname__}:"
+                f" error, exception {type(exc).__name__} {str(exc)!r} while loading the fast cache,"
+                " will ignore the fast cache"
+            )
+        obj_via_cache = None
+
     if os.path.exists(cache_fn):
         try:
             obj_via_cache = load_obj_from_cache_file(cache_fn)
             hash_via_cache = short_hash(obj_via_cache)
-            cached_paths_available = _paths_available(func, obj_via_cache)
+            cached_paths_available = _paths_available(func, obj_via_cache, parallel=fast_cache)
         except Exception as exc:
             print(
                 f"Dependency boundary for {func.__qualname__}:"
@@ -69,6 +103,15 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
 
     if hash_via_user and hash_via_cache and hash_via_user == hash_via_cache and cached_paths_available:
         print(f"Dependency boundary for {func.__qualname__}: using cached object with hash {hash_via_user}")
+        if fast_cache:
+            try:
+                save_obj_to_fast_cache_file(obj_via_cache, cache_filename=cache_fn, hash=hash_via_user)
+                _touch_paths_stamp(cache_fn)
+            except Exception as exc:
+                print(
+                    f"Dependency boundary for {func.__qualname__}:"
+                    f" error, exception {type(exc).__name__} {str(exc)!r} while saving the fast cache"
+                )
         return obj_via_cache
 
     # Either user hash invalid, or cached hash invalid, or not all paths are available, or user hash not defined.
@@ -164,13 +207,103 @@ def load_obj_from_cache_file(cache_filename: str) -> Any:
     return obj
 
 
-def _paths_available(func, obj: Any) -> bool:
+def get_fast_cache_filename(cache_filename: str) -> str:
+    """
+    :param cache_filename: Python cache file, via :func:`get_cache_filename_for_func`
+    :return: filename of the binary cache file
     """
+    assert cache_filename.endswith(".py")
+    return cache_filename[: -len(".py")] + ".pkl"
+
+
+# noinspection PyShadowingBuiltins
+def save_obj_to_fast_cache_file(obj: Any, *, cache_filename: str, hash: str) -> None:
+    """
+    Save object in binary form. Should be the object as loaded from the Python cache file,
+    where the hash was verified.
+
+    :param obj:
+    :param cache_filename: Python cache file. the binary file is stored next to it
+    :param hash: short_hash(obj), as given by the user
+    """
+    py_stat = os.stat(cache_filename)
+    fast_cache_fn = get_fast_cache_filename(cache_filename)
+    tmp_fn = f"{fast_cache_fn}.tmp{os.getpid()}"
+    with open(tmp_fn, "wb") as f:
+        pickle.dump(
+            {
+                "version": _FastCacheVersion,
+                "hash": hash,
+                "py_stat": (py_stat.st_mtime_ns, py_stat.st_size),
+                "obj": obj,
+            },
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(tmp_fn, fast_cache_fn)  # atomic, in case of parallel managers
+
+
+# noinspection PyShadowingBuiltins
+def load_obj_from_fast_cache_file(cache_filename: str, *, hash: str) -> Optional[Any]:
+    """
+    :param cache_filename: Python cache file
+    :param hash: user hash
+    :return: previously saved object, or None if there is no valid binary cache
+        (does not exist, or stored for another user hash, or the Python cache file changed since then)
+    """
+    fast_cache_fn = get_fast_cache_filename(cache_filename)
+    if not os.path.exists(fast_cache_fn):
+        return None
+    with open(fast_cache_fn, "rb") as f:
+        d = pickle.load(f)
+    if d.get("version") != _FastCacheVersion or d["hash"] != hash:
+        return None
+    py_stat = os.stat(cache_filename)
+    if tuple(d["py_stat"]) != (py_stat.st_mtime_ns, py_stat.st_size):
+        return None
+    return d["obj"]
+
+
+_FastCacheVersion = 1
+
+
+def _fast_cache_paths_available(func, obj: Any, *, cache_filename: str, check_interval: float) -> bool:
+    """
+    :return: True if all paths in obj are available, maybe just trusting the stamp file of the last check
+    """
+    stamp_fn = get_fast_cache_filename(cache_filename) + ".paths_available"
+    if os.path.exists(stamp_fn) and time.time() - os.stat(stamp_fn).st_mtime < check_interval:
+        return True
+    if not _paths_available(func, obj, parallel=True):
+        return False
+    _touch_paths_stamp(cache_filename)
+    return True
+
+
+def _touch_paths_stamp(cache_filename: str):
+    stamp_fn = get_fast_cache_filename(cache_filename) + ".paths_available"
+    with open(stamp_fn, "a"):
+        pass
+    os.utime(stamp_fn)
+
+
+def _paths_available(func, obj: Any, *, parallel: bool = False) -> bool:
+    """
+    :param func:
+    :param obj:
+    :param parallel: check the paths in parallel threads. this helps on slow (network) file systems
     :return: True if all paths in obj are available
     """
-    paths = extract_paths(obj)
-    for path in paths:
-        if not path.available():
+    paths = list(extract_paths(obj))
+    if parallel:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            available = list(executor.map(lambda path: path.available(), paths))
+    else:
+        available = (path.available() for path in paths)  # lazy, to stop at the first unavailable path
+    for path, path_available in zip(paths, available):
+        if not path_available:
             print(f"Dependency boundary for {func.__qualname__}: path {path} in cached object not available")
             # No need to print this for all paths, just the first one is enough.
             return False
@@ -0,0 +1,212 @@
+"""
+Parsing of the search statistics (timings, search space statistics, evaluation) from RASR search logs,
+shared by the ``ExtractSearchStatisticsJob`` implementations.
+"""
+
+__all__ = ["SearchLogStatistics", "average_ss_statistics", "parse_search_log", "parse_search_logs"]
+
+import collections
+from dataclasses import dataclass, field
+import gzip
+import multiprocessing
+import typing
+import xml.etree.ElementTree as ET
+
+AM_COMPONENT = "flf-lattice-tool.network.recognizer.acoustic-model.mixture-set"
+TF_FWD_COMPONENT = "flf-lattice-tool.network.recognizer.feature-extraction.tf-fwd"
+
+
+@dataclass
+class SearchLogStatistics:
+    """Statistics extracted from one or more RASR search logs, summed over all logs."""
+
+    hosts: typing.List[str] = field(default_factory=list)
+
+    elapsed: float = 0.0
+    user: float = 0.0
+    system: float = 0.0
+
+    frames: int = 0
+    word_ends: float = 0.0
+    """Avg number of word ends after pruning, weighted by the number of frames."""
+    trees: float = 0.0
+    """Avg number of trees after pruning, weighted by the number of frames."""
+    states: float = 0.0
+    """Avg number of states after pruning, weighted by the number of frames."""
+
+    recognizer_time: float = 0.0
+    rescoring_time: float = 0.0
+    lm_time: float = 0.0
+    am_time: float = 0.0
+
+    seq_ss_statistics: typing.Dict[str, typing.Dict[str, typing.Any]] = field(default_factory=dict)
+    eval_statistics: typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]] = field(default_factory=dict)
+
+    def merge(self, other: "SearchLogStatistics"):
+        self.hosts += other.hosts
+        for attr in [
+            "elapsed",
+            "user",
+            "system",
+            "frames",
+            "word_ends",
+            "trees",
+            "states",
+            "recognizer_time",
+            "rescoring_time",
+            "lm_time",
+            "am_time",
+        ]:
+            setattr(self, attr, getattr(self, attr) + getattr(other, attr))
+        self.seq_ss_statistics.update(other.seq_ss_statistics)
+        self.eval_statistics.update(other.eval_statistics)
+
+
+def _process_segment(seg: ET.Element, stats: SearchLogStatistics):
+    for layer in seg.findall('./layer[@name="recognizer"]'):
+        frames = int(layer.findall('./statistics/frames[@port="features"]')[0].attrib["number"])
+        stats.frames += frames
+        stats.word_ends += frames * float(
+            layer.findall('./search-space-statistics/statistic[@name="ending words after pruning"]/avg')[0].text
+        )
+        stats.trees += frames * float(
+            layer.findall('./search-space-statistics/statistic[@name="trees after  pruning"]/avg')[0].text
+        )
+        stats.states += frames * float(
+            layer.findall('./search-space-statistics/statistic[@name="states after pruning"]/avg')[0].text
+        )
+
+        stats.recognizer_time += float(layer.findall("./flf-recognizer-time")[0].text)
+
+        am_info = layer.find(f'./information[@component="{AM_COMPONENT}"]')
+        if am_info is not None:
+            stats.am_time += float(am_info.text.lstrip().split(" ")[3])
+
+    for rescore in seg.findall("./flf-push-forward-rescoring-time"):
+        stats.rescoring_time += float(rescore.text)
+
+    seg_stats = {}
+    full_name = seg.attrib["full-name"]
+    for sss in seg.findall('./layer[@name="recognizer"]/search-space-statistics/statistic[@type="scalar"]'):
+        min_val = float(sss.findtext("./min", default="0"))
+        avg_val = float(sss.findtext("./avg", default="0"))
+        max_val = float(sss.findtext("./max", default="0"))
+        seg_stats[sss.attrib["name"]] = (min_val, avg_val, max_val)
+    stats.seq_ss_statistics[full_name] = seg_stats
+
+    features = seg.find('./layer[@name="recognizer"]/statistics/frames[@port="features"]')
+    seg_stats["frames"] = int(features.attrib["number"])
+
+    tf_fwd = seg.find(f'./layer[@name="recognizer"]/information[@component="{TF_FWD_COMPONENT}"]')
+    seg_stats["tf_fwd"] = float(tf_fwd.text.strip().split()[-1]) if tf_fwd is not None else 0.0
+
+    stats.eval_statistics[full_name] = {}
+    for evaluation in seg.findall(".//evaluation"):
+        stat_name = evaluation.attrib["name"]
+        alignment = evaluation.find('statistic[@type="alignment"]')
+        stats.eval_statistics[full_name][stat_name] = {
+            "errors": int(alignment.findtext("edit-operations")),
+            "ref-tokens": int(alignment.findtext('count[@event="token"][@source="reference"]')),
+            "score": float(alignment.findtext('score[@source="best"]')),
+        }
+
+
+def parse_search_log(path: str) -> SearchLogStatistics:
+    """
+    Extracts the search statistics from a gzipped RASR search log in a single streaming pass.
+
+    Every segment is processed as soon as it has been parsed completely and is then removed from
+    the tree, as is everything outside of segments, so memory usage does not grow with the log size.
+    """
+
+    stats = SearchLogStatistics()
+    host = None
+    timers = {}
+
+    stack = []
+    # depth of elements whose children are needed when the element itself has been parsed completely
+    container_depth = 0
+    containers = ["segment", "fwd-summary"]
+
+    with gzip.open(path, "rb") as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                if elem.tag in containers:
+                    container_depth += 1
+                continue
+
+            stack.pop()
+            parent = stack[-1] if len(stack) > 0 else None
+
+            if elem.tag in containers:
+                container_depth -= 1
+            if elem.tag == "segment":
+                _process_segment(elem, stats)
+            elif elem.tag == "fwd-summary":
+                for lm_total in elem.findall("./total-run-time"):
+                    stats.lm_time += float(lm_total.text)
+            elif container_depth > 0:
+                # keep the contents until the enclosing container has been parsed completely
+                continue
+            elif len(stack) == 2 and stack[1].tag == "system-information" and elem.tag == "name":
+                host = host if host is not None else elem.text
+            elif len(stack) == 2 and stack[1].tag == "timer" and elem.tag in ["elapsed", "user", "system"]:
+                timers.setdefault(elem.tag, float(elem.text))
+
+            if parent is not None and container_depth == 0:
+                parent.remove(elem)
+
+    stats.hosts.append(host)
+    stats.elapsed = timers["elapsed"]
+    stats.user = timers["user"]
+    stats.system = timers["system"]
+
+    return stats
+
+
+def parse_search_logs(paths: typing.List[str], num_processes: int = 1) -> SearchLogStatistics:
+    """
+    Parses the given search logs in parallel and sums up their statistics.
+
+    The result is independent of the number of processes, logs are merged in the given order.
+    """
+
+    assert num_processes > 0
+
+    if num_processes == 1 or len(paths) <= 1:
+        results = [parse_search_log(path) for path in paths]
+    else:
+        with multiprocessing.Pool(min(num_processes, len(paths))) as pool:
+            results = pool.map(parse_search_log, paths, chunksize=1)
+
+    stats = SearchLogStatistics()
+    for result in results:
+        stats.merge(result)
+    return stats
+
+
+def average_ss_statistics(
+    seq_ss_statistics: typing.Dict[str, typing.Dict[str, typing.Any]], corpus_duration_hours: float
+) -> typing.Dict[str, float]:
+    """Averages the per segment search space statistics over all frames, tf_fwd is normalized to an RTF."""
+
+    ss_statistics = collections.defaultdict(lambda: (0.0, 0))
+    for s in seq_ss_statistics.values():
+        frames = s["frames"]
+        for stat, val in s.items():
+            if stat == "frames":
+                pass
+            elif stat == "tf_fwd":
+                prev_count, prev_frames = ss_statistics[stat]
+                ss_statistics[stat] = (
+                    prev_count + val,
+                    (3600.0 * 1000.0 * corpus_duration_hours),
+                )
+            else:
+                prev_count, prev_frames = ss_statistics[stat]
+                ss_statistics[stat] = (
+                    prev_count + val[1] * frames,
+                    prev_frames + frames,
+                )
+    return {s: count / frames for s, (count, frames) in ss_statistics.items()}
@@ -8,6 +8,8 @@ from typing import *
 from i6_core.returnn import ReturnnConfig
 from i6_core.returnn.dataset import ExtractDatasetMeanStddevJob
 
+from i6_experiments.common.helpers.dataset_statistics import ExtractDatasetMeanStddevShardedJob
+
 from .base import Datastream
 from ..datasets.audio import OggZipDataset
 
@@ -182,6 +184,8 @@ class AudioFeatureDatastream(Datastream):
         returnn_python_exe: Optional[tk.Path] = None,
         returnn_root: Optional[tk.Path] = None,
         alias_path: str = "",
+        num_shards: Optional[int] = None,
+        seq_fraction: float = 1.0,
     ):
         """
         Computes the global feature statistics over a corpus given as zip-dataset.
@@ -194,6 +198,9 @@ class AudioFeatureDatastream(Datastream):
         :param returnn_python_exe:
         :param returnn_root:
         :param alias_path: sets alias folder for ExtractDatasetStatisticsJob
+        :param num_shards: if set, use :class:`ExtractDatasetMeanStddevShardedJob` with this many parallel tasks
+        :param seq_fraction: if < 1, estimate the statistics only on this random fraction of the seqs,
+            via :class:`ExtractDatasetMeanStddevShardedJob`
         :return: audio datastream with added global feature statistics
         :rtype: AudioFeatureDatastream
         """
@@ -204,10 +211,19 @@ class AudioFeatureDatastream(Datastream):
             target_options=None,
         )
 
-        extraction_config = ReturnnConfig(config={"train": extraction_dataset.as_returnn_opts()})
-        extract_dataset_statistics_job = ExtractDatasetMeanStddevJob(
-            extraction_config, returnn_python_exe=returnn_python_exe, returnn_root=returnn_root
-        )
+        if num_shards is not None or seq_fraction < 1.0:
+            extract_dataset_statistics_job = ExtractDatasetMeanStddevShardedJob(
+                extraction_dataset.as_returnn_opts(),
+                num_shards=num_shards or 1,
+                seq_fraction=seq_fraction,
+                returnn_python_exe=returnn_python_exe,
+                returnn_root=returnn_root,
+            )
+        else:
+            extraction_config = ReturnnConfig(config={"train": extraction_dataset.as_returnn_opts()})
+            extract_dataset_statistics_job = ExtractDatasetMeanStddevJob(
+                extraction_config, returnn_python_exe=returnn_python_exe, returnn_root=returnn_root
+            )
         extract_dataset_statistics_job.add_alias(os.path.join(alias_path, "extract_dataset_statistics_job"))
         if use_scalar_only:
             self.additional_options["norm_mean"] = extract_dataset_statistics_job.out_mean
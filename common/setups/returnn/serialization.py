@@ -10,10 +10,6 @@ from copy import deepcopy
 from types import FunctionType
 from i6_core.returnn.config import ReturnnConfig
 
-# The code here does not need the user to use returnn_common.
-# However, we internally make use of some helper code from returnn_common.
-from returnn_common.nn.naming import ReturnnDimTagsProxy
-
 from .. import serialization as base_serialization
 
 
@@ -36,6 +32,11 @@ def get_serializable_config(
         otherwise it uses only the module name and function qualname for the hash of functions
     :return: either config itself if no change needed, or otherwise new adapted config
     """
+    # The code here does not need the user to use returnn_common.
+    # However, we internally make use of some helper code from returnn_common.
+    # Imported here, as it is slow to import (via RETURNN TF code).
+    from returnn_common.nn.naming import ReturnnDimTagsProxy
+
     config = deepcopy(config)
 
     # Collect taken Python variable names (or function names).
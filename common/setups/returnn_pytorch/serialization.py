@@ -4,13 +4,12 @@ import os
 import pathlib
 import shutil
 import string
+import sys
 import textwrap
-from collections import OrderedDict
 from dataclasses import fields
 from inspect import isfunction
 from typing import Any, Dict, List, Optional, Set, Tuple, Union, TYPE_CHECKING
 
-import torch
 from i6_core.util import instanciate_delayed
 from sisyphus import gs, tk
 from sisyphus.delayed_ops import DelayedBase
@@ -19,7 +18,8 @@ from sisyphus.hash import sis_hash_helper
 if TYPE_CHECKING:
     from i6_models.config import ModelConfiguration
 
-from ..serialization import Call, Import, SerializerObject
+from ..serialization import Call, Import, SerializerObject, SisHashMemoMixin
+from ..serialization import get_sis_hash_fingerprint, intern_import, memoize_sis_hash
 
 
 class PyTorchModel(SerializerObject):
@@ -73,7 +73,7 @@ class PyTorchModel(SerializerObject):
         return sis_hash_helper(h)
 
 
-class Collection(DelayedBase):
+class Collection(SisHashMemoMixin, DelayedBase):
     """
     A helper class to serialize a RETURNN config with returnn_common elements.
     Should be passed to either `returnn_prolog` or `returnn_epilog` in a `ReturnnConfig`
@@ -139,6 +139,10 @@ class Collection(DelayedBase):
         content += [obj.get() for obj in self.serializer_objects]
         return "".join(content)
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return get_sis_hash_fingerprint(self.serializer_objects, [obj.use_for_hash for obj in self.serializer_objects])
+
+    @memoize_sis_hash
     def _sis_hash(self) -> bytes:
         h = {
             "delayed_objects": [obj for obj in self.serializer_objects if obj.use_for_hash],
@@ -165,7 +169,7 @@ def build_config_constructor_serializers(
 
     # Import the class of <cfg>
     imports = [
-        Import(
+        intern_import(
             code_object_path=f"{type(cfg).__module__}.{type(cfg).__name__}", unhashed_package_root=unhashed_package_root
         )
     ]
@@ -194,13 +198,13 @@ def build_config_constructor_serializers(
             subcall, subimports = build_config_constructor_serializers(value.cfg)
             imports += subimports
             imports.append(
-                Import(
+                intern_import(
                     code_object_path=f"{value.module_class.__module__}.{value.module_class.__name__}",
                     unhashed_package_root=unhashed_package_root,
                 )
             )
             imports.append(
-                Import(
+                intern_import(
                     code_object_path=f"{ModuleFactoryV1.__module__}.{ModuleFactoryV1.__name__}",
                     unhashed_package_root=unhashed_package_root,
                 )
@@ -214,14 +218,14 @@ def build_config_constructor_serializers(
                     ),
                 )
             )
-        elif isinstance(value, torch.nn.Module):
+        elif _is_torch_module(value):
             # Example:
             # ConformerConvolutionConfig(norm=BatchNorm1d(...))
             # -> Import class BatchNorm1d
             # -> Sub-serialization of BatchNorm1d object.
             #       The __str__ function of torch.nn.Module already does this in the way we want.
             imports.append(
-                Import(
+                intern_import(
                     code_object_path=f"{value.__module__}.{type(value).__name__}",
                     unhashed_package_root=unhashed_package_root,
                 )
@@ -234,7 +238,7 @@ def build_config_constructor_serializers(
             # Builtins (e.g. 'sum') do not need to be imported
             if value.__module__ != "builtins":
                 imports.append(
-                    Import(
+                    intern_import(
                         code_object_path=f"{value.__module__}.{value.__name__}",
                         unhashed_package_root=unhashed_package_root,
                     )
@@ -248,6 +252,16 @@ def build_config_constructor_serializers(
             # -> Just get string representation
             call_kwargs.append((key.name, str(value)))
 
-    imports = list(OrderedDict.fromkeys(imports))  # remove duplications
+    # Note: We used to remove duplicates here, but as Import does not define __eq__, there never were any.
+    # Keep the duplicates, as the (interned) imports are identical objects now, and removing them would change the hash.
 
     return Call(callable_name=type(cfg).__name__, kwargs=call_kwargs, return_assign_variables=variable_name), imports
+
+
+def _is_torch_module(value: Any) -> bool:
+    """
+    Avoids importing torch (slow) in the Sisyphus manager:
+    if torch was not imported yet, value cannot be a torch module.
+    """
+    torch = sys.modules.get("torch")
+    return torch is not None and isinstance(value, torch.nn.Module)
@@ -4,11 +4,15 @@ Helper code for serializing any data, e.g. for ReturnnConfig.
 
 from __future__ import annotations
 
+import dataclasses
+import enum
+import functools
+import operator
 import string
 import sys
 import textwrap
-from types import FunctionType
-from typing import Any, Dict, List, Optional, Tuple, Union
+from types import BuiltinFunctionType, FunctionType
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from i6_core.util import uopen, instanciate_delayed
 from sisyphus import tk
@@ -17,7 +21,133 @@ from sisyphus.hash import short_hash, sis_hash_helper
 from sisyphus.tools import try_get
 
 
-class SerializerObject(DelayedBase):
+# Set to False to disable the memoization of the hashes, e.g. for benchmarking.
+SisHashMemoEnabled = True
+
+
+def memoize_sis_hash(func: Callable[[Any], bytes]) -> Callable[[Any], bytes]:
+    """
+    Decorator for ``_sis_hash`` of :class:`SisHashMemoMixin` objects.
+
+    Big configs are hashed many times during graph construction,
+    and in sweeps, the same serializer objects are shared by many configs.
+    So we store the hash after the first computation, together with the fingerprint
+    (:func:`SisHashMemoMixin._sis_hash_fingerprint`), i.e. all objects which determine the hash.
+    The stored hash is used as long as the fingerprint consists of the identical objects,
+    so any modification (attribute assignment or in-place, also of some sub object) invalidates it.
+    """
+
+    @functools.wraps(func)
+    def _sis_hash(self: SisHashMemoMixin) -> bytes:
+        fingerprint = self._sis_hash_fingerprint() if SisHashMemoEnabled else None
+        if fingerprint is None:
+            return func(self)
+        memo = self.__dict__.get("_sis_hash_memo")  # func qualname -> (fingerprint, hash)
+        entry = memo.get(func.__qualname__) if memo else None
+        if entry is not None and len(entry[0]) == len(fingerprint) and all(map(operator.is_, entry[0], fingerprint)):
+            return entry[1]
+        res = func(self)
+        # Directly via __dict__, as this is not part of the state.
+        self.__dict__.setdefault("_sis_hash_memo", {})[func.__qualname__] = (fingerprint, res)
+        return res
+
+    _sis_hash.sis_hash_memoized = True
+    return _sis_hash
+
+
+class SisHashMemoMixin:
+    """
+    Support for :func:`memoize_sis_hash`.
+    """
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_sis_hash_memo", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        """
+        :return: all objects which determine the hash, where any modification would result in a different object,
+            e.g. the attribute values, and for lists also their items.
+            Or None if this is not known, then the hash is not memoized.
+            Use :func:`get_sis_hash_fingerprint`.
+        """
+        return None
+
+
+def _collect_sis_hash_fingerprint(obj: Any, out: List[Any]) -> bool:
+    """
+    Adds obj to the fingerprint, or for containers, frozen dataclasses and serializer objects, all sub objects.
+    Other objects are only accepted if they are known to be immutable (see :data:`_ImmutableFingerprintTypes`),
+    as any other object (e.g. a non-frozen dataclass or a set) could be modified in-place without notice.
+
+    :param obj:
+    :param out: fingerprint, see :func:`SisHashMemoMixin._sis_hash_fingerprint`
+    :return: False if the fingerprint cannot be determined (so the hash should not be memoized)
+    """
+    if isinstance(obj, SisHashMemoMixin):
+        # If the class overwrites _sis_hash without memoization, we don't know the fingerprint.
+        if not getattr(type(obj)._sis_hash, "sis_hash_memoized", False):
+            return False
+        sub = obj._sis_hash_fingerprint()
+        if sub is None:
+            return False
+        out.append(obj)
+        out.extend(sub)
+    elif isinstance(obj, (list, tuple, dict)):
+        # Only the content matters for the hash, not the container object itself.
+        out.append(type(obj))
+        for v in obj.items() if isinstance(obj, dict) else obj:
+            if not _collect_sis_hash_fingerprint(v, out):
+                return False
+        out.append(_FingerprintContainerEnd)
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type) and obj.__dataclass_params__.frozen:
+        # The fields cannot be reassigned, but they might be mutable themselves.
+        out.append(obj)
+        for field in dataclasses.fields(obj):
+            if not _collect_sis_hash_fingerprint(getattr(obj, field.name), out):
+                return False
+        out.append(_FingerprintContainerEnd)
+    elif isinstance(obj, _ImmutableFingerprintTypes):
+        out.append(obj)  # also keeps the obj alive, so that its id is not reused
+    else:
+        return False
+    return True
+
+
+_FingerprintContainerEnd = object()
+
+# Objects of these types are assumed to be not modified in-place.
+_ImmutableFingerprintTypes = (
+    str,
+    bytes,
+    int,
+    float,
+    complex,
+    type(None),
+    type,
+    FunctionType,
+    BuiltinFunctionType,
+    enum.Enum,
+    tk.Path,
+)
+
+
+def get_sis_hash_fingerprint(*objs: Any) -> Optional[List[Any]]:
+    """
+    :return: fingerprint of all objs, see :func:`SisHashMemoMixin._sis_hash_fingerprint`
+    """
+    out = []
+    for obj in objs:
+        if not _collect_sis_hash_fingerprint(obj, out):
+            return None
+    return out
+
+
+class SerializerObject(SisHashMemoMixin, DelayedBase):
     """
     Base class for objects that can be passed to :class:`Collection` or :class:`returnn_common.Collection`.
     """
@@ -33,7 +163,7 @@ class SerializerObject(DelayedBase):
         raise NotImplementedError
 
 
-class Collection(DelayedBase):
+class Collection(SisHashMemoMixin, DelayedBase):
     """
     Collection of a list of :class:`SerializerObject`
     """
@@ -54,6 +184,10 @@ class Collection(DelayedBase):
         content = [obj.get() for obj in self.serializer_objects]
         return "".join(content)
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return get_sis_hash_fingerprint(self.serializer_objects, [obj.use_for_hash for obj in self.serializer_objects])
+
+    @memoize_sis_hash
     def _sis_hash(self) -> bytes:
         h = {
             "delayed_objects": [obj for obj in self.serializer_objects if obj.use_for_hash],
@@ -124,6 +258,10 @@ class Import(SerializerObject):
             return f"from {self.module} import {self.object_name} as {self.import_as}\n"
         return f"from {self.module} import {self.object_name}\n"
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return [self.code_object, self.import_as, self.ignore_import_as_for_hash]
+
+    @memoize_sis_hash
     def _sis_hash(self):
         if self.import_as and not self.ignore_import_as_for_hash:
             return sis_hash_helper({"code_object": self.code_object, "import_as": self.import_as})
@@ -135,6 +273,36 @@ class Import(SerializerObject):
         return hash(self.code_object)
 
 
+def intern_import(
+    code_object_path: str,
+    *,
+    unhashed_package_root: Optional[str] = None,
+    import_as: Optional[str] = None,
+    use_for_hash: bool = True,
+    ignore_import_as_for_hash: bool = False,
+) -> Import:
+    """
+    Like :class:`Import`, but returns the same (shared) object for the same arguments,
+    such that the hash is only computed once (see :func:`memoize_sis_hash`), even across many configs.
+    The returned object must not be modified.
+    """
+    key = (code_object_path, unhashed_package_root, import_as, use_for_hash, ignore_import_as_for_hash)
+    obj = _interned_imports.get(key)
+    if obj is None:
+        obj = Import(
+            code_object_path,
+            unhashed_package_root=unhashed_package_root,
+            import_as=import_as,
+            use_for_hash=use_for_hash,
+            ignore_import_as_for_hash=ignore_import_as_for_hash,
+        )
+        _interned_imports[key] = obj
+    return obj
+
+
+_interned_imports: Dict[Tuple[str, Optional[str], Optional[str], bool, bool], Import] = {}
+
+
 class PartialImport(Import):
     """
     Like Import, but for partial callables where certain parameters are given fixed and are hashed.
@@ -198,6 +366,10 @@ class PartialImport(Import):
             }
         )
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return get_sis_hash_fingerprint(super()._sis_hash_fingerprint(), self.hashed_arguments)
+
+    @memoize_sis_hash
     def _sis_hash(self):
         super_hash = super()._sis_hash()
         return sis_hash_helper({"import": super_hash, "hashed_arguments": self.hashed_arguments})
@@ -217,6 +389,10 @@ class ExternalImport(SerializerObject):
     def get(self) -> str:
         return f'sys.path.insert(0, "{self.import_path.get()}")\n'
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return [self.import_path]
+
+    @memoize_sis_hash
     def _sis_hash(self):
         return sis_hash_helper(self.import_path)
 
@@ -261,6 +437,10 @@ class CodeFromFunction(SerializerObject):
         """get"""
         return self._code
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return [self.name, self.func, self._func_code, self.hash_full_python_code]
+
+    @memoize_sis_hash
     def _sis_hash(self):
         if self.hash_full_python_code:
             return sis_hash_helper((self.name, self._func_code))
@@ -350,6 +530,10 @@ class ExplicitHash(SerializerObject):
         """get"""
         return ""
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return get_sis_hash_fingerprint(self.hash)
+
+    @memoize_sis_hash
     def _sis_hash(self):
         return sis_hash_helper(self.hash)
 
@@ -399,6 +583,10 @@ class Call(SerializerObject):
         # full call
         return f"{return_assign_str}{self.callable_name}({', '.join(kwargs_str_list)})\n"
 
+    def _sis_hash_fingerprint(self) -> Optional[List[Any]]:
+        return get_sis_hash_fingerprint(self.callable_name, self.kwargs, self.return_assign_variables)
+
+    @memoize_sis_hash
     def _sis_hash(self):
         h = {
             "callable_name": self.callable_name,
@@ -0,0 +1,144 @@
+"""
+Test for serialization, and a benchmark for the hash memoization
+"""
+
+from __future__ import annotations
+import dataclasses
+import time
+from typing import List
+from sisyphus.hash import sis_hash_helper
+from . import serialization
+from .serialization import Call, Collection, ExplicitHash, Import, PartialImport, SerializerObject, intern_import
+
+
+def _make_call_tree(depth: int, width: int, name: str = "cfg") -> Call:
+    if depth == 0:
+        return Call(callable_name=f"Leaf{name}", kwargs=[("dim", "512"), ("dropout", "0.1")])
+    return Call(
+        callable_name=f"Config{name}",
+        kwargs=[(f"sub{i}", _make_call_tree(depth - 1, width, f"{name}_{i}")) for i in range(width)],
+        return_assign_variables=name if depth == 3 else None,
+    )
+
+
+def _hash_without_memo(obj) -> bytes:
+    serialization.SisHashMemoEnabled = False
+    try:
+        return sis_hash_helper(obj)
+    finally:
+        serialization.SisHashMemoEnabled = True
+
+
+def test_memoized_sis_hash_invalidation():
+    call = _make_call_tree(depth=2, width=2)
+    partial_import = PartialImport(
+        code_object_path="i6_experiments.some.func",
+        unhashed_package_root="i6_experiments",
+        hashed_arguments={"opts": [1, 2]},
+        unhashed_arguments={},
+    )
+    collection = Collection([intern_import("i6_experiments.some.Model"), call, partial_import])
+
+    def _check() -> bytes:
+        h = sis_hash_helper(collection)
+        assert h == _hash_without_memo(collection)
+        assert sis_hash_helper(collection) == h  # now via memo
+        return h
+
+    hashes = {_check()}
+    call.kwargs.append(("extra", "1"))  # in-place
+    hashes.add(_check())
+    call.kwargs[0][1].callable_name = "Other"  # attrib of sub object
+    hashes.add(_check())
+    partial_import.hashed_arguments["opts"].append(3)  # in-place in sub object
+    hashes.add(_check())
+    collection.serializer_objects.append(ExplicitHash("v2"))
+    hashes.add(_check())
+    assert len(hashes) == 5
+
+
+def test_memoized_sis_hash_custom_subclass():
+    class _Custom(SerializerObject):
+        def __init__(self, value: List[int]):
+            super().__init__()
+            self.value = value
+
+        def get(self) -> str:
+            return ""
+
+        def _sis_hash(self):
+            return sis_hash_helper(self.value)
+
+    custom = _Custom([1])
+    collection = Collection([Import("i6_experiments.some.Model"), custom])
+    h = sis_hash_helper(collection)
+    custom.value.append(2)  # unknown fingerprint, so the collection must not use the memo
+    assert sis_hash_helper(collection) != h
+
+
+@dataclasses.dataclass
+class _ModelConfig:
+    dim: int
+    layers: List[int]
+
+
+@dataclasses.dataclass(frozen=True)
+class _FrozenModelConfig:
+    dim: int
+    layers: List[int]
+
+
+def test_memoized_sis_hash_mutable_leaves():
+    model_config = _ModelConfig(dim=512, layers=[1, 2])
+    frozen_model_config = _FrozenModelConfig(dim=512, layers=[1, 2])
+    partial_import = PartialImport(
+        code_object_path="i6_experiments.some.func",
+        unhashed_package_root="i6_experiments",
+        hashed_arguments={"model_config": model_config, "frozen": frozen_model_config, "tags": {"a"}},
+        unhashed_arguments={},
+    )
+    assert partial_import._sis_hash_fingerprint() is None  # non-frozen dataclass and set are not accepted
+    h = sis_hash_helper(partial_import)
+    model_config.dim = 1024  # in-place
+    h_ = sis_hash_helper(partial_import)
+    assert h_ != h and h_ == _hash_without_memo(partial_import)
+
+    partial_import.hashed_arguments = {"frozen": frozen_model_config}
+    assert partial_import._sis_hash_fingerprint() is not None
+    h = sis_hash_helper(partial_import)
+    frozen_model_config.layers.append(3)  # in-place in a field of the frozen dataclass
+    h_ = sis_hash_helper(partial_import)
+    assert h_ != h and h_ == _hash_without_memo(partial_import)
+
+
+def benchmark_sweep(num_configs: int = 500, num_hashes_per_config: int = 3):
+    """
+    Graph construction of a sweep: many configs sharing the same network serializers,
+    each hashed multiple times (e.g. by the train job, and by multiple recog/forward jobs).
+    """
+    from i6_core.returnn.config import ReturnnConfig
+
+    for memo_enabled in [False, True]:
+        serialization.SisHashMemoEnabled = memo_enabled
+        start_time = time.perf_counter()
+        network = [intern_import(f"i6_experiments.some.module{i}.Class{i}") for i in range(50)]
+        network.append(_make_call_tree(depth=4, width=3))
+        hashes = []
+        for i in range(num_configs):
+            collection = Collection(network + [ExplicitHash({"lr": 1e-3 * (i + 1)})])
+            config = ReturnnConfig({"learning_rate": 1e-3 * (i + 1)}, python_epilog=[collection])
+            for _ in range(num_hashes_per_config):
+                hashes.append(sis_hash_helper(config))
+        print(
+            f"memo {'enabled' if memo_enabled else 'disabled'}:"
+            f" {time.perf_counter() - start_time:.3f} secs for {num_configs} configs"
+        )
+        if not memo_enabled:
+            ref_hashes = hashes
+        else:
+            assert hashes == ref_hashes
+    serialization.SisHashMemoEnabled = True
+
+
+if __name__ == "__main__":
+    benchmark_sweep()
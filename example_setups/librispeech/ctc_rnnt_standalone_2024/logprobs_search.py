@@ -0,0 +1,98 @@
+"""
+Search-only job for decoder tuning on dumped log-probs, see pytorch_networks/ctc/decoder/dump_logprobs_v1.py
+"""
+import json
+import os
+import shutil
+import subprocess
+from typing import Any, Dict, Optional
+
+from sisyphus import tk, Job, Task
+
+from i6_core.util import instanciate_delayed
+
+from .pytorch_networks.ctc.decoder import flashlight_ctc_v1
+
+
+class FlashlightCtcSearchFromLogprobsJob(Job):
+    """
+    Runs the flashlight CTC decoder (flashlight_ctc_v1.search_from_logprobs) on dumped log-probs,
+    i.e. applies blank penalty, prior correction and the lexicon/LM search without loading the model.
+
+    Outputs search_out.py in the same format as the ReturnnForwardJobV2 based search.
+    """
+
+    def __init__(
+        self,
+        *,
+        logprobs: tk.Path,
+        logprobs_index: tk.Path,
+        decoder_config: Dict[str, Any],
+        returnn_python_exe: tk.Path,
+        returnn_root: tk.Path,
+        extra_config: Optional[Dict[str, Any]] = None,
+        cpu_rqmt: int = 2,
+        mem_rqmt: float = 8,
+        time_rqmt: float = 4,
+    ):
+        """
+        :param logprobs: logprobs.bin of the dump_logprobs_v1 forward job
+        :param logprobs_index: logprobs_index.json of the dump_logprobs_v1 forward job
+        :param decoder_config: flashlight_ctc_v1.DecoderConfig as dict
+        :param returnn_python_exe: python executable with torchaudio
+        :param returnn_root: RETURNN repository, needed for the vocabulary
+        :param extra_config: flashlight_ctc_v1.ExtraConfig as dict, not hashed
+        """
+        self.logprobs = logprobs
+        self.logprobs_index = logprobs_index
+        self.decoder_config = decoder_config
+        self.returnn_python_exe = returnn_python_exe
+        self.returnn_root = returnn_root
+        self.extra_config = extra_config
+
+        self.out_search_file = self.output_path("search_out.py")
+
+        self.rqmt = {"cpu": cpu_rqmt, "mem": mem_rqmt, "time": time_rqmt}
+
+    def tasks(self):
+        yield Task("create_files", mini_task=True)
+        yield Task("run", rqmt=self.rqmt)
+
+    def create_files(self):
+        with open("search_args.json", "wt") as f:
+            json.dump(
+                {
+                    "config": instanciate_delayed(self.decoder_config),
+                    "logprobs_file": self.logprobs.get_path(),
+                    "index_file": self.logprobs_index.get_path(),
+                    "extra_config": self.extra_config,
+                },
+                f,
+                indent=2,
+            )
+
+        # import the decoder as top level module, so that it can be used by spawned search worker processes
+        decoder_dir, decoder_module = os.path.split(flashlight_ctc_v1.__file__)
+        with open("run.py", "wt") as f:
+            f.write(
+                "import json\n"
+                "import sys\n"
+                f"sys.path.insert(0, {self.returnn_root.get_path()!r})\n"
+                f"sys.path.insert(0, {decoder_dir!r})\n"
+                f"import {os.path.splitext(decoder_module)[0]} as decoder\n"
+                "\n"
+                'if __name__ == "__main__":\n'
+                '    with open("search_args.json", "rt") as f:\n'
+                "        decoder.search_from_logprobs(**json.load(f))\n"
+            )
+
+    def run(self):
+        subprocess.check_call([self.returnn_python_exe.get_path(), "run.py"])
+        shutil.move("search_out.py", self.out_search_file.get_path())
+
+    @classmethod
+    def hash(cls, parsed_args):
+        d = dict(parsed_args)
+        for k in ["extra_config", "cpu_rqmt", "mem_rqmt", "time_rqmt"]:
+            d.pop(k)
+        return super().hash(d)
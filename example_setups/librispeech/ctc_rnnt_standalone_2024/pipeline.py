@@ -21,6 +21,7 @@ from i6_experiments.common.setups.returnn.datasets import Dataset
 
 from .config import get_forward_config, get_training_config, get_prior_config, TrainingDatasets
 from .default_tools import SCTK_BINARY_PATH, RETURNN_EXE, MINI_RETURNN_ROOT
+from .logprobs_search import FlashlightCtcSearchFromLogprobsJob
 
 
 @dataclass
@@ -42,6 +43,7 @@ def search_single(
     returnn_root: tk.Path,
     mem_rqmt: float = 10,
     use_gpu: bool = False,
+    cpu_rqmt: int = 2,
 ):
     """
     Run search for a specific test dataset
@@ -55,6 +57,7 @@ def search_single(
     :param returnn_root: Path to a checked out RETURNN repository
     :param mem_rqmt: some search jobs might need more memory
     :param use_gpu: if to do GPU decoding
+    :param cpu_rqmt: number of CPUs for the search job, e.g. to run search workers in parallel
     """
     returnn_config = copy.deepcopy(returnn_config)
     returnn_config.config["forward"] = recognition_dataset.as_returnn_opts()
@@ -65,15 +68,28 @@ def search_single(
         mem_rqmt=mem_rqmt,
         time_rqmt=24,
         device="gpu" if use_gpu else "cpu",
-        cpu_rqmt=2,
+        cpu_rqmt=cpu_rqmt,
         returnn_python_exe=returnn_exe,
         returnn_root=returnn_root,
         output_files=["search_out.py"],
     )
     search_job.add_alias(prefix_name + "/search_job")
 
+    wer = score(prefix_name, search_job.out_files["search_out.py"], recognition_bliss_corpus)
+    return wer, search_job
+
+
+def score(prefix_name: str, recog_words_file: tk.Path, recognition_bliss_corpus: tk.Path) -> tk.Variable:
+    """
+    Score a search_out.py with sclite
+
+    :param prefix_name: prefix folder path for output files
+    :param recog_words_file: the search_out.py containing the word sequence per sequence tag
+    :param recognition_bliss_corpus: path to bliss file used as Sclite evaluation reference
+    :return: the WER
+    """
     search_ctm = SearchWordsToCTMJob(
-        recog_words_file=search_job.out_files["search_out.py"],
+        recog_words_file=recog_words_file,
         bliss_corpus=recognition_bliss_corpus,
     ).out_ctm_file
 
@@ -83,7 +99,69 @@ def search_single(
     tk.register_output(prefix_name + "/sclite/wer", sclite_job.out_wer)
     tk.register_output(prefix_name + "/sclite/report", sclite_job.out_report_dir)
 
-    return sclite_job.out_wer, search_job
+    return sclite_job.out_wer
+
+
+def search_single_from_logprobs(
+    prefix_name: str,
+    dump_returnn_config: ReturnnConfig,
+    checkpoint: tk.Path,
+    recognition_dataset: Dataset,
+    recognition_bliss_corpus: tk.Path,
+    decoder_args: Dict[str, Any],
+    returnn_exe: tk.Path,
+    returnn_root: tk.Path,
+    unhashed_decoder_args: Optional[Dict[str, Any]] = None,
+    mem_rqmt: float = 10,
+    use_gpu: bool = False,
+    cpu_rqmt: int = 2,
+):
+    """
+    Run search for a specific test dataset in two stages: the model log-probs are dumped once by a forward job
+    which does not depend on the decoder settings, the flashlight search then runs in a separate job on the dump.
+
+    :param prefix_name: prefix folder path for alias and output files
+    :param dump_returnn_config: the RETURNN config using ctc.decoder.dump_logprobs_v1 as forward module
+    :param Checkpoint checkpoint: path to RETURNN PyTorch model checkpoint
+    :param recognition_dataset: Dataset to perform recognition on
+    :param recognition_bliss_corpus: path to bliss file used as Sclite evaluation reference
+    :param decoder_args: arguments as for the flashlight_ctc_v1 forward_init_hook, i.e. {"config": ...}
+    :param returnn_exe: The python executable to run the job with (when using container just "python3")
+    :param returnn_root: Path to a checked out RETURNN repository
+    :param unhashed_decoder_args: unhashed arguments as for the flashlight_ctc_v1 forward_init_hook
+    :param mem_rqmt: some search jobs might need more memory
+    :param use_gpu: if to do the model forwarding on GPU
+    :param cpu_rqmt: number of CPUs for the search job
+    """
+    dump_returnn_config = copy.deepcopy(dump_returnn_config)
+    dump_returnn_config.config["forward"] = recognition_dataset.as_returnn_opts()
+    dump_job = ReturnnForwardJobV2(
+        model_checkpoint=checkpoint,
+        returnn_config=dump_returnn_config,
+        log_verbosity=5,
+        mem_rqmt=mem_rqmt,
+        time_rqmt=24,
+        device="gpu" if use_gpu else "cpu",
+        cpu_rqmt=2,
+        returnn_python_exe=returnn_exe,
+        returnn_root=returnn_root,
+        output_files=["logprobs.bin", "logprobs_index.json"],
+    )
+
+    search_job = FlashlightCtcSearchFromLogprobsJob(
+        logprobs=dump_job.out_files["logprobs.bin"],
+        logprobs_index=dump_job.out_files["logprobs_index.json"],
+        decoder_config=decoder_args["config"],
+        returnn_python_exe=returnn_exe,
+        returnn_root=returnn_root,
+        extra_config=(unhashed_decoder_args or {}).get("extra_config", None),
+        cpu_rqmt=cpu_rqmt,
+        mem_rqmt=mem_rqmt,
+    )
+    search_job.add_alias(prefix_name + "/search_job")
+
+    wer = score(prefix_name, search_job.out_search_file, recognition_bliss_corpus)
+    return wer, search_job
 
 
 @tk.block()
@@ -98,6 +176,9 @@ def search(
     returnn_root: tk.Path,
     use_gpu: bool = False,
     debug: bool = False,
+    unhashed_decoder_args: Optional[Dict[str, Any]] = None,
+    cpu_rqmt: int = 2,
+    use_cached_logprobs: bool = False,
 ):
     """
     Run search over multiple datasets and collect statistics
@@ -111,6 +192,11 @@ def search(
     :param returnn_exe: The python executable to run the job with (when using container just "python3")
     :param returnn_root: Path to a checked out RETURNN repository
     :param use_gpu: run search with GPU
+    :param unhashed_decoder_args: arguments for the decoding forward_init_hook that do not change the result,
+        e.g. the "extra_config" for RTF logging or pipelined search
+    :param cpu_rqmt: number of CPUs for each search job
+    :param use_cached_logprobs: dump the model log-probs once per dataset and run only the search per decoder setting,
+        only for ctc.decoder.flashlight_ctc_v1
     """
     if asr_model.prior_file is not None:
         decoder_args["config"]["prior_file"] = asr_model.prior_file
@@ -120,25 +206,54 @@ def search(
         config=forward_config,
         net_args=asr_model.net_args,
         decoder_args=decoder_args,
+        unhashed_decoder_args=unhashed_decoder_args,
         decoder=decoder_module,
         debug=debug,
     )
 
+    if use_cached_logprobs:
+        assert decoder_module == "ctc.decoder.flashlight_ctc_v1", "cached log-probs need the flashlight CTC decoder"
+        # does not depend on the decoder args, so it is shared between all decoder settings
+        dump_returnn_config = get_forward_config(
+            network_module=asr_model.network_module,
+            config=forward_config,
+            net_args=asr_model.net_args,
+            decoder_args={},
+            decoder="ctc.decoder.dump_logprobs_v1",
+            debug=debug,
+        )
+
     # use fixed last checkpoint for now, needs more fine-grained selection / average etc. here
     wers = {}
     search_jobs = []
     for key, (test_dataset, test_dataset_reference) in test_dataset_tuples.items():
         search_name = prefix_name + "/%s" % key
-        wers[search_name], search_job = search_single(
-            search_name,
-            returnn_search_config,
-            asr_model.checkpoint,
-            test_dataset,
-            test_dataset_reference,
-            returnn_exe,
-            returnn_root,
-            use_gpu=use_gpu,
-        )
+        if use_cached_logprobs:
+            wers[search_name], search_job = search_single_from_logprobs(
+                search_name,
+                dump_returnn_config,
+                asr_model.checkpoint,
+                test_dataset,
+                test_dataset_reference,
+                decoder_args,
+                returnn_exe,
+                returnn_root,
+                unhashed_decoder_args=unhashed_decoder_args,
+                use_gpu=use_gpu,
+                cpu_rqmt=cpu_rqmt,
+            )
+        else:
+            wers[search_name], search_job = search_single(
+                search_name,
+                returnn_search_config,
+                asr_model.checkpoint,
+                test_dataset,
+                test_dataset_reference,
+                returnn_exe,
+                returnn_root,
+                use_gpu=use_gpu,
+                cpu_rqmt=cpu_rqmt,
+            )
         search_jobs.append(search_job)
 
     return search_jobs, wers
@@ -0,0 +1,61 @@
+"""
+Dumps the CTC log-probs of a model for a dataset, so that decoder settings can be tuned without rerunning the model
+
+Writes two files:
+ - logprobs.bin: float32 log-probs of all sequences without padding, concatenated along time, i.e. [sum(T), V]
+ - logprobs_index.json: number of classes and per sequence the tag, frame offset, number of frames and audio duration
+
+The log-probs are stored before any prior correction or blank penalty,
+use flashlight_ctc_v1.search_from_logprobs to decode them.
+"""
+
+import json
+
+LOGPROBS_FILE = "logprobs.bin"
+INDEX_FILE = "logprobs_index.json"
+
+
+def forward_init_hook(run_ctx, **kwargs):
+    run_ctx.logprobs_file = open(LOGPROBS_FILE, "wb")
+    run_ctx.num_frames = 0
+    run_ctx.num_classes = None
+    run_ctx.segments = []
+
+
+def forward_finish_hook(run_ctx, **kwargs):
+    run_ctx.logprobs_file.close()
+    with open(INDEX_FILE, "wt") as f:
+        json.dump(
+            {
+                "dtype": "float32",
+                "num_classes": run_ctx.num_classes,
+                "num_frames": run_ctx.num_frames,
+                "segments": run_ctx.segments,
+            },
+            f,
+        )
+    print("Dumped %d frames of %d sequences" % (run_ctx.num_frames, len(run_ctx.segments)))
+
+
+def forward_step(*, model, data, run_ctx, **kwargs):
+    import torch
+
+    raw_audio = data["raw_audio"]  # [B, T', F]
+    raw_audio_len = data["raw_audio:size1"]  # [B]
+
+    logprobs, audio_features_len = model(
+        raw_audio=raw_audio,
+        raw_audio_len=raw_audio_len,
+    )
+
+    logprobs_cpu = logprobs.detach().to(device="cpu", dtype=torch.float32).numpy()  # [B, T, V]
+    audio_features_len = audio_features_len.cpu().numpy()
+    raw_audio_len = raw_audio_len.cpu().numpy()
+    if run_ctx.num_classes is None:
+        run_ctx.num_classes = logprobs_cpu.shape[2]
+    assert logprobs_cpu.shape[2] == run_ctx.num_classes
+
+    for logprobs_seq, length, audio_len, tag in zip(logprobs_cpu, audio_features_len, raw_audio_len, data["seq_tag"]):
+        run_ctx.logprobs_file.write(logprobs_seq[:length].tobytes())
+        run_ctx.segments.append([tag, run_ctx.num_frames, int(length), float(audio_len) / 16000])
+        run_ctx.num_frames += int(length)
@@ -2,12 +2,18 @@
 Flashlight/Torchaudio CTC decoder
 
 includes handling of prior computation
+
+The search can optionally be pipelined with the acoustic model forwarding (see ExtraConfig.num_search_workers):
+the log-probs of each batch are handed to a pool of search workers while the next batch is forwarded,
+results are written to search_out.py in the original order.
 """
 
+import collections
 from dataclasses import dataclass
+import threading
 import time
 import numpy as np
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 
 @dataclass
@@ -46,27 +52,80 @@ class ExtraConfig:
     # Hypothesis logging
     print_hypothesis: bool = True
 
+    # Pipelined search, 0 means the search runs synchronously after the AM forwarding of each batch.
+    # Set the CPU rqmt of the search job accordingly.
+    num_search_workers: int = 0
+    # "thread" or "process", processes avoid any contention on the GIL but need to build their own decoder
+    search_worker_type: str = "process"
+    # max number of batches that are forwarded but not yet decoded, bounds the memory used for the log-probs
+    max_queued_batches: int = 4
 
-def forward_init_hook(run_ctx, **kwargs):
+
+# Created once here, as the thread pool runs the initializers concurrently
+_worker_decoder = threading.local()
+
+
+def _init_search_worker(decoder_kwargs: Dict[str, Any]):
     """
+    Initializer for the search workers, builds one decoder per worker
 
-    :param run_ctx:
-    :param kwargs:
-    :return:
+    For thread workers the decoder is stored thread-local.
+    """
+    from torchaudio.models.decoder import ctc_decoder
+
+    _worker_decoder.decoder = ctc_decoder(**decoder_kwargs)
+
+
+def _search_batch(logprobs: np.ndarray, lengths: np.ndarray):
+    """
+    Runs the search for one batch inside of a search worker
+
+    :return: list of word sequences and the time spent in the search
     """
     import torch
+
+    search_start = time.time()
+    hypothesis = _worker_decoder.decoder(torch.from_numpy(logprobs), torch.from_numpy(lengths))
+    search_time = time.time() - search_start
+    return [list(hyp[0].words) for hyp in hypothesis], search_time
+
+
+def _write_hypotheses(run_ctx, tags: List[str], words_per_seq: List[List[str]]):
+    for words, tag in zip(words_per_seq, tags):
+        sequence = " ".join([word for word in words if not word.startswith("[")])
+        if run_ctx.print_hypothesis:
+            print(sequence)
+        run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(sequence)))
+
+
+def _collect_search_result(run_ctx):
+    """
+    Waits for the oldest queued batch and writes its hypotheses
+    """
+    future, tags, audio_len_batch = run_ctx.search_queue.popleft()
+
+    wait_start = time.time()
+    words_per_seq, search_time = future.result()
+    queue_wait_time = time.time() - wait_start
+
+    if run_ctx.print_rtf:
+        run_ctx.total_search_time += search_time
+        run_ctx.total_queue_wait_time += queue_wait_time
+        print("Batch-Search-Time: %.2fs, Search-RTF: %.3f" % (search_time, search_time / audio_len_batch))
+        print("Batch-Queue-Wait-Time: %.2fs" % queue_wait_time)
+
+    _write_hypotheses(run_ctx, tags, words_per_seq)
+
+
+def _init_search(run_ctx, config: DecoderConfig, extra_config: ExtraConfig):
+    """
+    Sets up the decoder (or search workers), prior correction and RTF logging in run_ctx
+    """
     from torchaudio.models.decoder import ctc_decoder
 
     from returnn.datasets.util.vocabulary import Vocabulary
     from returnn.util.basic import cf
 
-    config = DecoderConfig(**kwargs["config"])
-    extra_config_dict = kwargs.get("extra_config", {})
-    extra_config = ExtraConfig(**extra_config_dict)
-
-    run_ctx.recognition_file = open("search_out.py", "wt")
-    run_ctx.recognition_file.write("{\n")
-
     if config.arpa_lm is not None:
         lm = cf(config.arpa_lm)
     else:
@@ -75,7 +134,7 @@ def forward_init_hook(run_ctx, **kwargs):
     vocab = Vocabulary.create_vocab(vocab_file=config.returnn_vocab, unknown_label=None)
     labels = vocab.labels
 
-    run_ctx.ctc_decoder = ctc_decoder(
+    decoder_kwargs = dict(
         lexicon=config.lexicon,
         lm=lm,
         lm_weight=config.lm_weight,
@@ -90,6 +149,32 @@ def forward_init_hook(run_ctx, **kwargs):
         sil_score=config.sil_score,
         word_score=config.word_score,
     )
+
+    run_ctx.search_pool = None
+    if extra_config.num_search_workers > 0:
+        import concurrent.futures
+        import multiprocessing
+
+        assert extra_config.max_queued_batches > 0
+        if extra_config.search_worker_type == "process":
+            run_ctx.search_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=extra_config.num_search_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_search_worker,
+                initargs=(decoder_kwargs,),
+            )
+        elif extra_config.search_worker_type == "thread":
+            run_ctx.search_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=extra_config.num_search_workers,
+                initializer=_init_search_worker,
+                initargs=(decoder_kwargs,),
+            )
+        else:
+            raise ValueError(f"invalid search_worker_type {extra_config.search_worker_type}")
+        run_ctx.search_queue = collections.deque()
+        run_ctx.max_queued_batches = extra_config.max_queued_batches
+    else:
+        run_ctx.ctc_decoder = ctc_decoder(**decoder_kwargs)
     run_ctx.labels = labels
     run_ctx.blank_log_penalty = config.blank_log_penalty
 
@@ -99,20 +184,88 @@ def forward_init_hook(run_ctx, **kwargs):
     else:
         run_ctx.prior = None
 
-    if config.use_torch_compile:
-        options = config.torch_compile_options or {}
-        run_ctx.engine._model = torch.compile(run_ctx.engine._model, **options)
-
     run_ctx.print_rtf = extra_config.print_rtf
     if run_ctx.print_rtf:
         run_ctx.running_audio_len_s = 0
         run_ctx.total_am_time = 0
         run_ctx.total_search_time = 0
+        run_ctx.total_queue_wait_time = 0
+        run_ctx.start_time = time.time()
 
     run_ctx.print_hypothesis = extra_config.print_hypothesis
 
 
+def _correct_logprobs(run_ctx, logprobs_cpu):
+    """
+    Applies blank penalty and prior correction in-place
+
+    :param logprobs_cpu: [B, T, V] torch tensor on CPU
+    """
+    if run_ctx.blank_log_penalty is not None:
+        # assumes blank is last
+        logprobs_cpu[:, :, -1] -= run_ctx.blank_log_penalty
+    if run_ctx.prior is not None:
+        logprobs_cpu -= run_ctx.prior_scale * run_ctx.prior
+
+
+def _search(run_ctx, logprobs_cpu, lengths_cpu, tags: List[str], audio_len_batch: Optional[float]) -> Optional[float]:
+    """
+    Decodes one batch of corrected log-probs, either directly or by queuing it for the search workers
+
+    :return: search time if decoded directly, None if queued
+    """
+    if run_ctx.search_pool is not None:
+        future = run_ctx.search_pool.submit(_search_batch, logprobs_cpu.numpy(), lengths_cpu.numpy())
+        run_ctx.search_queue.append((future, tags, audio_len_batch))
+
+        # write finished batches in order, block only if the queue is full
+        while len(run_ctx.search_queue) > 0 and (
+            len(run_ctx.search_queue) > run_ctx.max_queued_batches or run_ctx.search_queue[0][0].done()
+        ):
+            _collect_search_result(run_ctx)
+        return None
+
+    search_start = time.time()
+    hypothesis = run_ctx.ctc_decoder(logprobs_cpu, lengths_cpu)
+    search_time = time.time() - search_start
+    run_ctx.total_search_time += search_time
+
+    if run_ctx.print_rtf:
+        print("Batch-Search-Time: %.2fs, Search-RTF: %.3f" % (search_time, search_time / audio_len_batch))
+
+    _write_hypotheses(run_ctx, tags, [hyp[0].words for hyp in hypothesis])
+    return search_time
+
+
+def forward_init_hook(run_ctx, **kwargs):
+    """
+
+    :param run_ctx:
+    :param kwargs:
+    :return:
+    """
+    import torch
+
+    config = DecoderConfig(**kwargs["config"])
+    extra_config_dict = kwargs.get("extra_config", {})
+    extra_config = ExtraConfig(**extra_config_dict)
+
+    run_ctx.recognition_file = open("search_out.py", "wt")
+    run_ctx.recognition_file.write("{\n")
+
+    _init_search(run_ctx, config, extra_config)
+
+    if config.use_torch_compile:
+        options = config.torch_compile_options or {}
+        run_ctx.engine._model = torch.compile(run_ctx.engine._model, **options)
+
+
 def forward_finish_hook(run_ctx, **kwargs):
+    if run_ctx.search_pool is not None:
+        while len(run_ctx.search_queue) > 0:
+            _collect_search_result(run_ctx)
+        run_ctx.search_pool.shutdown()
+
     run_ctx.recognition_file.write("}\n")
     run_ctx.recognition_file.close()
 
@@ -127,6 +280,13 @@ def forward_finish_hook(run_ctx, **kwargs):
         )
         total_proc_time = run_ctx.total_am_time + run_ctx.total_search_time
         print("Total-time: %.2f, Batch-RTF: %.3f" % (total_proc_time, total_proc_time / run_ctx.running_audio_len_s))
+        if run_ctx.search_pool is not None:
+            print(
+                "Total-Queue-Wait-Time: %.2fs, Queue-Wait-RTF: %.3f"
+                % (run_ctx.total_queue_wait_time, run_ctx.total_queue_wait_time / run_ctx.running_audio_len_s)
+            )
+            wall_time = time.time() - run_ctx.start_time
+            print("Total-Wall-Time: %.2fs, Wall-RTF: %.3f" % (wall_time, wall_time / run_ctx.running_audio_len_s))
 
 
 def forward_step(*, model, data, run_ctx, **kwargs):
@@ -138,6 +298,8 @@ def forward_step(*, model, data, run_ctx, **kwargs):
     if run_ctx.print_rtf:
         audio_len_batch = torch.sum(raw_audio_len).detach().cpu().numpy() / 16000
         run_ctx.running_audio_len_s += audio_len_batch
+    else:
+        audio_len_batch = None
 
     am_start = time.time()
     logprobs, audio_features_len = model(
@@ -148,28 +310,72 @@ def forward_step(*, model, data, run_ctx, **kwargs):
     tags = data["seq_tag"]
 
     logprobs_cpu = logprobs.cpu()
-    if run_ctx.blank_log_penalty is not None:
-        # assumes blank is last
-        logprobs_cpu[:, :, -1] -= run_ctx.blank_log_penalty
-    if run_ctx.prior is not None:
-        logprobs_cpu -= run_ctx.prior_scale * run_ctx.prior
+    _correct_logprobs(run_ctx, logprobs_cpu)
 
     am_time = time.time() - am_start
     run_ctx.total_am_time += am_time
 
-    search_start = time.time()
-    hypothesis = run_ctx.ctc_decoder(logprobs_cpu, audio_features_len.cpu())
-    search_time = time.time() - search_start
-    run_ctx.total_search_time += search_time
-
     if run_ctx.print_rtf:
         print("Batch-AM-Time: %.2fs, AM-RTF: %.3f" % (am_time, am_time / audio_len_batch))
-        print("Batch-Search-Time: %.2fs, Search-RTF: %.3f" % (search_time, search_time / audio_len_batch))
+
+    search_time = _search(run_ctx, logprobs_cpu, audio_features_len.cpu(), tags, audio_len_batch)
+
+    if run_ctx.print_rtf and search_time is not None:
         print("Batch-time: %.2f, Batch-RTF: %.3f" % (am_time + search_time, (am_time + search_time) / audio_len_batch))
 
-    for hyp, tag in zip(hypothesis, tags):
-        words = hyp[0].words
-        sequence = " ".join([word for word in words if not word.startswith("[")])
-        if run_ctx.print_hypothesis:
-            print(sequence)
-        run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(sequence)))
+
+def search_from_logprobs(
+    *,
+    config: Dict[str, Any],
+    logprobs_file: str,
+    index_file: str,
+    extra_config: Optional[Dict[str, Any]] = None,
+    max_seqs_per_batch: int = 16,
+):
+    """
+    Runs the search on log-probs dumped with dump_logprobs_v1 without loading the model,
+    writes the hypotheses to search_out.py in the same format as the forward hooks.
+
+    :param config: DecoderConfig as dict, the prior and blank penalty are applied here
+    :param logprobs_file: logprobs.bin of dump_logprobs_v1
+    :param index_file: logprobs_index.json of dump_logprobs_v1
+    :param extra_config: ExtraConfig as dict
+    :param max_seqs_per_batch: number of sequences passed to the decoder at once
+    """
+    import json
+    import types
+
+    import torch
+
+    decoder_config = DecoderConfig(**config)
+    with open(index_file, "rt") as f:
+        index = json.load(f)
+    logprobs = np.memmap(
+        logprobs_file, dtype=index["dtype"], mode="r", shape=(index["num_frames"], index["num_classes"])
+    )
+
+    run_ctx = types.SimpleNamespace()
+    run_ctx.recognition_file = open("search_out.py", "wt")
+    run_ctx.recognition_file.write("{\n")
+    _init_search(run_ctx, decoder_config, ExtraConfig(**(extra_config or {})))
+
+    segments = index["segments"]
+    for batch_start in range(0, len(segments), max_seqs_per_batch):
+        batch = segments[batch_start : batch_start + max_seqs_per_batch]
+        tags = [tag for tag, _, _, _ in batch]
+        lengths = torch.tensor([length for _, _, length, _ in batch], dtype=torch.int32)
+
+        logprobs_cpu = torch.zeros((len(batch), int(lengths.max()), index["num_classes"]), dtype=torch.float32)
+        for i, (_, offset, length, _) in enumerate(batch):
+            logprobs_cpu[i, :length] = torch.from_numpy(np.array(logprobs[offset : offset + length]))
+        _correct_logprobs(run_ctx, logprobs_cpu)
+
+        if run_ctx.print_rtf:
+            audio_len_batch = sum(audio_len for _, _, _, audio_len in batch)
+            run_ctx.running_audio_len_s += audio_len_batch
+        else:
+            audio_len_batch = None
+
+        _search(run_ctx, logprobs_cpu, lengths, tags, audio_len_batch)
+
+    forward_finish_hook(run_ctx)
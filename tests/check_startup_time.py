@@ -0,0 +1,127 @@
+#!/bin/python3
+"""
+Measures the startup time of Sisyphus configs, i.e. the time to load the config (imports + graph construction),
+and reports the slowest imported modules.
+
+Usage (same setup as check_jobs.py)::
+
+    python check_startup_time.py config/**/*.py [--top 20] [--max-secs 30] [--forbid-modules torch tensorflow]
+
+Each config is loaded in a fresh Python process (with ``-X importtime``),
+so that the import times are not hidden by an earlier config.
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+
+def _load_config_child(config: str):
+    """
+    Runs in the child process. Loads the config and prints the stats as JSON as the last line to stdout.
+    """
+    start_time = time.perf_counter()
+    from sisyphus.loader import config_manager
+    from sisyphus import toolkit as tk
+
+    sis_import_time = time.perf_counter() - start_time
+    config_manager.load_configs([config])
+    total_time = time.perf_counter() - start_time
+    print(
+        json.dumps(
+            {
+                "config": config,
+                "sisyphus_import_secs": sis_import_time,
+                "total_secs": total_time,
+                "num_jobs": len(list(tk.graph.graph.jobs())),
+                "modules": sorted(sys.modules.keys()),
+            }
+        )
+    )
+
+
+def _parse_import_times(stderr: str) -> Dict[str, Tuple[float, float]]:
+    """
+    :param stderr: output of ``python -X importtime``
+    :return: module -> (self secs, cumulative secs)
+    """
+    res = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # header
+        res[parts[2].strip()] = (int(parts[0]) / 1e6, int(parts[1]) / 1e6)
+    return res
+
+
+def check_config(config: str, *, top: int, forbid_modules: List[str]) -> Tuple[float, List[str]]:
+    """
+    :return: total secs, errors
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", __file__, "--child", config],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stdout)
+        print(proc.stderr, file=sys.stderr)
+        return 0.0, [f"{config}: loading failed with exit code {proc.returncode}"]
+    stats = json.loads(proc.stdout.strip().splitlines()[-1])
+    import_times = _parse_import_times(proc.stderr)
+
+    print(
+        f"{config}: total {stats['total_secs']:.2f} secs"
+        f" (sisyphus import {stats['sisyphus_import_secs']:.2f} secs),"
+        f" {stats['num_jobs']} jobs, {len(stats['modules'])} modules"
+    )
+    print(f"  top {top} modules by self import time:")
+    for name, (self_secs, cum_secs) in sorted(import_times.items(), key=lambda item: -item[1][0])[:top]:
+        print(f"    {self_secs:8.3f} secs (cumulative {cum_secs:8.3f} secs) {name}")
+
+    errors = []
+    modules = set(stats["modules"])
+    for mod_name in forbid_modules:
+        if mod_name in modules:
+            errors.append(f"{config}: module {mod_name!r} was imported while loading the config")
+    return stats["total_secs"], errors
+
+
+def main():
+    """main"""
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        _load_config_child(sys.argv[2])
+        return
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("configs", nargs="+", help="Sisyphus config files")
+    arg_parser.add_argument("--top", type=int, default=20, help="number of slowest modules to report")
+    arg_parser.add_argument("--max-secs", type=float, help="fail if loading any config takes longer")
+    arg_parser.add_argument("--forbid-modules", nargs="*", default=[], help="fail if any of these is imported")
+    args = arg_parser.parse_args()
+
+    errors = []
+    total_secs = 0.0
+    for config in args.configs:
+        secs, config_errors = check_config(config, top=args.top, forbid_modules=args.forbid_modules)
+        errors += config_errors
+        total_secs += secs
+        if args.max_secs is not None and secs > args.max_secs:
+            errors.append(f"{config}: loading took {secs:.2f} secs > {args.max_secs} secs")
+    print(f"Total: {total_secs:.2f} secs for {len(args.configs)} configs")
+    for error in errors:
+        print("ERROR:", error, file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.getcwd())  # like check_jobs.py, run from the Sisyphus setup dir
+    main()
@@ -27,6 +27,8 @@ class ConformerBlockConvFirstV1Config(ModelConfiguration):
     """
     Attributes:
         ff_cfg: Configuration for ConformerPositionwiseFeedForwardV1
+        rel_pos_enc_cfg: Configuration for the relative positional encoding,
+            SelfAttRelPosEncodingV2Config selects the memory-efficient bucketed attention path
         mhsa_cfg: Configuration for Conformer
         conv_cfg: Configuration for ConformerConvolutionV1
     """
@@ -48,7 +50,7 @@ class ConformerBlockConvFirstV1(nn.Module):
         :param cfg: conformer block configuration with subunits for the different conformer parts
         """
         super().__init__()
-        self.rel_pos_enc = custom_parts.SelfAttRelPosEncodingV1(cfg=cfg.rel_pos_enc_cfg)
+        self.rel_pos_enc = custom_parts.get_rel_pos_encoding_module(cfg=cfg.rel_pos_enc_cfg)
         self.ff_1 = ConformerPositionwiseFeedForwardV1(cfg=cfg.ff_cfg)
         self.mhsa = custom_parts.ConformerMHSARelposV1(cfg=cfg.mhsa_cfg)
         self.conv = ConformerConvolutionV1(model_cfg=cfg.conv_cfg)
@@ -50,6 +50,27 @@ class ConformerMHSARelposV1(torch.nn.Module):
         self.att_dropout = cfg.att_weights_dropout
         self.dropout = cfg.dropout
 
+    @staticmethod
+    def _bucketed_rel_pos_scores(q: torch.Tensor, rel_pos_table: torch.Tensor) -> torch.Tensor:
+        """
+        Computes the relative positional scores q_i * e_{clip(j - i)} by scoring the queries only against the
+        (2*clipping+1) distinct encodings and gathering the results into the full score matrix.
+
+        :param q: queries of shape (B, H, T, D)
+        :param rel_pos_table: encodings of the distance buckets -clipping, ..., clipping of shape (2*clipping+1, D)
+        :return: scores of shape (B, H, T, T)
+        """
+        n_time = q.size(2)
+        clipping = (rel_pos_table.size(0) - 1) // 2
+
+        qe = torch.matmul(q, rel_pos_table.transpose(0, 1))  # [B, H, T, 2C+1]
+
+        position = torch.arange(n_time, device=q.device)  # [T]
+        distance_mat = position.unsqueeze(0) - position.unsqueeze(1)  # [T, T]
+        bucket_idx = torch.clip(distance_mat, min=-clipping, max=clipping) + clipping  # [T, T]
+
+        return torch.gather(qe, dim=-1, index=bucket_idx.expand(*q.shape[:2], n_time, n_time))  # [B, H, T, T]
+
     def forward(
         self, input_tensor: torch.Tensor, rel_pos_enc: torch.Tensor, sequence_mask: Optional[torch.Tensor] = None
     ) -> torch.Tensor:
@@ -57,7 +78,8 @@ class ConformerMHSARelposV1(torch.nn.Module):
         Apply layer norm and multi-head self attention and dropout
 
         :param input_tensor: Input to the self attention of shape (B, T, F)
-        :param rel_pos_enc: Relative positional encoding tensor of shape (T, T, D).
+        :param rel_pos_enc: Relative positional encoding tensor of shape (T, T, D) or table of the distinct distance
+            buckets of shape (2*clipping+1, D), see SelfAttRelPosEncodingV2.
         :param sequence_mask: Optional bool mask of shape (B, T), True signals within sequence, False outside.
         """
 
@@ -75,11 +97,14 @@ class ConformerMHSARelposV1(torch.nn.Module):
 
         qk = torch.matmul(q, k.transpose(-2, -1))  # [B, H, T, T]
 
-        q_reshape = q.permute(2, 0, 1, 3).reshape(
-            (n_time, n_batch * self.num_att_heads, self.dim_per_head)
-        )  # [T, B*H, D]
-        qp_reshape = torch.matmul(q_reshape, rel_pos_enc.transpose(-2, -1))  # [T, B*H, T]
-        qp = qp_reshape.permute(1, 0, 2).reshape((n_batch, self.num_att_heads, n_time, n_time))  # [B, H, T, T]
+        if rel_pos_enc.dim() == 2:
+            qp = self._bucketed_rel_pos_scores(q, rel_pos_enc)  # [B, H, T, T]
+        else:
+            q_reshape = q.permute(2, 0, 1, 3).reshape(
+                (n_time, n_batch * self.num_att_heads, self.dim_per_head)
+            )  # [T, B*H, D]
+            qp_reshape = torch.matmul(q_reshape, rel_pos_enc.transpose(-2, -1))  # [T, B*H, T]
+            qp = qp_reshape.permute(1, 0, 2).reshape((n_batch, self.num_att_heads, n_time, n_time))  # [B, H, T, T]
 
         scores = (qk + qp) / np.sqrt(self.dim_per_head)  # [B, H, T, T]
 
@@ -0,0 +1,99 @@
+"""
+Compares the full [T, T, D] relative positional encoding path (SelfAttRelPosEncodingV1) of ConformerMHSARelposV1
+against the bucketed path (SelfAttRelPosEncodingV2) in terms of outputs, step time and peak memory for varying T.
+
+Usage: python3 -m i6_experiments.users.berger.pytorch.custom_parts.mhsa_relpos_benchmark [--device cuda]
+Peak memory is only reported for CUDA devices.
+"""
+import argparse
+import time
+from typing import Tuple
+
+import torch
+
+from .mhsa_relpos import ConformerMHSARelposV1, ConformerMHSARelposV1Config
+from .rel_pos_enc import (
+    SelfAttRelPosEncodingV1,
+    SelfAttRelPosEncodingV1Config,
+    SelfAttRelPosEncodingV2,
+    SelfAttRelPosEncodingV2Config,
+)
+
+
+def _run_step(
+    mhsa: ConformerMHSARelposV1, rel_pos_enc: SelfAttRelPosEncodingV1, x: torch.Tensor, mask: torch.Tensor
+) -> Tuple[torch.Tensor, float, int]:
+    device = x.device
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+
+    y = mhsa(x, rel_pos_enc(x), mask)
+    y.sum().backward()
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        peak_mem = torch.cuda.max_memory_allocated(device)
+    else:
+        peak_mem = -1
+    return y.detach(), time.perf_counter() - start, peak_mem
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--num-heads", type=int, default=8)
+    parser.add_argument("--clipping", type=int, default=32)
+    parser.add_argument("--time-lens", type=int, nargs="+", default=[250, 500, 1000, 2000])
+    parser.add_argument("--repetitions", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(42)
+
+    mhsa = ConformerMHSARelposV1(
+        ConformerMHSARelposV1Config(
+            input_dim=args.dim, num_att_heads=args.num_heads, att_weights_dropout=0.0, dropout=0.0
+        )
+    ).to(device)
+    enc_v1 = SelfAttRelPosEncodingV1(
+        SelfAttRelPosEncodingV1Config(out_dim=args.dim // args.num_heads, clipping=args.clipping, dropout=0.0)
+    ).to(device)
+    enc_v2 = SelfAttRelPosEncodingV2(
+        SelfAttRelPosEncodingV2Config(out_dim=args.dim // args.num_heads, clipping=args.clipping, dropout=0.0)
+    ).to(device)
+    enc_v2.load_state_dict(enc_v1.state_dict())
+
+    print(
+        f"{'T':>6} | {'max abs diff':>12} | {'V1 time (s)':>11} | {'V2 time (s)':>11} | "
+        f"{'V1 mem (MB)':>11} | {'V2 mem (MB)':>11}"
+    )
+    for n_time in args.time_lens:
+        x = torch.randn(args.batch_size, n_time, args.dim, device=device)
+        mask = torch.ones(args.batch_size, n_time, dtype=torch.bool, device=device)
+
+        times = {"v1": 0.0, "v2": 0.0}
+        peak_mems = {"v1": 0, "v2": 0}
+        max_diff = 0.0
+        for _ in range(args.repetitions):
+            y_v1, t_v1, mem_v1 = _run_step(mhsa, enc_v1, x, mask)
+            y_v2, t_v2, mem_v2 = _run_step(mhsa, enc_v2, x, mask)
+            for module in (mhsa, enc_v1, enc_v2):
+                module.zero_grad()
+            times["v1"] += t_v1 / args.repetitions
+            times["v2"] += t_v2 / args.repetitions
+            peak_mems["v1"] = max(peak_mems["v1"], mem_v1)
+            peak_mems["v2"] = max(peak_mems["v2"], mem_v2)
+            max_diff = max(max_diff, torch.max(torch.abs(y_v1 - y_v2)).item())
+
+        print(
+            f"{n_time:>6} | {max_diff:>12.3e} | {times['v1']:>11.4f} | {times['v2']:>11.4f} | "
+            f"{peak_mems['v1'] / 2**20:>11.1f} | {peak_mems['v2'] / 2**20:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
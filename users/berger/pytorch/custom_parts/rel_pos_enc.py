@@ -56,3 +56,29 @@ class SelfAttRelPosEncodingV1(torch.nn.Module):
         # Index such that self.pos_enc[a, b, :] = self.encoding_matrix[pos_distance_mat_clipped[a, b], :]
         # self.pos_enc = self.encoding_matrix[pos_distance_mat_clipped].to(device=x.device)  # [T, T, out_dim]
         return self.encoding_matrix[pos_distance_mat_clipped].to(device=x.device)  # [T, T, out_dim]
+
+
+@dataclass
+class SelfAttRelPosEncodingV2Config(SelfAttRelPosEncodingV1Config):
+    pass
+
+
+class SelfAttRelPosEncodingV2(SelfAttRelPosEncodingV1):
+    """
+    Same parameters as SelfAttRelPosEncodingV1, but instead of the full [T, T, out_dim] encoding only the table of the
+    (2 * clipping + 1) distinct distance buckets is returned. ConformerMHSARelposV1 scores the queries against this table
+    and gathers the result into [B, H, T, T], which avoids the quadratic-in-T encoding tensor.
+    """
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # x: [B, T, F]
+        return self.encoding_matrix.to(device=x.device)  # [2*clipping+1, out_dim]
+
+
+def get_rel_pos_encoding_module(cfg: SelfAttRelPosEncodingV1Config) -> SelfAttRelPosEncodingV1:
+    """
+    Select the relative positional encoding module matching the type of the given config.
+    """
+    if isinstance(cfg, SelfAttRelPosEncodingV2Config):
+        return SelfAttRelPosEncodingV2(cfg=cfg)
+    return SelfAttRelPosEncodingV1(cfg=cfg)
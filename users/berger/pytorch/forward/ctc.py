@@ -3,7 +3,7 @@ import numpy as np
 from torchaudio.models.rnnt import RNNT
 from returnn.frontend import Tensor
 from returnn.tensor.tensor_dict import TensorDict
-from i6_experiments.users.berger.pytorch.forward.transducer_beam_search import beam_search
+from i6_experiments.users.berger.pytorch.forward.transducer_beam_search import batched_beam_search
 from sisyphus import tk
 from i6_core.lib.lexicon import Lexicon
 
@@ -33,15 +33,14 @@ def flashlight_ctc_decoder_forward_step(
     tokens_arrays = []
     tokens_len = []
 
-    for b in range(audio_features.size(0)):
-        seq_feature_len = audio_features_len[b : b + 1]
-        seq_features = audio_features[b : b + 1, : seq_feature_len[0]]
-        token_indices = beam_search(
-            model=model.to(device=device),
-            features=seq_features.to(device=device),
-            features_len=seq_feature_len.to(device=device),
-            beam_size=beam_size,
-        )
+    batch_token_indices = batched_beam_search(
+        model=model.to(device=device),
+        features=audio_features.to(device=device),
+        features_len=audio_features_len.to(device=device),
+        beam_size=beam_size,
+    )
+
+    for b, token_indices in enumerate(batch_token_indices):
         tokens_array = np.array([label_list[token_idx] for token_idx in token_indices], dtype="<U3")
         print(f"Recognized sequence {repr(seq_tags[b])}: {tokens_array}")
         tokens_arrays.append(tokens_array)
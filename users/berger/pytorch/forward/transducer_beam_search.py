@@ -1,30 +1,119 @@
-from functools import lru_cache
 from typing import List
-from dataclasses import dataclass
 
 import torch
 from torchaudio.models.rnnt import RNNT
 
-from i6_experiments.users.berger.pytorch.models.conformer_transducer import FFNNTransducer
 
+def batched_beam_search(
+    *, model: RNNT, features: torch.Tensor, features_len: torch.Tensor, beam_size: int = 100
+) -> List[List[int]]:
+    """
+    Transducer beam search over a whole batch of sequences at once.
+
+    All active hypotheses of all sequences are scored with a single `model.forward_single` call per step and pruned
+    with `torch.topk` over a [B, K*C] score tensor. Hypotheses are represented as tensors of context, score, length and
+    timestep; the label sequences are recovered at the end by following the stored back-pointers.
+
+    Pruning follows the length-normalized score of the previous per-hypothesis implementation, i.e. the accumulated
+    negative log-probability divided by the number of tokens (including the initial blank context). Hypotheses that
+    have reached the end of their sequence are carried over unchanged.
+
+    :param model: transducer model providing `forward_encoder`, `forward_single`, `blank_idx` and
+        `context_history_size`
+    :param features: [B, T, F]
+    :param features_len: [B]
+    :param beam_size: number of hypotheses K kept per sequence
+    :return: for every sequence in the batch, the non-blank label indices of the best hypothesis
+    """
+    assert features.dim() == 3
+    assert features_len.dim() == 1 and features_len.size(0) == features.size(0)
+
+    # Compute encoder once for the whole batch
+    enc, enc_lens = model.forward_encoder(features, features_len)  # [B, T, C], [B]
+    device = enc.device
+    B = enc.size(0)
+    K = beam_size
+    H = model.context_history_size
+    enc_lens = enc_lens.to(device=device, dtype=torch.long)  # [B]
+
+    batch_idx = torch.arange(B, device=device).unsqueeze(1).expand(B, K)  # [B, K]
+    inf = float("inf")
+
+    # Initially only hypothesis 0 of each sequence is valid: all-blank history with 0 score
+    context = torch.full((B, K, H), model.blank_idx, dtype=torch.long, device=device)  # [B, K, H]
+    scores = torch.full((B, K), inf, device=device)  # [B, K], accumulated negative log-probs
+    scores[:, 0] = 0.0
+    num_tokens = torch.full((B, K), H, dtype=torch.long, device=device)  # [B, K]
+    timesteps = torch.zeros((B, K), dtype=torch.long, device=device)  # [B, K]
+
+    # Per step: index of the predecessor hypothesis and appended label (-1 if the hypothesis was carried over)
+    backrefs: List[torch.Tensor] = []
+    labels: List[torch.Tensor] = []
+
+    while True:
+        valid = torch.isfinite(scores)  # [B, K]
+        finished = timesteps >= enc_lens.unsqueeze(1)  # [B, K]
+        active = valid & ~finished  # [B, K]
+        if not torch.any(active):
+            break
+
+        # Score all active hypotheses in one forward call. Hypotheses sharing sequence, timestep and context have
+        # identical output, so each unique combination is only computed once.
+        act_b, act_k = torch.nonzero(active, as_tuple=True)  # [N], [N]
+        keys = torch.cat(
+            [act_b.unsqueeze(1), timesteps[act_b, act_k].unsqueeze(1), context[act_b, act_k]], dim=1
+        )  # [N, 2+H]
+        unique_keys, inverse = torch.unique(keys, dim=0, return_inverse=True)  # [U, 2+H], [N]
+        log_probs = model.forward_single(enc[unique_keys[:, 0], unique_keys[:, 1]], unique_keys[:, 2:])  # [U, C]
+        num_classes = log_probs.size(1)
+
+        step_scores = torch.full((B, K, num_classes), inf, device=device)  # [B, K, C]
+        step_scores[act_b, act_k] = -log_probs[inverse].to(step_scores.dtype)
+
+        ext_scores = scores.unsqueeze(2) + step_scores  # [B, K, C]
+        ext_lens = (num_tokens + 1).unsqueeze(2).expand(B, K, num_classes).clone()  # [B, K, C]
+
+        # Finished hypotheses are carried over exactly once (in the slot of class 0) without modification
+        carry = valid & finished  # [B, K]
+        ext_scores[..., 0] = torch.where(carry, scores, ext_scores[..., 0])
+        ext_lens[..., 0] = torch.where(carry, num_tokens, ext_lens[..., 0])
+
+        avg_scores = ext_scores / ext_lens  # [B, K, C]
 
-@dataclass
-class Hypothesis:
-    tokens: List[int]
-    score: float
-    timestep: int
+        # Pruning
+        _, top_idx = torch.topk(-avg_scores.view(B, K * num_classes), k=K, dim=1)  # [B, K]
+        prev_k = torch.div(top_idx, num_classes, rounding_mode="floor")  # [B, K]
+        new_class = top_idx % num_classes  # [B, K]
+
+        was_carried = carry[batch_idx, prev_k]  # [B, K]
+        is_blank = new_class == model.blank_idx  # [B, K]
+
+        scores = ext_scores.view(B, K * num_classes).gather(1, top_idx)  # [B, K]
+        num_tokens = ext_lens.view(B, K * num_classes).gather(1, top_idx)  # [B, K]
+        timesteps = timesteps[batch_idx, prev_k] + (is_blank & ~was_carried).long()  # [B, K]
+
+        prev_context = context[batch_idx, prev_k]  # [B, K, H]
+        shifted_context = torch.cat([prev_context[..., 1:], new_class.unsqueeze(2)], dim=2)  # [B, K, H]
+        context = torch.where(was_carried.unsqueeze(2), prev_context, shifted_context)  # [B, K, H]
+
+        backrefs.append(prev_k)
+        labels.append(torch.where(was_carried, torch.full_like(new_class, -1), new_class))
 
-    @property
-    def avg_score(self) -> float:
-        return self.score / len(self.tokens)
+    # Best hypothesis per sequence according to the length-normalized score
+    best_k = torch.argmin(scores / num_tokens, dim=1)  # [B]
+    assert torch.all(timesteps[torch.arange(B, device=device), best_k] == enc_lens)
 
+    # Backtrack
+    token_lists: List[List[int]] = [[] for _ in range(B)]
+    cur_k = best_k
+    for step_backrefs, step_labels in zip(reversed(backrefs), reversed(labels)):
+        step_tokens = step_labels.gather(1, cur_k.unsqueeze(1)).squeeze(1).tolist()  # [B]
+        for b, token in enumerate(step_tokens):
+            if token != -1 and token != model.blank_idx:
+                token_lists[b].append(token)
+        cur_k = step_backrefs.gather(1, cur_k.unsqueeze(1)).squeeze(1)  # [B]
 
-def extended_hypothesis(base_hyp: Hypothesis, token: int, is_blank: bool, score: float) -> Hypothesis:
-    return Hypothesis(
-        base_hyp.tokens + [token],
-        base_hyp.score + score,
-        base_hyp.timestep + int(is_blank),
-    )
+    return [list(reversed(tokens)) for tokens in token_lists]
 
 
 def beam_search(*, model: RNNT, features: torch.Tensor, features_len: torch.Tensor, beam_size: int = 100) -> List[int]:
@@ -37,50 +126,4 @@ def beam_search(*, model: RNNT, features: torch.Tensor, features_len: torch.Tens
     if features_len.dim() == 0:
         features_len = features_len.unsqueeze(0)  # [1]
 
-    # Compute encoder once
-    enc, enc_lens = model.forward_encoder(features, features_len)  # [1, T, C], [1]
-    T = enc_lens[0].cpu().item()
-
-    # Function to get scores for time and history to avoid duplicate computation
-    @lru_cache
-    def cached_forward(timestep: int, context_tensor: torch.Tensor) -> torch.Tensor:
-        enc_state = enc[:, timestep]  # [1, C]
-        log_probs = model.forward_single(enc_state, context_tensor.unsqueeze(0))[0]  # [C]
-        scores = -log_probs  # [C]
-        return scores.cpu()
-
-    # Initial hypothesis contains all-blank history with 0 score
-    hypotheses = [Hypothesis([model.blank_idx] * model.context_history_size, 0, 0)]
-
-    # all_finished indicated if all hypotheses have reached the end of the time axis
-    all_finished = False
-    while not all_finished:
-        next_hypotheses = []  # accumulate extended hypotheses in here
-        all_finished = True
-
-        # iterate over all existing hypotheses and extend them
-        for hypothesis in hypotheses:
-            if hypothesis.timestep == T:
-                # hypothesis has already reached end of time axis and is not extended
-                next_hypotheses.append(hypothesis)
-                continue
-
-            # hypothesis gets extended, so not all are finished
-            all_finished = False
-
-            # form limited context of hypothesis into a tensor and compute log probs with it
-            context_tensor = torch.tensor(hypothesis.tokens[-model.context_history_size :], device=enc.device)  # [H]
-            scores = cached_forward(hypothesis.timestep, context_tensor)  # [C]
-
-            # extend hypothesis with all possible next classes
-            for c in range(scores.size(0)):
-                next_hypotheses.append(extended_hypothesis(hypothesis, c, c == model.blank_idx, scores[c].item()))
-
-        # Pruning
-        hypotheses = sorted(next_hypotheses, key=lambda hyp: hyp.avg_score)[:beam_size]
-
-    best_hypothesis = hypotheses[0]  # list has been sorted at the end of the loop so the best is first in the list
-    assert best_hypothesis.timestep == T
-    non_blanks = list(filter(lambda c: c != model.blank_idx, best_hypothesis.tokens))
-
-    return non_blanks
+    return batched_beam_search(model=model, features=features, features_len=features_len, beam_size=beam_size)[0]
@@ -5,20 +5,32 @@ from i6_core.lib import corpus
 from i6_core.lib.corpus import Corpus, Recording, Segment
 
 import h5py
+import numpy as np
 
 
 class FilterMismatchedSequencesJob(Job):
+    """
+    Splits the sequences of the target HDF into a blacklist and a whitelist,
+    depending on whether their length matches the length in the feature HDF.
+
+    Only the sequence tags and lengths are read, the target HDF in chunks of `chunk_size` sequences.
+    """
+
+    __sis_hash_exclude__ = {"chunk_size": 100_000}
+
     def __init__(
         self,
         feature_hdf: tk.Path,
         target_hdf: tk.Path,
         check_mismatch_func: Callable[[int, int], bool],
         returnn_root: tk.Path,
+        chunk_size: int = 100_000,
     ) -> None:
         self.feature_hdf = feature_hdf
         self.target_hdf = target_hdf
         self.mismatch_func = check_mismatch_func
         self.returnn_root = returnn_root
+        self.chunk_size = chunk_size
 
         self.out_segment_blacklist = self.output_path("segment_blacklist")
         self.out_segment_whitelist = self.output_path("segment_whitelist")
@@ -27,32 +39,42 @@ class FilterMismatchedSequencesJob(Job):
         yield Task("run", resume="run", mini_task=True)
 
     def run(self) -> None:
-        feature_hdf_file = h5py.File(self.feature_hdf)
-        target_hdf_file = h5py.File(self.target_hdf)
-
-        segment_blacklist = []
-        segment_whitelist = []
-
-        feature_len_dict = dict(zip(list(feature_hdf_file["seqTags"]), list(feature_hdf_file["seqLengths"][:, 0])))
-
-        for tag, target_len in zip(target_hdf_file["seqTags"], target_hdf_file["seqLengths"]):
-            if tag not in feature_len_dict:
-                print(f"Sequence {tag} is not contained in feature HDF")
-                continue
-            if self.mismatch_func(feature_len_dict[tag], target_len):
-                print(
-                    f"Sequence {tag} length mismatch: Feature sequence length is {feature_len_dict[tag]}, target sequence length is {len}"
-                )
-                segment_blacklist.append(tag)
-            else:
-                print(f"Sequence {tag} lengths are compatible.")
-                segment_whitelist.append(tag)
-
-        with open(self.out_segment_blacklist.get(), "wb") as f:
-            f.write(b"\n".join(segment_blacklist))
-
-        with open(self.out_segment_whitelist.get(), "wb") as f:
-            f.write(b"\n".join(segment_whitelist))
+        # Only the metadata of the feature HDF, sorted by tag for the lookup.
+        # Stable sort, so that for duplicate tags the last one is found.
+        with h5py.File(self.feature_hdf, "r") as feature_hdf_file:
+            feature_tags = feature_hdf_file["seqTags"][:]
+            feature_lens = feature_hdf_file["seqLengths"][:, 0]
+        feature_order = np.argsort(feature_tags, kind="stable")
+        feature_tags = feature_tags[feature_order]
+        feature_lens = feature_lens[feature_order]
+
+        blacklist_file = open(self.out_segment_blacklist.get(), "wb")
+        whitelist_file = open(self.out_segment_whitelist.get(), "wb")
+
+        with h5py.File(self.target_hdf, "r") as target_hdf_file, blacklist_file, whitelist_file:
+            target_tags = target_hdf_file["seqTags"]
+            target_lens = target_hdf_file["seqLengths"]
+            num_blacklisted = num_whitelisted = 0
+
+            for chunk_start in range(0, len(target_tags), self.chunk_size):
+                chunk_tags = target_tags[chunk_start : chunk_start + self.chunk_size]
+                chunk_lens = target_lens[chunk_start : chunk_start + self.chunk_size]
+                feature_idx = np.searchsorted(feature_tags, chunk_tags, side="right") - 1
+
+                for tag, target_len, idx in zip(chunk_tags, chunk_lens, feature_idx):
+                    if idx < 0 or feature_tags[idx] != tag:
+                        print(f"Sequence {tag} is not contained in feature HDF")
+                        continue
+                    if self.mismatch_func(feature_lens[idx], target_len):
+                        print(
+                            f"Sequence {tag} length mismatch: Feature sequence length is {feature_lens[idx]}, target sequence length is {target_len}"
+                        )
+                        blacklist_file.write((b"\n" if num_blacklisted else b"") + tag)
+                        num_blacklisted += 1
+                    else:
+                        print(f"Sequence {tag} lengths are compatible.")
+                        whitelist_file.write((b"\n" if num_whitelisted else b"") + tag)
+                        num_whitelisted += 1
 
 
 class FilterCorpusByDurationWordsRatioJob(Job):
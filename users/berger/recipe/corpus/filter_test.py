@@ -0,0 +1,111 @@
+"""
+Test for the chunked FilterMismatchedSequencesJob, against the previous implementation with a tag dict
+"""
+
+import os
+import tempfile
+from types import SimpleNamespace
+from typing import Callable, List
+
+import h5py
+import numpy as np
+
+from .filter import FilterMismatchedSequencesJob
+
+
+def _filter_mismatched_sequences_reference(
+    feature_hdf: str,
+    target_hdf: str,
+    mismatch_func: Callable[[int, int], bool],
+    out_segment_blacklist: str,
+    out_segment_whitelist: str,
+) -> None:
+    """previous implementation of FilterMismatchedSequencesJob.run (without the prints)"""
+    feature_hdf_file = h5py.File(feature_hdf)
+    target_hdf_file = h5py.File(target_hdf)
+
+    segment_blacklist = []
+    segment_whitelist = []
+
+    feature_len_dict = dict(zip(list(feature_hdf_file["seqTags"]), list(feature_hdf_file["seqLengths"][:, 0])))
+
+    for tag, target_len in zip(target_hdf_file["seqTags"], target_hdf_file["seqLengths"]):
+        if tag not in feature_len_dict:
+            continue
+        if mismatch_func(feature_len_dict[tag], target_len):
+            segment_blacklist.append(tag)
+        else:
+            segment_whitelist.append(tag)
+
+    with open(out_segment_blacklist, "wb") as f:
+        f.write(b"\n".join(segment_blacklist))
+
+    with open(out_segment_whitelist, "wb") as f:
+        f.write(b"\n".join(segment_whitelist))
+
+    feature_hdf_file.close()
+    target_hdf_file.close()
+
+
+def _write_synthetic_hdf(filename: str, tags: List[str], seq_lengths: np.ndarray, *, seed: int = 42) -> None:
+    """RETURNN HDF layout (as by SimpleHDFWriter), only with the data needed here"""
+    rnd = np.random.RandomState(seed)
+    with h5py.File(filename, "w") as f:
+        f.attrs["inputPattSize"] = 1
+        f.attrs["numSeqs"] = len(tags)
+        f.attrs["numTimesteps"] = int(seq_lengths[:, 0].sum())
+        f.create_dataset("inputs", data=rnd.randn(int(seq_lengths[:, 0].sum()), 1).astype(np.float32))
+        f.create_dataset("seqTags", data=[tag.encode() for tag in tags])
+        f.create_dataset("seqLengths", data=seq_lengths.astype(np.int32))
+
+
+def test_filter_mismatched_sequences():
+    rnd = np.random.RandomState(42)
+    num_seqs = 100
+    target_tags = [f"corpus/seq-{i}/{i}" for i in range(num_seqs)]
+    target_lens = rnd.randint(1, 50, size=(num_seqs,))
+    # Features: in a different order, every 7th tag is missing, and one tag is there twice (the last one counts).
+    feature_seqs = [(target_tags[i], target_lens[i] + rnd.randint(-3, 4)) for i in rnd.permutation(num_seqs) if i % 7]
+    feature_seqs.append((target_tags[1], target_lens[1] + 10))
+    feature_tags = [tag for tag, _ in feature_seqs]
+    feature_lens = np.array([[length] for _, length in feature_seqs])
+
+    def _mismatch(feature_len: int, target_len: np.ndarray) -> bool:
+        return abs(feature_len - target_len[0]) > 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        feature_hdf = os.path.join(tmp_dir, "features.hdf")
+        _write_synthetic_hdf(feature_hdf, feature_tags, feature_lens)
+        for name, tags in [("all", target_tags), ("none_in_features", target_tags[::7])]:
+            target_hdf = os.path.join(tmp_dir, f"targets.{name}.hdf")
+            _write_synthetic_hdf(target_hdf, tags, np.array([[target_lens[int(tag.split("/")[-1])]] for tag in tags]))
+
+            ref_blacklist = os.path.join(tmp_dir, f"ref.{name}.blacklist")
+            ref_whitelist = os.path.join(tmp_dir, f"ref.{name}.whitelist")
+            _filter_mismatched_sequences_reference(feature_hdf, target_hdf, _mismatch, ref_blacklist, ref_whitelist)
+
+            for chunk_size in [1, 6, 100_000]:
+                job = SimpleNamespace(
+                    feature_hdf=feature_hdf,
+                    target_hdf=target_hdf,
+                    mismatch_func=_mismatch,
+                    chunk_size=chunk_size,
+                    out_segment_blacklist=SimpleNamespace(get=lambda: os.path.join(tmp_dir, "out.blacklist")),
+                    out_segment_whitelist=SimpleNamespace(get=lambda: os.path.join(tmp_dir, "out.whitelist")),
+                )
+                FilterMismatchedSequencesJob.run(job)
+
+                for ref_file, out_file in [
+                    (ref_blacklist, job.out_segment_blacklist.get()),
+                    (ref_whitelist, job.out_segment_whitelist.get()),
+                ]:
+                    with open(ref_file, "rb") as ref_f, open(out_file, "rb") as out_f:
+                        assert ref_f.read() == out_f.read(), f"{out_file} differs for {name}, chunk_size {chunk_size}"
+
+            if name == "all":
+                with open(ref_blacklist, "rb") as f:
+                    assert f.read().count(b"\n") > 0
+                with open(ref_whitelist, "rb") as f:
+                    assert f.read().count(b"\n") > 0
+            else:
+                assert os.path.getsize(ref_blacklist) == os.path.getsize(ref_whitelist) == 0
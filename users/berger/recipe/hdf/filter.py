@@ -2,11 +2,22 @@ from sisyphus import Job, tk, Task
 
 import h5py
 import numpy as np
+from typing import Iterator, Tuple
 
 
 class FilterEmptySequencesJob(Job):
-    def __init__(self, dataset_hdf: tk.Path) -> None:
+    """
+    Removes all sequences with empty inputs from a RETURNN HDF.
+
+    The data is streamed in chunks of at most `chunk_size` frames from the input to the output HDF,
+    so the memory usage does not depend on the size of the HDF.
+    """
+
+    __sis_hash_exclude__ = {"chunk_size": 100_000}
+
+    def __init__(self, dataset_hdf: tk.Path, chunk_size: int = 100_000) -> None:
         self.dataset_hdf = dataset_hdf
+        self.chunk_size = chunk_size
 
         self.out_hdf = self.output_path("data.hdf")
 
@@ -14,38 +25,71 @@ class FilterEmptySequencesJob(Job):
         yield Task("run", resume="run", mini_task=True)
 
     def run(self) -> None:
-        hdf_file = h5py.File(self.dataset_hdf)
+        with h5py.File(self.dataset_hdf, "r") as hdf_file, h5py.File(self.out_hdf, "w") as out_hdf:
+            filter_hdf_sequences(hdf_file, out_hdf, lambda seq_lengths: seq_lengths[:, 0] > 0, self.chunk_size)
+
+
+def filter_hdf_sequences(hdf_file: h5py.File, out_hdf: h5py.File, keep_func, chunk_size: int) -> None:
+    """
+    Copies the RETURNN HDF `hdf_file` to `out_hdf`, keeping only the sequences selected by `keep_func`.
 
-        seqTags = hdf_file["seqTags"][:]
-        seqLengths = hdf_file["seqLengths"][:]
+    :param keep_func: maps the seqLengths [num_seqs, num_keys] to a boolean mask [num_seqs]
+    :param chunk_size: max number of frames per read/write
+    """
+    # First pass, only the metadata: which sequences are kept, and where their frames are
+    seq_tags = hdf_file["seqTags"][:]
+    seq_lengths = hdf_file["seqLengths"][:]
+    keep_mask = keep_func(seq_lengths)
 
-        valid_indices = np.where(seqLengths[:, 0] > 0)[0]
-        filtered_seqTags = seqTags[valid_indices]
-        filtered_seqLengths = seqLengths[valid_indices]
+    # The columns of seqLengths are "inputs", followed by the sorted target keys
+    columns = {"inputs": 0}
+    if "targets" in hdf_file:
+        for idx, key in enumerate(sorted(hdf_file["targets/data"].keys())):
+            columns[f"targets/data/{key}"] = idx + 1 if seq_lengths.shape[1] > 1 else 0
 
-        def copy_data_group(src, key, dest):
-            src_data = src[key]
-            if isinstance(src_data, h5py.Dataset):
+    def copy_data_group(src, key, dest):
+        src_data = src[key]
+        if isinstance(src_data, h5py.Dataset):
+            if src_data.name.lstrip("/") in columns:
+                ranges = list(_kept_frame_ranges(seq_lengths[:, columns[src_data.name.lstrip("/")]], keep_mask))
+                num_frames = sum(end - start for start, end in ranges)
+                dest_data = dest.create_dataset(key, shape=(num_frames,) + src_data.shape[1:], dtype=src_data.dtype)
+                pos = 0
+                for start, end in ranges:
+                    for chunk_start in range(start, end, chunk_size):
+                        chunk = src_data[chunk_start : min(chunk_start + chunk_size, end)]
+                        dest_data[pos : pos + len(chunk)] = chunk
+                        pos += len(chunk)
+            else:
                 dest.create_dataset(key, data=src_data[:])
-                for attr_key, attr_val in src_data.attrs.items():
-                    dest[key].attrs[attr_key] = attr_val
-            if isinstance(src_data, h5py.Group):
-                dest.create_group(key)
-                for attr_key, attr_val in src_data.attrs.items():
-                    dest[key].attrs[attr_key] = attr_val
-                for sub_key in src_data:
-                    copy_data_group(src_data, sub_key, dest[key])
-
-        out_hdf = h5py.File(self.out_hdf, "w")
-
-        for attr_key, attr_val in hdf_file.attrs.items():
-            out_hdf.attrs[attr_key] = attr_val
-
-        copy_data_group(hdf_file, "inputs", out_hdf)
-        out_hdf.create_dataset("seqTags", data=filtered_seqTags)
-        for attr_key, attr_val in hdf_file["seqTags"].attrs.items():
-            out_hdf["seqTags"].attrs[attr_key] = attr_val
-        out_hdf.create_dataset("seqLengths", data=filtered_seqLengths)
-        for attr_key, attr_val in hdf_file["seqLengths"].attrs.items():
-            out_hdf["seqLengths"].attrs[attr_key] = attr_val
+            for attr_key, attr_val in src_data.attrs.items():
+                dest[key].attrs[attr_key] = attr_val
+        if isinstance(src_data, h5py.Group):
+            dest.create_group(key)
+            for attr_key, attr_val in src_data.attrs.items():
+                dest[key].attrs[attr_key] = attr_val
+            for sub_key in src_data:
+                copy_data_group(src_data, sub_key, dest[key])
+
+    for attr_key, attr_val in hdf_file.attrs.items():
+        out_hdf.attrs[attr_key] = attr_val
+
+    copy_data_group(hdf_file, "inputs", out_hdf)
+    out_hdf.create_dataset("seqTags", data=seq_tags[keep_mask])
+    for attr_key, attr_val in hdf_file["seqTags"].attrs.items():
+        out_hdf["seqTags"].attrs[attr_key] = attr_val
+    out_hdf.create_dataset("seqLengths", data=seq_lengths[keep_mask])
+    for attr_key, attr_val in hdf_file["seqLengths"].attrs.items():
+        out_hdf["seqLengths"].attrs[attr_key] = attr_val
+    if "targets" in hdf_file:
         copy_data_group(hdf_file, "targets", out_hdf)
+
+
+def _kept_frame_ranges(lengths: np.ndarray, keep_mask: np.ndarray) -> Iterator[Tuple[int, int]]:
+    """
+    :return: frame ranges [start, end) of the kept sequences, with adjacent kept sequences merged
+    """
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+    mask_diff = np.diff(np.concatenate([[0], keep_mask.astype(np.int8), [0]]))
+    for start_idx, end_idx in zip(np.flatnonzero(mask_diff == 1), np.flatnonzero(mask_diff == -1)):
+        yield int(offsets[start_idx]), int(offsets[end_idx])
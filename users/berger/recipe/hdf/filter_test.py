@@ -0,0 +1,103 @@
+"""
+Test for the streaming HDF filter, against the previous in-memory implementation
+"""
+
+import os
+import tempfile
+
+import h5py
+import numpy as np
+
+from .filter import filter_hdf_sequences
+
+
+def _filter_empty_sequences_reference(in_file: str, out_file: str) -> None:
+    """previous implementation of FilterEmptySequencesJob.run, which loads all data into memory"""
+    hdf_file = h5py.File(in_file, "r")
+
+    seqTags = hdf_file["seqTags"][:]
+    seqLengths = hdf_file["seqLengths"][:]
+
+    valid_indices = np.where(seqLengths[:, 0] > 0)[0]
+    filtered_seqTags = seqTags[valid_indices]
+    filtered_seqLengths = seqLengths[valid_indices]
+
+    def copy_data_group(src, key, dest):
+        src_data = src[key]
+        if isinstance(src_data, h5py.Dataset):
+            dest.create_dataset(key, data=src_data[:])
+            for attr_key, attr_val in src_data.attrs.items():
+                dest[key].attrs[attr_key] = attr_val
+        if isinstance(src_data, h5py.Group):
+            dest.create_group(key)
+            for attr_key, attr_val in src_data.attrs.items():
+                dest[key].attrs[attr_key] = attr_val
+            for sub_key in src_data:
+                copy_data_group(src_data, sub_key, dest[key])
+
+    out_hdf = h5py.File(out_file, "w")
+
+    for attr_key, attr_val in hdf_file.attrs.items():
+        out_hdf.attrs[attr_key] = attr_val
+
+    copy_data_group(hdf_file, "inputs", out_hdf)
+    out_hdf.create_dataset("seqTags", data=filtered_seqTags)
+    for attr_key, attr_val in hdf_file["seqTags"].attrs.items():
+        out_hdf["seqTags"].attrs[attr_key] = attr_val
+    out_hdf.create_dataset("seqLengths", data=filtered_seqLengths)
+    for attr_key, attr_val in hdf_file["seqLengths"].attrs.items():
+        out_hdf["seqLengths"].attrs[attr_key] = attr_val
+    copy_data_group(hdf_file, "targets", out_hdf)
+
+    out_hdf.close()
+    hdf_file.close()
+
+
+def _write_synthetic_hdf(filename: str, *, num_seqs: int = 50, dim: int = 7, seed: int = 42) -> None:
+    """RETURNN HDF layout (as by SimpleHDFWriter), where every 4th seq is empty"""
+    rnd = np.random.RandomState(seed)
+    lengths = rnd.randint(1, 30, size=(num_seqs,))
+    lengths[::4] = 0
+    # empty seqs have no frames at all, so the (unfiltered) targets of the reference are also consistent
+    seq_lengths = np.stack([lengths, lengths, (lengths + 1) // 2], axis=1).astype(np.int32)
+    with h5py.File(filename, "w") as f:
+        f.attrs["inputPattSize"] = dim
+        f.attrs["numLabels"] = 1
+        f.attrs["numSeqs"] = num_seqs
+        f.attrs["numTimesteps"] = int(lengths.sum())
+        f.create_dataset("inputs", data=rnd.randn(int(lengths.sum()), dim).astype(np.float32))
+        f.create_dataset("seqTags", data=[f"corpus/seq-{i}/{i}".encode() for i in range(num_seqs)])
+        f.create_dataset("seqLengths", data=seq_lengths)
+        f.create_group("targets/data")
+        f["targets/data"].create_dataset(
+            "alignment", data=rnd.randint(0, 100, size=(int(seq_lengths[:, 1].sum()),)).astype(np.int32)
+        )
+        f["targets/data"].create_dataset(
+            "words", data=rnd.randint(0, 10, size=(int(seq_lengths[:, 2].sum()),)).astype(np.int32)
+        )
+        f.create_group("targets/size")
+        f["targets/size"].attrs["alignment"] = 100
+        f["targets/size"].attrs["words"] = 10
+        f.create_group("targets/labels")
+        f["targets/labels"].create_dataset("alignment", data=[b"dummy"])
+        f["targets/labels"].create_dataset("words", data=[f"w{i}".encode() for i in range(10)])
+
+
+def test_filter_empty_sequences():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_file = os.path.join(tmp_dir, "in.hdf")
+        _write_synthetic_hdf(in_file)
+
+        ref_file = os.path.join(tmp_dir, "ref.hdf")
+        _filter_empty_sequences_reference(in_file, ref_file)
+
+        for chunk_size in [1, 5, 100_000]:
+            out_file = os.path.join(tmp_dir, f"out.{chunk_size}.hdf")
+            with h5py.File(in_file, "r") as hdf_file, h5py.File(out_file, "w") as out_hdf:
+                filter_hdf_sequences(hdf_file, out_hdf, lambda seq_lengths: seq_lengths[:, 0] > 0, chunk_size)
+
+            with open(ref_file, "rb") as ref_f, open(out_file, "rb") as out_f:
+                assert ref_f.read() == out_f.read(), f"output differs from reference for chunk_size {chunk_size}"
+
+        with h5py.File(ref_file, "r") as f:
+            assert len(f["seqTags"]) == 50 - 13
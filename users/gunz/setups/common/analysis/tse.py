@@ -1,13 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
+import json
 import logging
 import numpy as np
 import subprocess
-from typing import Iterator, List, Tuple, TypeVar
+from typing import Iterator, List, Optional, Tuple, TypeVar
 import sys
 
 from sisyphus import Job, Path, Task
 
 from i6_core.lib.rasr_cache import FileArchiveBundle
+from i6_core.util import chunks
 
 
 NUM_TASKS = 16
@@ -73,101 +76,157 @@ class ComputeTimestampErrorJob(Job):
         self.rqmt = {"cpu": 1, "mem": 8, "time": 1}
 
     def tasks(self) -> Iterator[Task]:
-        yield Task("run", resume="run", rqmt=self.rqmt)
+        yield Task("run", resume="run", rqmt=self.rqmt, args=range(1, NUM_TASKS + 1))
+        yield Task("merge", mini_task=True)
 
-    def run(self):
-        alignment = FileArchiveBundle(cache(self.alignment))
+    def _load_alignments(self) -> Tuple[FileArchiveBundle, FileArchiveBundle]:
+        # fetch both bundles concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cached_alignment, cached_ref_alignment = executor.map(cache, [self.alignment, self.reference_alignment])
+
+        alignment = FileArchiveBundle(cached_alignment)
         alignment.setAllophones(self.allophones.get_path())
 
-        ref_alignment = FileArchiveBundle(cache(self.reference_alignment))
+        ref_alignment = FileArchiveBundle(cached_ref_alignment)
         ref_alignment.setAllophones(self.reference_allophones.get_path())
 
+        return alignment, ref_alignment
+
+    def run(self, task_id: int):
+        alignment, ref_alignment = self._load_alignments()
+
         segments = [f for f in alignment.file_list() if not f.endswith(".attribs")]
-        self.out_num_processed.set(len(segments))
+        segments = list(chunks(segments, NUM_TASKS))[task_id - 1]
 
         s_idx = next(iter(alignment.files.values())).allophones.index("[SILENCE]{#+#}@i@f")
         ref_s_idx = next(iter(ref_alignment.files.values())).allophones.index("[SILENCE]{#+#}@i@f")
 
         skipped = 0
-        total_dist = 0
+        total_dist = 0.0
         total_num = 0
-        tse = {}
+        dist_per_seq = {}
 
         for seg in segments:
-            mix_indices = get_mixture_indices(alignment, seg)
-            mix_indices_ref = get_mixture_indices(ref_alignment, seg)
+            res = self._compute_segment(alignment, ref_alignment, seg, s_idx, ref_s_idx)
 
-            if len(mix_indices) == 0 or len(mix_indices_ref) == 0:
-                logging.warning(f"empty alignment for {seg}, skipping")
+            if res is None:
                 skipped += 1
                 continue
 
-            begins, ends = self._compute_begins_ends(alignment, seg, mix_indices, s_idx)
-            begins_ref, ends_ref = self._compute_begins_ends(ref_alignment, seg, mix_indices_ref, ref_s_idx)
-
-            if len(begins) == len(begins_ref) and len(ends) == len(ends_ref):
-                data = [(begins, ends, begins_ref, ends_ref)]
-            elif self.fuzzy_match_mismatching_phoneme_sequences:
-                skipped += 1
-                continue  # for now, impl is difficult
-
-                # Compute matching sequence on decoded allophones to allow mismatches in
-                # allophone indices, and then go back to the mixture indices for efficient
-                # computation of the boundaries (indexes are the same).
-                a_allos = [alignment.files[seg].allophones[mix] for mix in mix_indices]
-                b_allos = [ref_alignment.files[seg].allophones[mix] for mix in mix_indices_ref]
-
-                seq_matcher = SequenceMatcher(None, a=a_allos, b=b_allos, autojunk=False)
-                match_blocks = [bl for bl in seq_matcher.get_matching_blocks() if bl.size >= 5]
-
-                if len(match_blocks) == 0:
-                    logging.info(f"No matching blocks in sequence found. Skipping {seg}.")
-                    skipped += 1
-                    continue
-
-                logging.info(a_allos)
-                logging.info(b_allos)
-                logging.info(match_blocks)
-
-                # We do the comparison of the positions on a sequence of the full length to
-                # track mismatches in the starts of the blocks.
-                #
-                # Basically we zero out everything else but the matching block of indices and
-                # recompute the begins and ends over that instead.
-                mix_indices_all = [np.zeros_like(mix_indices) for _ in match_blocks]
-                for mi, bl in zip(mix_indices_all, match_blocks):
-                    mi[bl.a : bl.a + bl.size] = mix_indices[bl.a : bl.a + bl.size]
-                mix_indices_ref_all = [np.zeros_like(mix_indices_ref) for _ in match_blocks]
-                for mi, bl in zip(mix_indices_ref_all, match_blocks):
-                    mi[bl.b : bl.b + bl.size] = mix_indices_ref[bl.b : bl.b + bl.size]
-
-                # mix_indices_all = [mix_indices[bl.a : bl.a + bl.size] for bl in match_blocks]
-                # mix_indices_ref_all = [mix_indices_ref[bl.b : bl.b + bl.size] for bl in match_blocks]
-
-                data = [
-                    (begins, ends, begins_ref, ends_ref)
-                    for mix_indices, mix_indices_ref in zip(mix_indices_all, mix_indices_ref_all)
-                    for begins, ends in [compute_begins_ends(mix_indices, s_idx)]
-                    for begins_ref, ends_ref in [compute_begins_ends(mix_indices_ref, ref_s_idx)]
-                ]
-            else:
-                logging.info(
-                    f"len mismatch in {seg} of {len(begins)}/{len(ends)} (alignment) vs. {len(begins_ref)}/{len(ends_ref)} (reference alignment), skipping due to different pronunciation. {len(tse)} alignments already diffed."
-                )
-                skipped += 1
-                continue
+            dist, num = res
+            total_dist += dist
+            total_num += num
+            dist_per_seq[seg] = (dist, num)
+
+        with open(f"tse.{task_id}.json", "wt") as f:
+            json.dump(
+                {
+                    "num_processed": len(segments),
+                    "num_skipped": skipped,
+                    "total_dist": total_dist,
+                    "total_num": total_num,
+                    "dist_per_seq": dist_per_seq,
+                },
+                f,
+            )
+
+    def merge(self):
+        num_processed = 0
+        skipped = 0
+        total_dist = 0.0
+        total_num = 0
+        tse = {}
 
-            distances = [self._compute_distance(b, e, b_ref, e_ref) for b, e, b_ref, e_ref in data]
-            dists, nums = list(zip(*distances))
+        for task_id in range(1, NUM_TASKS + 1):
+            with open(f"tse.{task_id}.json", "rt") as f:
+                partial = json.load(f)
 
-            total_num += sum(nums)
-            total_dist += sum(dists)
-            tse[seg] = (sum(dists) / sum(nums)) * self.t_step
+            num_processed += partial["num_processed"]
+            skipped += partial["num_skipped"]
+            total_dist += partial["total_dist"]
+            total_num += partial["total_num"]
+            tse.update({seg: (dist / num) * self.t_step for seg, (dist, num) in partial["dist_per_seq"].items()})
 
+        self.out_num_processed.set(num_processed)
         self.out_num_skipped.set(skipped)
         self.out_tse.set((total_dist / total_num) * self.t_step)
         self.out_tse_per_seq.set(tse)
 
+    def _compute_segment(
+        self,
+        alignment: FileArchiveBundle,
+        ref_alignment: FileArchiveBundle,
+        seg: str,
+        s_idx: int,
+        ref_s_idx: int,
+    ) -> Optional[Tuple[float, int]]:
+        """
+        :return: sum of the boundary distances and number of boundaries, or None if the segment is skipped
+        """
+        mix_indices = get_mixture_indices(alignment, seg)
+        mix_indices_ref = get_mixture_indices(ref_alignment, seg)
+
+        if len(mix_indices) == 0 or len(mix_indices_ref) == 0:
+            logging.warning(f"empty alignment for {seg}, skipping")
+            return None
+
+        begins, ends = self._compute_begins_ends(alignment, seg, mix_indices, s_idx)
+        begins_ref, ends_ref = self._compute_begins_ends(ref_alignment, seg, mix_indices_ref, ref_s_idx)
+
+        if len(begins) == len(begins_ref) and len(ends) == len(ends_ref):
+            data = [(begins, ends, begins_ref, ends_ref)]
+        elif self.fuzzy_match_mismatching_phoneme_sequences:
+            return None  # for now, impl is difficult
+
+            # Compute matching sequence on decoded allophones to allow mismatches in
+            # allophone indices, and then go back to the mixture indices for efficient
+            # computation of the boundaries (indexes are the same).
+            a_allos = [alignment.files[seg].allophones[mix] for mix in mix_indices]
+            b_allos = [ref_alignment.files[seg].allophones[mix] for mix in mix_indices_ref]
+
+            seq_matcher = SequenceMatcher(None, a=a_allos, b=b_allos, autojunk=False)
+            match_blocks = [bl for bl in seq_matcher.get_matching_blocks() if bl.size >= 5]
+
+            if len(match_blocks) == 0:
+                logging.info(f"No matching blocks in sequence found. Skipping {seg}.")
+                return None
+
+            logging.info(a_allos)
+            logging.info(b_allos)
+            logging.info(match_blocks)
+
+            # We do the comparison of the positions on a sequence of the full length to
+            # track mismatches in the starts of the blocks.
+            #
+            # Basically we zero out everything else but the matching block of indices and
+            # recompute the begins and ends over that instead.
+            mix_indices_all = [np.zeros_like(mix_indices) for _ in match_blocks]
+            for mi, bl in zip(mix_indices_all, match_blocks):
+                mi[bl.a : bl.a + bl.size] = mix_indices[bl.a : bl.a + bl.size]
+            mix_indices_ref_all = [np.zeros_like(mix_indices_ref) for _ in match_blocks]
+            for mi, bl in zip(mix_indices_ref_all, match_blocks):
+                mi[bl.b : bl.b + bl.size] = mix_indices_ref[bl.b : bl.b + bl.size]
+
+            # mix_indices_all = [mix_indices[bl.a : bl.a + bl.size] for bl in match_blocks]
+            # mix_indices_ref_all = [mix_indices_ref[bl.b : bl.b + bl.size] for bl in match_blocks]
+
+            data = [
+                (begins, ends, begins_ref, ends_ref)
+                for mix_indices, mix_indices_ref in zip(mix_indices_all, mix_indices_ref_all)
+                for begins, ends in [compute_begins_ends(mix_indices, s_idx)]
+                for begins_ref, ends_ref in [compute_begins_ends(mix_indices_ref, ref_s_idx)]
+            ]
+        else:
+            logging.info(
+                f"len mismatch in {seg} of {len(begins)}/{len(ends)} (alignment) vs. {len(begins_ref)}/{len(ends_ref)} (reference alignment), skipping due to different pronunciation."
+            )
+            return None
+
+        distances = [self._compute_distance(b, e, b_ref, e_ref) for b, e, b_ref, e_ref in data]
+        dists, nums = list(zip(*distances))
+
+        return float(sum(dists)), int(sum(nums))
+
     def _compute_begins_ends(
         self, alignment: FileArchiveBundle, seg_name: str, mix_indices: np.ndarray, silence_idx: int
     ) -> Tuple[np.ndarray, np.ndarray]:
@@ -1,10 +1,9 @@
 __all__ = ["RasrAlignmentToHDF", "RasrForcedTriphoneAlignmentToHDF"]
 
-import dataclasses
-
 import h5py
 import logging
 import numpy as np
+import os
 from os import path
 import shutil
 import tempfile
@@ -12,14 +11,22 @@ import typing
 
 from sisyphus import tk, Job, Task
 
-from i6_core.lib.rasr_cache import FileArchiveBundle
+from i6_core.lib.rasr_cache import FileArchive
 
 from ..analysis.allophone_state import AllophoneState
 from ...common.cache_manager import cache_file
 
 
 class RasrAlignmentToHDF(Job):
-    __sis_hash_exclude__ = {"tmp_dir": "/var/tmp", "remap_segment_names": None}
+    """
+    Converts a RASR alignment bundle into a single sparse HDF.
+
+    The cache files of the bundle are processed in parallel (num_shards tasks), each into a
+    temporary per-cache-file HDF, which are then merged in bundle order. The segments are mapped
+    via an (allophone index, state) -> tied class table, precomputed once per allophone inventory.
+    """
+
+    __sis_hash_exclude__ = {"tmp_dir": "/var/tmp", "remap_segment_names": None, "num_shards": 8}
 
     def __init__(
         self,
@@ -29,9 +36,13 @@ class RasrAlignmentToHDF(Job):
         num_tied_classes: int,
         tmp_dir: typing.Optional[str] = "/var/tmp",
         remap_segment_names: typing.Optional[typing.Callable[[str], str]] = None,
+        num_shards: int = 8,
     ):
+        assert num_shards >= 1
+
         self.alignment_bundle = alignment_bundle
         self.allophones = allophones
+        self.num_shards = num_shards
         self.num_tied_classes = num_tied_classes
         self.remap_segment_names = remap_segment_names
         self.state_tying = state_tying
@@ -43,44 +54,49 @@ class RasrAlignmentToHDF(Job):
         self.rqmt = {"cpu": 1, "mem": 8, "time": 2}
 
     def tasks(self):
-        yield Task("run", rqmt=self.rqmt)
+        yield Task("run", rqmt=self.rqmt, args=range(self.num_shards))
+        yield Task("merge", rqmt={"cpu": 1, "mem": 4, "time": 1})
 
-    def run(self):
-        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
-            f = path.join(tmp_dir, "data.hdf")
-            logging.info(f"processing using temporary file {f}")
+    def _cache_file_paths(self) -> typing.List[str]:
+        with open(cache_file(self.alignment_bundle), "rt") as bundle:
+            return [line.strip() for line in bundle if line.strip()]
 
-            with h5py.File(f, "w") as file:
-                self.__run(file)
+    def run(self, shard_idx: int):
+        with open(self.state_tying, "rt") as st:
+            state_tying = {k: int(v) for line in st for k, v in [line.strip().split()[0:2]]}
 
-            shutil.move(f, self.out_hdf_file.get_path())
+        lookups = {}
 
-    def __run(self, out: h5py.File):
-        string_dt = h5py.special_dtype(vlen=str)
+        for cache_idx, cache_path in enumerate(self._cache_file_paths()):
+            if cache_idx % self.num_shards != shard_idx:
+                continue
 
-        with open(self.state_tying, "rt") as st:
-            state_tying = {k: int(v) for line in st for k, v in [line.strip().split()[0:2]]}
+            logging.info(f"processing cache file {cache_idx}: {cache_path}")
 
-        cached_alignment_bundle = cache_file(self.alignment_bundle)
-        alignment_cache = FileArchiveBundle(cached_alignment_bundle)
-        alignment_cache.setAllophones(self.allophones.get_path())
+            alignment_cache = FileArchive(cache_file(cache_path), must_exists=True)
+            alignment_cache.setAllophones(self.allophones.get_path())
 
-        seq_names = []
+            # The allophone inventory is the same for all archives, build the lookup only once.
+            inventory = tuple(alignment_cache.allophones)
+            if inventory not in lookups:
+                lookups[inventory] = self.build_lookup(allophones=list(inventory), state_tying=state_tying)
+            lookup = lookups[inventory]
+
+            with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+                f = path.join(tmp_dir, "data.hdf")
 
-        # root
-        streams_group = out.create_group("streams")
+                with h5py.File(f, "w") as out:
+                    self._process_cache_file(out, alignment_cache, lookup)
 
-        # first level
-        alignment_group = streams_group.create_group("classes")
-        alignment_group.attrs["parser"] = "sparse"
-        alignment_group.create_dataset(
-            "feature_names",
-            data=[b"label_%d" % l for l in range(self.num_tied_classes)],
-            dtype=string_dt,
-        )
+                shutil.move(f, self._shard_hdf_file(cache_idx))
 
-        # second level
-        alignment_data = alignment_group.create_group("data")
+    def _shard_hdf_file(self, cache_idx: int) -> str:
+        return path.abspath(f"alignment.{cache_idx}.hdf")
+
+    def _process_cache_file(self, out: h5py.File, alignment_cache: FileArchive, lookup: typing.Any):
+        string_dt = h5py.special_dtype(vlen=str)
+        alignment_data = out.create_group("data")
+        seq_names = []
 
         for file in alignment_cache.file_list():
             if file.endswith(".attribs"):
@@ -89,52 +105,185 @@ class RasrAlignmentToHDF(Job):
             mapped_name = file if self.remap_segment_names is None else self.remap_segment_names(file)
             seq_names.append(mapped_name)
 
-            # alignment
+            # alignment, as [T, (allophone index, state)]
             alignment = alignment_cache.read(file, "align")
+            alignment = np.array([(t[1], t[2]) for t in alignment], dtype=np.int64).reshape(-1, 2)
 
-            alignment_states = [f"{alignment_cache.files[file].allophones[t[1]]}.{t[2]:d}" for t in alignment]
-            targets = self.compute_targets(alignment_states=alignment_states, state_tying=state_tying)
+            targets = self.compute_targets(alignment=alignment, lookup=lookup)
 
-            alignment_data.create_dataset(
-                mapped_name.replace("/", "\\"),
-                data=np.array(targets).astype(np.int32),
-            )
+            alignment_data.create_dataset(mapped_name.replace("/", "\\"), data=targets.astype(np.int32))
 
         out.create_dataset("seq_names", data=[s.encode() for s in seq_names], dtype=string_dt)
 
+    def merge(self):
+        string_dt = h5py.special_dtype(vlen=str)
+        seq_names = []
+        seen = set()
+
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+            f = path.join(tmp_dir, "data.hdf")
+            logging.info(f"merging using temporary file {f}")
+
+            with h5py.File(f, "w") as out:
+                # root
+                streams_group = out.create_group("streams")
+
+                # first level
+                alignment_group = streams_group.create_group("classes")
+                alignment_group.attrs["parser"] = "sparse"
+                alignment_group.create_dataset(
+                    "feature_names",
+                    data=[b"label_%d" % l for l in range(self.num_tied_classes)],
+                    dtype=string_dt,
+                )
+
+                # second level
+                alignment_data = alignment_group.create_group("data")
+
+                for cache_idx in range(len(self._cache_file_paths())):
+                    with h5py.File(self._shard_hdf_file(cache_idx), "r") as shard:
+                        for seq_name in shard["seq_names"].asstr():
+                            if seq_name in seen:
+                                logging.warning(f"skipping duplicate segment {seq_name} in cache file {cache_idx}")
+                                continue
+                            seen.add(seq_name)
+                            seq_names.append(seq_name)
+
+                            ds_name = seq_name.replace("/", "\\")
+                            alignment_data.create_dataset(ds_name, data=shard["data"][ds_name][...])
+
+                out.create_dataset("seq_names", data=[s.encode() for s in seq_names], dtype=string_dt)
+
+            shutil.move(f, self.out_hdf_file.get_path())
+
         with open(self.out_segments, "wt") as file:
             file.writelines((f"{seq_name.strip()}\n" for seq_name in seq_names))
 
-    def compute_targets(
-        self, alignment_states: typing.List[str], state_tying: typing.Dict[str, int]
-    ) -> typing.List[int]:
-        targets = [state_tying[allophone] for allophone in alignment_states]
+        for cache_idx in range(len(self._cache_file_paths())):
+            os.remove(self._shard_hdf_file(cache_idx))
+
+    def build_lookup(self, allophones: typing.List[str], state_tying: typing.Dict[str, int]) -> typing.Any:
+        """
+        :return: (allophone index, state) -> tied class table, -1 where the state tying has no entry
+        """
+        num_states = 1 + max(int(k.rsplit(".", 1)[1]) for k in state_tying.keys())
+        table = np.full((len(allophones), num_states), -1, dtype=np.int64)
+        for i, allophone in enumerate(allophones):
+            for state in range(num_states):
+                table[i, state] = state_tying.get(f"{allophone}.{state:d}", -1)
+        return _StateTyingLookup(allophones=allophones, table=table)
+
+    def compute_targets(self, alignment: np.ndarray, lookup: typing.Any) -> np.ndarray:
+        """
+        :param alignment: [T, 2], allophone index and state per frame
+        :param lookup: from :func:`build_lookup`
+        :return: [T], tied class per frame
+        """
+        return lookup.tied_classes(alignment[:, 0], alignment[:, 1])
+
+
+class _StateTyingLookup:
+    def __init__(self, allophones: typing.List[str], table: np.ndarray):
+        self.allophones = allophones
+        self.table = table
+
+    def tied_classes(self, allophone_ids: np.ndarray, states: np.ndarray) -> np.ndarray:
+        valid = states < self.table.shape[1]
+        targets = np.where(valid, self.table[allophone_ids, np.minimum(states, self.table.shape[1] - 1)], -1)
+        if (targets < 0).any():
+            t = int(np.flatnonzero(targets < 0)[0])
+            raise KeyError(f"{self.allophones[allophone_ids[t]]}.{states[t]:d}")
         return targets
 
 
 class RasrForcedTriphoneAlignmentToHDF(RasrAlignmentToHDF):
-    first = True
+    """
+    Like :class:`RasrAlignmentToHDF`, but replaces the contexts of all non-silence allophones
+    by the neighboring phonemes in the alignment, i.e. the phonemes of the previous and next run
+    of frames with a different center phoneme ("#" at the boundaries and for silence).
+    """
 
-    def compute_targets(
-        self, alignment_states: typing.List[str], state_tying: typing.Dict[str, int]
-    ) -> typing.List[int]:
-        decomposed_alignment = [AllophoneState.from_alignment_state(s) for s in alignment_states]
-        forced_triphone_alignment = []
-
-        for i, a_st in enumerate(decomposed_alignment):
-            if a_st.ph == "[SILENCE]":
-                forced_triphone_alignment.append(str(a_st))
-                continue
+    def build_lookup(self, allophones: typing.List[str], state_tying: typing.Dict[str, int]) -> typing.Any:
+        base = super().build_lookup(allophones=allophones, state_tying=state_tying)
+        return _ForcedTriphoneLookup(base=base, state_tying=state_tying)
 
-            next_left = (st.as_context() for st in decomposed_alignment[i::-1] if st.ph != a_st.ph)
-            next_right = (st.as_context() for st in decomposed_alignment[i:] if st.ph != a_st.ph)
+    def compute_targets(self, alignment: np.ndarray, lookup: typing.Any) -> np.ndarray:
+        return lookup.forced_triphone_tied_classes(alignment[:, 0], alignment[:, 1])
 
-            in_ctx = dataclasses.replace(a_st, ctx_l=next(next_left, "#"), ctx_r=next(next_right, "#"))
 
-            forced_triphone_alignment.append(str(in_ctx))
+class _ForcedTriphoneLookup:
+    BOUNDARY = 0  # context id of "#"
 
-        if self.first:
-            self.first = False
-            logging.info(f"Example alignment: {forced_triphone_alignment}")
+    def __init__(self, base: _StateTyingLookup, state_tying: typing.Dict[str, int]):
+        self.base = base
+        self.state_tying = state_tying
 
-        return super().compute_targets(forced_triphone_alignment, state_tying)
+        # per allophone index: parsed allophone, id of the center phoneme (-1 if not parseable), id of its context
+        self.parsed: typing.List[typing.Optional[AllophoneState]] = []
+        phonemes = {}
+        contexts = {"#": self.BOUNDARY}
+        ph_ids, ctx_ids, is_silence = [], [], []
+        for allophone in base.allophones:
+            try:
+                a_st = AllophoneState.from_alignment_state(allophone)
+            except AttributeError:
+                a_st = None
+            self.parsed.append(a_st)
+            if a_st is None:
+                ph_ids.append(-1)
+                ctx_ids.append(self.BOUNDARY)
+                is_silence.append(False)
+                continue
+            ph_ids.append(phonemes.setdefault(a_st.ph, len(phonemes)))
+            ctx_ids.append(contexts.setdefault(a_st.as_context(), len(contexts)))
+            is_silence.append(a_st.ph == "[SILENCE]")
+        self.ph_ids = np.array(ph_ids, dtype=np.int64)
+        self.ctx_ids = np.array(ctx_ids, dtype=np.int64)
+        self.is_silence = np.array(is_silence, dtype=bool)
+        self.contexts = [ctx for ctx, _ in sorted(contexts.items(), key=lambda kv: kv[1])]
+
+        # (allophone index, state, left context id, right context id) -> tied class, filled on demand
+        self.cache: typing.Dict[typing.Tuple[int, int, int, int], int] = {}
+        self.first = True
+
+    def forced_triphone_tied_classes(self, allophone_ids: np.ndarray, states: np.ndarray) -> np.ndarray:
+        if len(allophone_ids) == 0:
+            return np.zeros((0,), dtype=np.int64)
+
+        ph = self.ph_ids[allophone_ids]
+        if (ph < 0).any():
+            t = int(np.flatnonzero(ph < 0)[0])
+            raise AttributeError(f"{self.base.allophones[allophone_ids[t]]}.{states[t]:d} is not an allophone state")
+
+        # runs of frames with the same center phoneme, the contexts are the phonemes of the neighboring runs
+        is_run_start = np.concatenate([[True], ph[1:] != ph[:-1]])
+        run_idx = np.cumsum(is_run_start) - 1
+        run_ctx = self.ctx_ids[allophone_ids[is_run_start]]
+        ctx_l = np.concatenate([[self.BOUNDARY], run_ctx[:-1]])[run_idx]
+        ctx_r = np.concatenate([run_ctx[1:], [self.BOUNDARY]])[run_idx]
+
+        # silence keeps its original allophone
+        silence = self.is_silence[allophone_ids]
+        ctx_l[silence] = self.BOUNDARY
+        ctx_r[silence] = self.BOUNDARY
+
+        keys = np.stack([allophone_ids, states, ctx_l, ctx_r], axis=-1)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        unique_targets = np.array([self._tied_class(*(int(v) for v in key)) for key in unique_keys], dtype=np.int64)
+        return unique_targets[inverse.reshape(-1)]
+
+    def _tied_class(self, allophone_id: int, state: int, ctx_l: int, ctx_r: int) -> int:
+        key = (allophone_id, state, ctx_l, ctx_r)
+        if key not in self.cache:
+            a_st = self.parsed[allophone_id]
+            if a_st.ph == "[SILENCE]":
+                allophone = str(a_st)
+            else:
+                allophone = str(
+                    AllophoneState(ctx_l=self.contexts[ctx_l], ctx_r=self.contexts[ctx_r], ph=a_st.ph, rest=a_st.rest)
+                )
+            if self.first:
+                self.first = False
+                logging.info(f"Example allophone state: {allophone}.{state:d}")
+            self.cache[key] = self.state_tying[f"{allophone}.{state:d}"]
+        return self.cache[key]
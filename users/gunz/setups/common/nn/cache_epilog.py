@@ -1,4 +1,4 @@
-__all__ = ["hdf_dataset_cache_epilog"]
+__all__ = ["hdf_dataset_cache_epilog", "get_parallel_hdf_dataset_cache_epilog"]
 
 from textwrap import dedent
 
@@ -47,3 +47,70 @@ hdf_dataset_cache_epilog = dedent(
         cache(dataset)
     """
 )
+
+
+def get_parallel_hdf_dataset_cache_epilog(num_workers: int = 8) -> str:
+    """
+    Like `hdf_dataset_cache_epilog`, but caches the HDF files of all (sub) datasets concurrently
+    using a bounded thread pool. The time and throughput of every cached file is logged.
+
+    :param num_workers: max number of files copied by the cache manager at the same time
+    """
+
+    assert num_workers > 0
+
+    return dedent(
+        f"""
+        import concurrent.futures
+        import importlib
+        import logging
+        import os
+        import sys
+        import time
+
+        sys.path.append("/usr/local/")
+        sys.path.append("/usr/local/cache-manager/")
+
+        cm = importlib.import_module("cache-manager")
+
+        def cache_file(f):
+            start = time.monotonic()
+            cached = cm.cacheFile(f)
+            duration = time.monotonic() - start
+            try:
+                size_mb = os.path.getsize(cached) / 1024**2
+            except OSError:
+                size_mb = float("nan")
+            logging.info(
+                f"cached {{f}} -> {{cached}}: {{size_mb:.1f}}MB in {{duration:.2f}}s "
+                f"({{size_mb / max(duration, 1e-6):.1f}}MB/s)"
+            )
+            return cached
+
+        def collect(dataset, to_cache):
+            clazz = dataset["class"].lower()
+            if clazz in ["nextgenhdfdataset", "hdfdataset"]:
+                to_cache.append(dataset)
+            elif clazz in ["metadataset", "combineddataset"]:
+                # Recurse into the sub datasets
+
+                for sub_dataset in dataset["datasets"].values():
+                    collect(sub_dataset, to_cache)
+            else:
+                # Nothing to cache here.
+                pass
+
+        to_cache = []
+        collect(dev, to_cache)
+        collect(train, to_cache)
+
+        cache_start = time.monotonic()
+        num_files = sum(len(dataset["files"]) for dataset in to_cache)
+        logging.info(f"caching {{num_files}} files using {num_workers} threads...")
+        with concurrent.futures.ThreadPoolExecutor(max_workers={num_workers}) as cache_pool:
+            cached = [list(cache_pool.map(cache_file, dataset["files"])) for dataset in to_cache]
+        for dataset, files in zip(to_cache, cached):
+            dataset["files"] = files
+        logging.info(f"cached {{num_files}} files in {{time.monotonic() - cache_start:.2f}}s")
+        """
+    )
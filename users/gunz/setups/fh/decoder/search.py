@@ -20,6 +20,7 @@ from ...common.lm_config import TfRnnLmRasrConfig
 from ...common.tdp import TDP, format_tdp
 from ..factored import LabelInfo, PhoneticContext
 from ..rust_scorer import RecompileTfGraphJob
+from ..util.adaptive_search import AdaptiveGridSearchJob
 from ..util.argmin import ComputeArgminJob
 from .config import PosteriorScales, PriorInfo, SearchParameters
 from .scorer import FactoredHybridFeatureScorer
@@ -690,28 +691,14 @@ class FHDecoder:
         pre_path: str = "scales",
         cpu_slow: bool = True,
     ) -> SearchParameters:
-        assert len(prior_scales) > 0
-        assert len(tdp_scales) > 0
-
         recog_args = dataclasses.replace(search_parameters, altas=altas_value, beam=altas_beam)
-
-        if isinstance(prior_scales, np.ndarray):
-            prior_scales = [(s,) for s in prior_scales] if prior_scales.ndim == 1 else [tuple(s) for s in prior_scales]
-
-        prior_scales = [tuple(round(p, 2) for p in priors) for priors in prior_scales]
-        prior_scales = [
-            (p, 0.0, 0.0)
-            if isinstance(p, float)
-            else (p[0], 0.0, 0.0)
-            if len(p) == 1
-            else (p[0], p[1], 0.0)
-            if len(p) == 2
-            else p
-            for p in prior_scales
-        ]
-        tdp_scales = [round(s, 2) for s in tdp_scales]
-        tdp_sil = tdp_sil if tdp_sil is not None else [recog_args.tdp_silence]
-        tdp_speech = tdp_speech if tdp_speech is not None else [recog_args.tdp_speech]
+        prior_scales, tdp_scales, tdp_sil, tdp_speech = self._get_scale_grid(
+            recog_args=recog_args,
+            prior_scales=prior_scales,
+            tdp_scales=tdp_scales,
+            tdp_sil=tdp_sil,
+            tdp_speech=tdp_speech,
+        )
 
         jobs = {
             ((c, l, r), tdp, tdp_sl, tdp_sp): self.recognize_count_lm(
@@ -765,11 +752,186 @@ class FHDecoder:
             best_overall_wer.out_min,
         )
 
+        return self._search_parameters_from_argmin(search_parameters, best_overall_n.out_argmin)
+
+    def recognize_optimize_scales_adaptive(
+        self,
+        *,
+        label_info: LabelInfo,
+        num_encoder_output: int,
+        search_parameters: SearchParameters,
+        prior_scales: typing.Union[
+            typing.List[typing.Tuple[float]],  # center
+            typing.List[typing.Tuple[float, float]],  # center, left
+            typing.List[typing.Tuple[float, float, float]],  # center, left, right
+            np.ndarray,
+        ],
+        tdp_scales: typing.Union[typing.List[float], np.ndarray],
+        tdp_sil: typing.Optional[typing.List[typing.Tuple[TDP, TDP, TDP, TDP]]] = None,
+        tdp_speech: typing.Optional[typing.List[typing.Tuple[TDP, TDP, TDP, TDP]]] = None,
+        initial: typing.Optional[typing.Tuple[int, int, int, int]] = None,
+        mode: str = "coordinate_descent",
+        subset_fraction: float = 0.2,
+        subset_concurrent: typing.Optional[int] = None,
+        max_rounds: int = 3,
+        eta: int = 3,
+        altas_value=14.0,
+        altas_beam=14.0,
+        keep_value=10,
+        gpu: typing.Optional[bool] = None,
+        cpu_rqmt: typing.Optional[int] = None,
+        mem_rqmt: typing.Optional[int] = None,
+        crp_update: typing.Optional[typing.Callable[[rasr.RasrConfig], typing.Any]] = None,
+        pre_path: str = "scales",
+        cpu_slow: bool = True,
+    ) -> SearchParameters:
+        """
+        Like `recognize_optimize_scales`, but instead of decoding the full grid of scales, the grid is searched
+        adaptively by an `AdaptiveGridSearchJob` on a random subset of the segments of the search corpus.
+        Only the best point is decoded on the full corpus.
+
+        The sclite scoring of a subset decoding counts the words of the missing segments as deletions. This is the
+        same constant offset for all points of one subset, so the argmin is not affected.
+
+        :param initial: indices into (prior_scales, tdp_scales, tdp_sil, tdp_speech) of the start point,
+            defaults to the first value of every axis
+        :param mode: "coordinate_descent" or "successive_halving", see `AdaptiveGridSearchJob`
+        :param subset_fraction: fraction of the segments to decode during the search
+        :param subset_concurrent: concurrency of the subset decodings, defaults to the one of the search CRP
+        """
+        recog_args = dataclasses.replace(search_parameters, altas=altas_value, beam=altas_beam)
+        axes = self._get_scale_grid(
+            recog_args=recog_args,
+            prior_scales=prior_scales,
+            tdp_scales=tdp_scales,
+            tdp_sil=tdp_sil,
+            tdp_speech=tdp_speech,
+        )
+        initial = tuple(axis[i] for axis, i in zip(axes, initial or (0, 0, 0, 0)))
+
+        all_segments = i6_core.corpus.SegmentCorpusJob(self.search_crp.corpus_config.file, 1).out_single_segment_files[
+            1
+        ]
+        subset_concurrent = subset_concurrent or self.search_crp.concurrent
+
+        def get_subset_segments(fraction: float) -> tk.Path:
+            split = i6_core.corpus.ShuffleAndSplitSegmentsJob(
+                segment_file=all_segments,
+                split={"subset": fraction, "rest": 1.0 - fraction},
+            )
+            return i6_core.corpus.SplitSegmentFileJob(
+                split.out_segments["subset"], concurrent=subset_concurrent
+            ).out_segment_path
+
+        def recog_func(point: typing.Tuple, fraction: float) -> tk.Variable:
+            (c, l, r), tdp, tdp_sl, tdp_sp = point
+
+            def update_crp(crp: rasr.RasrConfig):
+                if crp_update is not None:
+                    crp_update(crp)
+                if fraction < 1.0:
+                    crp.concurrent = subset_concurrent
+                    crp.segment_path = get_subset_segments(fraction)
+
+            fraction_suffix = f"-subset{fraction}" if fraction < 1.0 else ""
+            recog_jobs = self.recognize_count_lm(
+                add_sis_alias_and_output=False,
+                calculate_stats=False,
+                cpu_rqmt=cpu_rqmt,
+                crp_update=update_crp,
+                gpu=gpu,
+                is_min_duration=False,
+                keep_value=keep_value,
+                label_info=label_info,
+                mem_rqmt=mem_rqmt,
+                name_override=f"{self.name}-pC{c}-pL{l}-pR{r}-tdp{tdp}-tdpSil{tdp_sl}-tdpSp{tdp_sp}{fraction_suffix}",
+                num_encoder_output=num_encoder_output,
+                opt_lm_am=False,
+                rerun_after_opt_lm=False,
+                search_parameters=dataclasses.replace(
+                    recog_args, tdp_scale=tdp, tdp_silence=tdp_sl, tdp_speech=tdp_sp
+                ).with_prior_scale(left=l, center=c, right=r),
+                remove_or_set_concurrency=False,
+            )
+
+            if cpu_slow:
+                recog_jobs.search.update_rqmt("run", {"cpu_slow": True})
+            recog_jobs.lat2ctm.set_keep_value(keep_value)
+            recog_jobs.search.set_keep_value(keep_value)
+
+            pre_name = f"{pre_path}/{self.name}/Lm{recog_args.lm_scale}-Pron{recog_args.pron_scale}-pC{c}-pL{l}-pR{r}-tdp{tdp}-tdpSil{format_tdp(tdp_sl)}-tdpSp{format_tdp(tdp_sp)}{fraction_suffix}"
+            recog_jobs.search.add_alias(pre_name)
+
+            return recog_jobs.sclite.out_num_errors
+
+        search_job = AdaptiveGridSearchJob(
+            axes=list(axes),
+            initial=initial,
+            recog_func=recog_func,
+            identity={
+                "name": self.name,
+                "model_path": self.model_path,
+                "graph": self.graph,
+                "corpus": self.search_crp.corpus_config.file,
+                "eval_files": self.eval_files,
+                "label_info": label_info,
+                "num_encoder_output": num_encoder_output,
+                "search_parameters": recog_args,
+                "keep_value": keep_value,
+                "subset_concurrent": subset_concurrent,
+            },
+            mode=mode,
+            subset_fraction=subset_fraction,
+            max_rounds=max_rounds,
+            eta=eta,
+        )
+        search_job.add_alias(f"{pre_path}/{self.name}/adaptive-search")
+        tk.register_output(f"scales-best/{self.name}/args", search_job.out_argmin)
+        tk.register_output(f"scales-best/{self.name}/num_err", search_job.out_min)
+        tk.register_output(f"scales-best/{self.name}/search.log", search_job.out_log)
+
+        return self._search_parameters_from_argmin(search_parameters, search_job.out_argmin)
+
+    def _get_scale_grid(
+        self,
+        *,
+        recog_args: SearchParameters,
+        prior_scales: typing.Union[typing.List[typing.Tuple[float, ...]], np.ndarray],
+        tdp_scales: typing.Union[typing.List[float], np.ndarray],
+        tdp_sil: typing.Optional[typing.List[typing.Tuple[TDP, TDP, TDP, TDP]]],
+        tdp_speech: typing.Optional[typing.List[typing.Tuple[TDP, TDP, TDP, TDP]]],
+    ) -> typing.Tuple[typing.List[typing.Tuple[float, float, float]], typing.List[float], typing.List, typing.List]:
+        assert len(prior_scales) > 0
+        assert len(tdp_scales) > 0
+
+        if isinstance(prior_scales, np.ndarray):
+            prior_scales = [(s,) for s in prior_scales] if prior_scales.ndim == 1 else [tuple(s) for s in prior_scales]
+
+        prior_scales = [tuple(round(p, 2) for p in priors) for priors in prior_scales]
+        prior_scales = [
+            (p, 0.0, 0.0)
+            if isinstance(p, float)
+            else (p[0], 0.0, 0.0)
+            if len(p) == 1
+            else (p[0], p[1], 0.0)
+            if len(p) == 2
+            else p
+            for p in prior_scales
+        ]
+        tdp_scales = [round(s, 2) for s in tdp_scales]
+        tdp_sil = tdp_sil if tdp_sil is not None else [recog_args.tdp_silence]
+        tdp_speech = tdp_speech if tdp_speech is not None else [recog_args.tdp_speech]
+
+        return prior_scales, tdp_scales, tdp_sil, tdp_speech
+
+    def _search_parameters_from_argmin(
+        self, search_parameters: SearchParameters, argmin: DelayedBase
+    ) -> SearchParameters:
         # cannot destructure, need to use indices
-        best_priors = best_overall_n.out_argmin[0]
-        best_tdp_scale = best_overall_n.out_argmin[1]
-        best_tdp_sil = best_overall_n.out_argmin[2]
-        best_tdp_sp = best_overall_n.out_argmin[3]
+        best_priors = argmin[0]
+        best_tdp_scale = argmin[1]
+        best_tdp_sil = argmin[2]
+        best_tdp_sp = argmin[3]
 
         def push_delayed_tuple(
             argmin: DelayedBase,
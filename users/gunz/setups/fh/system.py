@@ -888,8 +888,10 @@ class FactoredHybridSystem(NnSystem):
         dev_data: typing.Optional[typing.Dict[str, typing.Any]] = None,
         train_data: typing.Optional[typing.Dict[str, typing.Any]] = None,
         use_old_cache_epilog: bool = False,
+        cache_epilog: typing.Optional[str] = None,
     ):
         assert isinstance(returnn_config, returnn.ReturnnConfig)
+        assert cache_epilog is None or not use_old_cache_epilog
 
         nn_train_args = copy.copy(nn_train_args)
 
@@ -913,7 +915,11 @@ class FactoredHybridSystem(NnSystem):
         returnn_config = copy.deepcopy(returnn_config)
         update_config = returnn.ReturnnConfig(
             config={"dev": dev_data, "train": train_data},
-            python_epilog=hdf_dataset_cache_epilog if not use_old_cache_epilog else hdf_dataset_cache_epilog_v0,
+            python_epilog=cache_epilog
+            if cache_epilog is not None
+            else hdf_dataset_cache_epilog
+            if not use_old_cache_epilog
+            else hdf_dataset_cache_epilog_v0,
         )
         returnn_config.update(update_config)
 
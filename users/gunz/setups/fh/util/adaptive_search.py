@@ -0,0 +1,209 @@
+import itertools
+import math
+import typing
+
+from sisyphus import tk, Job, Task
+
+Point = typing.Tuple[typing.Any, ...]
+RecogFunc = typing.Callable[[Point, float], tk.Variable]
+
+
+class AdaptiveGridSearchJob(Job):
+    """
+    Adaptive search for the minimum of a function defined on a grid, typically the number of
+    recognition errors as function of decoding scales.
+
+    Instead of evaluating the full product of all axes, only promising points are evaluated.
+    The evaluations are created lazily in `update()` via `recog_func(point, corpus_fraction)`,
+    which is called in the graph process and must return a variable holding the value to minimize
+    (e.g. `ScliteJob.out_num_errors`) on the given fraction of the corpus.
+
+    Modes:
+        - "coordinate_descent": starting at `initial`, optimize one axis at a time while keeping the
+          others fixed, on `subset_fraction` of the corpus. Repeat over all axes until no axis changes
+          anymore or `max_rounds` is reached.
+        - "successive_halving": evaluate all grid points on `subset_fraction` of the corpus, keep the best
+          1/`eta` of them and evaluate those on `eta` times more data, until a single point remains.
+
+    The best point is finally evaluated on the full corpus (fraction 1.0), its value is `out_min`.
+    Values on different corpus fractions are never compared with each other.
+    """
+
+    def __init__(
+        self,
+        *,
+        axes: typing.List[typing.List[typing.Any]],
+        initial: Point,
+        recog_func: RecogFunc,
+        identity: typing.Any,
+        mode: str = "coordinate_descent",
+        subset_fraction: float = 0.2,
+        max_rounds: int = 3,
+        eta: int = 3,
+    ):
+        """
+        :param axes: candidate values for every parameter, a point is a tuple with one value per axis
+        :param initial: start point of the coordinate descent, also evaluated first in any mode
+        :param recog_func: (point, corpus fraction) -> variable holding the value to minimize, not hashed
+        :param identity: hashed instead of recog_func, must identify everything recog_func depends on
+            (e.g. name, model checkpoint, graph, corpus and search parameters), otherwise different searches
+            with the same grid would end up being the same job
+        :param mode: "coordinate_descent" or "successive_halving"
+        :param subset_fraction: corpus fraction used for the search (first rung for successive halving)
+        :param max_rounds: max number of passes over all axes in coordinate descent
+        :param eta: reduction factor for successive halving
+        """
+        assert mode in ["coordinate_descent", "successive_halving"]
+        assert len(axes) == len(initial)
+        assert all(v in axis for v, axis in zip(initial, axes)), "initial point must lie on the grid"
+        assert 0.0 < subset_fraction <= 1.0
+        assert eta > 1
+
+        self.axes = [list(axis) for axis in axes]
+        self.initial = tuple(initial)
+        self.recog_func = recog_func
+        self.identity = identity
+        self.mode = mode
+        self.subset_fraction = subset_fraction
+        self.max_rounds = max_rounds
+        self.eta = eta
+
+        self.out_argmin = self.output_var("argmin", pickle=False)
+        self.out_min = self.output_var("min", pickle=False)
+        self.out_log = self.output_path("search.log")
+
+        self.rqmt = None
+
+        self._results: typing.Dict[typing.Tuple[Point, float], tk.Variable] = {}
+        self._log: typing.List[str] = []
+        self._best: typing.Optional[Point] = None
+
+        # coordinate descent state
+        self._current = self.initial
+        self._round = 0
+        self._axis = 0
+        self._changed = False
+        self._axis_candidates: typing.Optional[typing.List[Point]] = None
+
+        # successive halving state
+        self._rung = 0
+        self._rung_points: typing.Optional[typing.List[Point]] = None
+
+        self._request([self.initial], self.subset_fraction)
+
+    @classmethod
+    def hash(cls, parsed_args):
+        d = dict(parsed_args)
+        d.pop("recog_func")
+        return super().hash(d)
+
+    def __getstate__(self):
+        # recog_func is only needed in the graph process and usually a closure that cannot be pickled
+        state = super().__getstate__() if hasattr(super(), "__getstate__") else self.__dict__
+        state = dict(state)
+        state["recog_func"] = None
+        return state
+
+    def tasks(self) -> typing.Iterator[Task]:
+        yield Task("run", mini_task=True)
+
+    def _request(self, points: typing.List[Point], fraction: float):
+        for point in points:
+            key = (point, fraction)
+            if key in self._results:
+                continue
+            value = self.recog_func(point, fraction)
+            self._results[key] = value
+            self.add_input(value)
+
+    def _value(self, point: Point, fraction: float) -> float:
+        return self._results[(point, fraction)].get()
+
+    def _argmin(self, points: typing.List[Point], fraction: float) -> Point:
+        # stable w.r.t. the order of points, ties keep the first (i.e. current) point
+        return min(points, key=lambda p: self._value(p, fraction))
+
+    def update(self):
+        """
+        Called by sisyphus whenever all current inputs are available.
+        Advances the search until new evaluations are needed or the search is finished.
+        """
+        while self._best is None:
+            if any(not v.available() for v in self._results.values()):
+                return
+            points, fraction = (
+                self._next_coordinate_descent() if self.mode == "coordinate_descent" else self._next_halving()
+            )
+            if self._best is not None:
+                self._request([self._best], 1.0)
+                return
+            self._request(points, fraction)
+
+    def _next_coordinate_descent(self) -> typing.Tuple[typing.List[Point], float]:
+        fraction = self.subset_fraction
+        while True:
+            if self._axis_candidates is not None:
+                best = self._argmin(self._axis_candidates, fraction)
+                self._log.append(
+                    f"round {self._round} axis {self._axis}: "
+                    + ", ".join(f"{p[self._axis]}={self._value(p, fraction)}" for p in self._axis_candidates)
+                )
+                if best != self._current:
+                    self._current = best
+                    self._changed = True
+                self._axis_candidates = None
+                self._axis += 1
+
+            if self._axis == len(self.axes):
+                self._round += 1
+                if not self._changed or self._round >= self.max_rounds:
+                    self._best = self._current
+                    return [], 1.0
+                self._axis = 0
+                self._changed = False
+
+            if len(self.axes[self._axis]) == 1:
+                self._axis += 1
+                continue
+
+            self._axis_candidates = [
+                self._current[: self._axis] + (v,) + self._current[self._axis + 1 :] for v in self.axes[self._axis]
+            ]
+            missing = [p for p in self._axis_candidates if (p, fraction) not in self._results]
+            if len(missing) > 0:
+                return missing, fraction
+
+    def _rung_fraction(self, rung: int) -> float:
+        return min(1.0, self.subset_fraction * self.eta**rung)
+
+    def _next_halving(self) -> typing.Tuple[typing.List[Point], float]:
+        if self._rung_points is None:
+            self._rung_points = [tuple(p) for p in itertools.product(*self.axes)]
+            return self._rung_points, self._rung_fraction(0)
+
+        fraction = self._rung_fraction(self._rung)
+        ranked = sorted(self._rung_points, key=lambda p: self._value(p, fraction))
+        self._log.append(
+            f"rung {self._rung} (fraction {fraction}): "
+            + ", ".join(f"{p}={self._value(p, fraction)}" for p in ranked)
+        )
+        if len(ranked) == 1 or fraction >= 1.0:
+            self._best = ranked[0]
+            return [], 1.0
+
+        self._rung += 1
+        self._rung_points = ranked[: max(1, math.ceil(len(ranked) / self.eta))]
+        return self._rung_points, self._rung_fraction(self._rung)
+
+    def run(self):
+        assert self._best is not None, "search did not finish, update() was not called for all evaluations"
+
+        with open(self.out_log.get_path(), "wt") as f:
+            f.write("\n".join(self._log))
+            f.write(f"\nbest: {self._best}\n")
+            f.write(f"evaluations: {len(self._results)} (full grid: {math.prod(len(a) for a in self.axes)})\n")
+            for (point, fraction), value in self._results.items():
+                f.write(f"{point} {fraction} {value.get()}\n")
+
+        self.out_argmin.set(self._best)
+        self.out_min.set(self._value(self._best, 1.0))
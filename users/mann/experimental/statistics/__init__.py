@@ -130,191 +130,24 @@ def resolve_bundle(alignment):
         alignment = {i: line.rstrip("\n") for i, line in enumerate(f, 1)}
     return alignment
 
-class AlignmentStatisticsJob(Job):
+from . import basic as _basic
 
-    def __init__(self, alignment, allophones, segments, concurrent, archiver_exe=None):
-        # self.csp = csp
-        self.alignment = alignment
-        self.allophones = allophones
-        self.segments = segments
-        self.concurrent = concurrent
+# The implementation lives in basic.py, the statistics jobs are re-declared in the
+# package module so that their sisyphus job paths do not change.
+class AlignmentStatisticsJob(_basic.AlignmentStatisticsJob):
+    pass
 
-        self.exe = RasrCommand.select_exe(archiver_exe, "archiver")
-        self.single_counts = {i: self.output_var("single_counts.{}".format(i)) for i in range(1, self.concurrent + 1)}
-        self.counts = self.output_var("counts")
-
-        self.rqmt = {'time': 1,
-                    'cpu' : 1,
-                    'gpu' : 0,
-                    'mem' : 1}
-
-    def tasks(self):
-        yield Task('run', resume='run', rqmt=self.rqmt, args=range(1, self.concurrent + 1))
-        yield Task('gather', resume='gather', mini_task=True)
-    
-    def archive(self, alignment, segment):
-        args = [self.exe,
-                '--allophone-file',
-                tk.uncached_path(self.allophones),
-                '--mode', 'show',
-                '--type', 'align',
-                alignment, segment]
-        res = subprocess.run(args,
-                            stdout=subprocess.PIPE)
-        lines = res.stdout.decode('utf-8').split('\n')
-        return lines
-    
-
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = []
-        state_count = 0
-
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
-
-                sil_counter = SilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-                    state_count += 1
-
-                silence_counts.append(sil_counter.counts)
-        
-        res = dict(
-            prepended_silence = sum(c[0] for c in silence_counts if len(c) > 0),
-            appended_silence = sum(c[-1] for c in silence_counts if len(c) > 0),
-            total_silence = sum(sum(c) for c in silence_counts),
-            total_states = state_count
-        )
-        self.single_counts[task_id].set(res)
-    
-    def gather(self):
-        res = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                res[key] += value
-        self.counts.set(dict(res))
-
-
-class SilenceAtSegmentBoundaries(AlignmentStatisticsJob):
-
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = defaultdict(int)
 
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
+class SilenceAtSegmentBoundaries(_basic.SilenceAtSegmentBoundaries):
+    pass
 
-                allo_gen = StateParser(lines)
-                
-                first_allo, _ = next(allo_gen)
-                if "#" in first_allo:
-                    silence_counts["start"] += 1
-                
-                last_allo, _ = next(reversed(allo_gen))
-                if "#" in last_allo:
-                    silence_counts["end"] += 1
-
-                silence_counts["total"] += 1
-        
-        self.single_counts[task_id].set(dict(silence_counts))
-    
-    def gather(self):
-        counter = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                counter[key] += value
-        # normalize
-        res = {
-            "start": counter["start"] / counter["total"],
-            "end"  : counter["end"]   / counter["total"],
-            "total": counter["total"]
-        } 
-        self.counts.set(res)
-
-
-class PositionalSilenceCounter(AlignmentStatisticsJob):
-
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = []
-
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
-
-                sil_counter = SilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
 
-                silence_counts.append(sil_counter.counts)
-        
-        res = dict(
-            start_loops = sum(c[0] - 1 for c in silence_counts),
-            end_loops   = sum(c[-1] - 1 for c in silence_counts),
-            inner_loops = sum(sum(c[1:-1]) - len(c) + 2 for c in silence_counts),
-            inner_count = sum(len(c) - 2 for c in silence_counts),
-            seg_count   = len(silence_counts)
-        )
-        self.single_counts[task_id].set(res)
-    
-    def gather(self):
-        counter = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                counter[key] += value
-        # normalize
-        res = {
-            "start_loops": counter["start_loops"] / counter["seg_count"],
-            "end_loops"  : counter["end_loops"]   / counter["seg_count"],
-            "inner_loops": counter["inner_loops"] / counter["inner_count"]
-        } 
-        self.counts.set(res)
-
-
-class SilenceBetweenWords(AlignmentStatisticsJob):
-
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = defaultdict(int)
-
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
+class PositionalSilenceCounter(_basic.PositionalSilenceCounter):
+    pass
 
-                sil_counter = ContextualSilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-                sil_counter.maybe_remove_last()
 
-                silence_counts["silence_insertions"] += sil_counter.sil_count
-                silence_counts["word_transitions"]   += sil_counter.word_end_count
-        
-        self.single_counts[task_id].set(
-            dict(silence_counts)
-        )
-    
-    def gather(self):
-        counter = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                counter[key] += value
-        # normalize
-        self.counts.set(counter["silence_insertions"] / counter["word_transitions"])
+class SilenceBetweenWords(_basic.SilenceBetweenWords):
+    pass
 
 class AllophoneSequencer:
     def __init__(self, corpus, lexicon, state_tying, hmm_partition):
@@ -3,6 +3,9 @@ __all__ = [
     "PhonemeCounts",
     "SilenceAtSegmentBoundaries",
     "AlignmentStatisticsJob",
+    "PositionalSilenceCounter",
+    "SilenceBetweenWords",
+    "CombinedAlignmentStatisticsJob",
     "ApplyStateTyingToPhonemeStats",
     "ApplyStateTyingToAllophoneStats"
 ]
@@ -12,6 +15,7 @@ Path = setup_path(__package__)
 
 import sys, os
 import subprocess
+import numpy as np
 import matplotlib.pyplot as plt
 from itertools import filterfalse
 # from tabulate import tabulate
@@ -136,7 +140,178 @@ def resolve_bundle(alignment):
         alignment = {i: line.rstrip("\n") for i, line in enumerate(f, 1)}
     return alignment
 
+class AlignmentCacheReader:
+    """Reads alignments in-process from a RASR alignment cache.
+
+    Yields per segment the allophone ids and hmm states as integer arrays,
+    together with lookup tables for allophone properties so that statistics
+    can be computed with array operations instead of string parsing.
+    """
+    def __init__(self, alignment_path, allophone_path):
+        self.archive = sc.FileArchive(alignment_path)
+        self.archive.setAllophones(allophone_path)
+        allophones = self.archive.allophones
+        self.is_silence = np.array([ContextualSilenceCounter.is_silence(a) for a in allophones], dtype=bool)
+        self.is_speech_end = np.array([ContextualSilenceCounter.is_speech_end(a) for a in allophones], dtype=bool)
+        self.is_lemma_start = np.array([ContextualSilenceCounter.is_lemma_start(a) for a in allophones], dtype=bool)
+
+    def read(self, segment):
+        align = self.archive.read(segment, "align")
+        if len(align) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        align = np.array([(a[1], a[2]) for a in align], dtype=np.int64)
+        return align[:, 0], align[:, 1]
+
+    def iter_segments(self, segment_path):
+        with open(segment_path, "r") as segment_file:
+            for seg in segment_file:
+                seg = seg.rstrip("\n")
+                if not seg:
+                    continue
+                allophone_ids, states = self.read(seg)
+                yield seg, allophone_ids, states
+
+
+def silence_run_lengths(silence_mask):
+    """Lengths of all runs of consecutive silence frames, equivalent to SilenceCounter.counts."""
+    if len(silence_mask) == 0:
+        return np.zeros(0, dtype=np.int64)
+    padded = np.concatenate(([False], silence_mask, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return changes[1::2] - changes[0::2]
+
+
+class AlignmentStatistic:
+    """Accumulates a statistic over segments of one task and normalizes the
+    summed counts of all tasks in `finalize`."""
+    name = None
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def feed(self, reader, allophone_ids, states):
+        raise NotImplementedError
+
+    def result(self):
+        return {key: int(value) for key, value in self.counts.items()}
+
+    @classmethod
+    def finalize(cls, counter):
+        return dict(counter)
+
+
+class SilenceStatistic(AlignmentStatistic):
+    name = "counts"
+
+    def __init__(self):
+        super().__init__()
+        for key in ["prepended_silence", "appended_silence", "total_silence", "total_states"]:
+            self.counts[key] = 0
+
+    def feed(self, reader, allophone_ids, states):
+        runs = silence_run_lengths(reader.is_silence[allophone_ids])
+        if len(runs) > 0:
+            self.counts["prepended_silence"] += runs[0]
+            self.counts["appended_silence"] += runs[-1]
+        self.counts["total_silence"] += runs.sum()
+        self.counts["total_states"] += len(allophone_ids)
+
+
+class BoundarySilenceStatistic(AlignmentStatistic):
+    name = "boundary_silence"
+
+    def feed(self, reader, allophone_ids, states):
+        if len(allophone_ids) == 0:
+            return
+        if reader.is_silence[allophone_ids[0]]:
+            self.counts["start"] += 1
+        if reader.is_silence[allophone_ids[-1]]:
+            self.counts["end"] += 1
+        self.counts["total"] += 1
+
+    @classmethod
+    def finalize(cls, counter):
+        return {
+            "start": counter["start"] / counter["total"],
+            "end"  : counter["end"]   / counter["total"],
+            "total": counter["total"]
+        }
+
+
+class PositionalSilenceStatistic(AlignmentStatistic):
+    name = "positional_silence"
+
+    def feed(self, reader, allophone_ids, states):
+        runs = silence_run_lengths(reader.is_silence[allophone_ids])
+        if len(runs) == 0:
+            return
+        self.counts["start_loops"] += runs[0] - 1
+        self.counts["end_loops"]   += runs[-1] - 1
+        self.counts["inner_loops"] += runs[1:-1].sum() - len(runs) + 2
+        self.counts["inner_count"] += len(runs) - 2
+        self.counts["seg_count"]   += 1
+
+    @classmethod
+    def finalize(cls, counter):
+        return {
+            "start_loops": counter["start_loops"] / counter["seg_count"],
+            "end_loops"  : counter["end_loops"]   / counter["seg_count"],
+            "inner_loops": counter["inner_loops"] / counter["inner_count"]
+        }
+
+
+class SilenceBetweenWordsStatistic(AlignmentStatistic):
+    """Vectorized version of ContextualSilenceCounter."""
+    name = "silence_between_words"
+
+    def feed(self, reader, allophone_ids, states):
+        if len(allophone_ids) == 0:
+            return
+        speech_end = reader.is_speech_end[allophone_ids[:-1]]
+        following = allophone_ids[1:]
+        sil_count = np.sum(speech_end & reader.is_silence[following])
+        word_end_count = np.sum(speech_end & reader.is_lemma_start[following])
+        if reader.is_silence[allophone_ids[-1]]:
+            sil_count = max(sil_count - 1, 0)
+            word_end_count = max(word_end_count - 1, 0)
+        self.counts["silence_insertions"] += sil_count
+        self.counts["word_transitions"]   += word_end_count
+
+    @classmethod
+    def finalize(cls, counter):
+        return counter["silence_insertions"] / counter["word_transitions"]
+
+
+ALIGNMENT_STATISTICS = {
+    stat.name: stat for stat in [
+        SilenceStatistic,
+        BoundarySilenceStatistic,
+        PositionalSilenceStatistic,
+        SilenceBetweenWordsStatistic,
+    ]
+}
+
+
+def compute_alignment_statistics(alignment_path, allophone_path, segment_path, statistics):
+    """Computes all given statistics in a single pass over the alignment cache."""
+    reader = AlignmentCacheReader(alignment_path, allophone_path)
+    accumulators = [stat() for stat in statistics]
+    for _, allophone_ids, states in reader.iter_segments(segment_path):
+        for acc in accumulators:
+            acc.feed(reader, allophone_ids, states)
+    return [acc.result() for acc in accumulators]
+
+
+def gather_counts(single_counts):
+    counter = defaultdict(int)
+    for cs in single_counts:
+        for key, value in cs.items():
+            counter[key] += value
+    return counter
+
+
 class AlignmentStatisticsJob(Job):
+    statistic = SilenceStatistic
 
     def __init__(self, alignment, allophones, segments, concurrent, archiver_exe=None):
         # self.csp = csp
@@ -169,158 +344,74 @@ class AlignmentStatisticsJob(Job):
                             stdout=subprocess.PIPE)
         lines = res.stdout.decode('utf-8').split('\n')
         return lines
-    
 
-    def run(self, task_id):
+    def compute_statistics(self, task_id, statistics):
         alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
         segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = []
-        state_count = 0
-
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
-
-                sil_counter = SilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-                    state_count += 1
-
-                silence_counts.append(sil_counter.counts)
-        
-        res = dict(
-            prepended_silence = sum(c[0] for c in silence_counts if len(c) > 0),
-            appended_silence = sum(c[-1] for c in silence_counts if len(c) > 0),
-            total_silence = sum(sum(c) for c in silence_counts),
-            total_states = state_count
+        return compute_alignment_statistics(
+            alignment_path, tk.uncached_path(self.allophones), segment_path, statistics
         )
+
+    def run(self, task_id):
+        res, = self.compute_statistics(task_id, [self.statistic])
         self.single_counts[task_id].set(res)
     
     def gather(self):
-        res = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                res[key] += value
-        self.counts.set(dict(res))
+        counter = gather_counts(self.single_counts[i].get() for i in range(1, self.concurrent + 1))
+        self.counts.set(self.statistic.finalize(counter))
 
 
 class SilenceAtSegmentBoundaries(AlignmentStatisticsJob):
-
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = defaultdict(int)
-
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
-
-                allo_gen = StateParser(lines)
-                
-                first_allo, _ = next(allo_gen)
-                if "#" in first_allo:
-                    silence_counts["start"] += 1
-                
-                last_allo, _ = next(reversed(allo_gen))
-                if "#" in last_allo:
-                    silence_counts["end"] += 1
-
-                silence_counts["total"] += 1
-        
-        self.single_counts[task_id].set(dict(silence_counts))
-    
-    def gather(self):
-        counter = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                counter[key] += value
-        # normalize
-        res = {
-            "start": counter["start"] / counter["total"],
-            "end"  : counter["end"]   / counter["total"],
-            "total": counter["total"]
-        } 
-        self.counts.set(res)
+    statistic = BoundarySilenceStatistic
 
 
 class PositionalSilenceCounter(AlignmentStatisticsJob):
+    statistic = PositionalSilenceStatistic
 
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
-
-        silence_counts = []
-
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
 
-                sil_counter = SilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
+class SilenceBetweenWords(AlignmentStatisticsJob):
+    statistic = SilenceBetweenWordsStatistic
 
-                silence_counts.append(sil_counter.counts)
-        
-        res = dict(
-            start_loops = sum(c[0] - 1 for c in silence_counts),
-            end_loops   = sum(c[-1] - 1 for c in silence_counts),
-            inner_loops = sum(sum(c[1:-1]) - len(c) + 2 for c in silence_counts),
-            inner_count = sum(len(c) - 2 for c in silence_counts),
-            seg_count   = len(silence_counts)
-        )
-        self.single_counts[task_id].set(res)
-    
-    def gather(self):
-        counter = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                counter[key] += value
-        # normalize
-        res = {
-            "start_loops": counter["start_loops"] / counter["seg_count"],
-            "end_loops"  : counter["end_loops"]   / counter["seg_count"],
-            "inner_loops": counter["inner_loops"] / counter["inner_count"]
-        } 
-        self.counts.set(res)
 
+class CombinedAlignmentStatisticsJob(AlignmentStatisticsJob):
+    """Computes several alignment statistics in one pass over the alignment caches.
 
-class SilenceBetweenWords(AlignmentStatisticsJob):
+    :param statistics: names of the statistics to compute, see ALIGNMENT_STATISTICS.
+        The results are available in `out_statistics[name]` and match the
+        `counts` output of the corresponding single statistic job.
+    """
 
-    def run(self, task_id):
-        alignment_path = tk.uncached_path(resolve_bundle(self.alignment)[task_id])
-        segment_path = tk.uncached_path(self.segments[task_id])
+    def __init__(self, alignment, allophones, segments, concurrent, statistics=tuple(ALIGNMENT_STATISTICS)):
+        assert all(name in ALIGNMENT_STATISTICS for name in statistics), \
+            "Unknown statistics: {}".format(set(statistics) - set(ALIGNMENT_STATISTICS))
+        self.alignment = alignment
+        self.allophones = allophones
+        self.segments = segments
+        self.concurrent = concurrent
+        self.statistics = list(statistics)
 
-        silence_counts = defaultdict(int)
+        self.single_counts = {
+            (name, i): self.output_var("single_counts.{}.{}".format(name, i))
+            for name in self.statistics for i in range(1, self.concurrent + 1)
+        }
+        self.out_statistics = {name: self.output_var(name) for name in self.statistics}
 
-        with open(segment_path, "r") as segment_file:
-            for seg in segment_file:
-                lines = self.archive(alignment_path, seg.rstrip("\n"))
+        self.rqmt = {'time': 1,
+                    'cpu' : 1,
+                    'gpu' : 0,
+                    'mem' : 1}
 
-                sil_counter = ContextualSilenceCounter()
-                for allo, state in allophone_and_state_generator(lines):
-                    sil_counter.feed(allo)
-                sil_counter.maybe_remove_last()
+    def run(self, task_id):
+        results = self.compute_statistics(task_id, [ALIGNMENT_STATISTICS[name] for name in self.statistics])
+        for name, res in zip(self.statistics, results):
+            self.single_counts[(name, task_id)].set(res)
 
-                silence_counts["silence_insertions"] += sil_counter.sil_count
-                silence_counts["word_transitions"]   += sil_counter.word_end_count
-        
-        self.single_counts[task_id].set(
-            dict(silence_counts)
-        )
-    
     def gather(self):
-        counter = defaultdict(int)
-        for i in range(1, self.concurrent + 1):
-            cs = self.single_counts[i].get()
-            for key, value in cs.items():
-                counter[key] += value
-        # normalize
-        self.counts.set(counter["silence_insertions"] / counter["word_transitions"])
+        for name in self.statistics:
+            counter = gather_counts(
+                self.single_counts[(name, i)].get() for i in range(1, self.concurrent + 1)
+            )
+            self.out_statistics[name].set(ALIGNMENT_STATISTICS[name].finalize(counter))
 
 class AllophoneSequencer:
     def __init__(self, corpus, lexicon, state_tying, hmm_partition):
@@ -52,10 +52,57 @@ def get_batch_from_segments(segments, batchSize=10000):
             index = 0
 
 
+def stream_batches_from_segments(segments, batchSize=10000):
+    """
+    Concatenates the frames of the given segments and yields them in batches of batchSize frames,
+    reading only as many segments as needed for the next batch.
+
+    :param Iterable[np.ndarray] segments: per-segment feature arrays of shape [T, F]
+    :param int batchSize: number of frames per batch, the last batch may be smaller
+    """
+    buffer = []
+    bufferedFrames = 0
+    for segment in segments:
+        segment = np.asarray(segment)
+        while len(segment) > 0:
+            take = min(batchSize - bufferedFrames, len(segment))
+            buffer.append(segment[:take])
+            bufferedFrames += take
+            segment = segment[take:]
+            if bufferedFrames == batchSize:
+                yield np.vstack(buffer)
+                buffer = []
+                bufferedFrames = 0
+    if bufferedFrames > 0:
+        yield np.vstack(buffer)
+
+
 ###################################
 # Triphone
 ###################################
 class EstimateSprintTriphoneForwardPriorsJob(Job):
+    """
+    Estimates the triphone forward priors by feeding every encoder frame with all (pastContext, centerState)
+    label combinations through the factored hybrid output network.
+
+    Each session.run gets a chunk of encoder frames tiled over all labels, i.e. [1, L * C, D].
+    This assumes that the network after the encoder output is framewise (no recurrence, convolution or
+    attention over time), such that the tiled frames do not influence each other.
+
+    The chunk size C trades memory for speed: fewer and larger runs are faster, but the tiled batch and the
+    activations of the output network on it grow with L * C.
+    By default, the number of label-frames per run is derived from `mem`, see :meth:`getFramesPerRun`.
+    With L in the thousands and D=512, the default of 8GB gives some dozens of encoder frames per run,
+    i.e. an order of magnitude or more fewer runs than one run per label. Raising `mem` raises C accordingly.
+    With `n_max_label_frames`, the number of label-frames per run can be set explicitly instead.
+    """
+
+    __sis_hash_exclude__ = {"n_max_label_frames": None}
+
+    # rough number of float32 values per label-frame in the output network: the tiled encoder frame,
+    # the label embeddings and the hidden layers of the left/center/right outputs, times the feature dim
+    ACTIVATIONS_PER_FEATURE_DIM = 16
+
     def __init__(
         self,
         graph_path,
@@ -69,9 +116,10 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
         n_state_classes,
         n_contexts,
         n_batch=15000,
+        n_max_label_frames=None,
         cpu=2,
         gpu=1,
-        mem=2,
+        mem=8,
         time=1,
     ):
         self.graph_path = graph_path
@@ -80,8 +128,6 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
         self.data_indices = data_indices
         self.segment_slice = (start_ind_segment, end_ind_segment)
         self.tf_lib = library_path
-        self.triphone_means, self.diphone_means = initialize_dicts_with_zeros(n_contexts, n_state_classes)
-        self.context_means = np.zeros(n_contexts)
         self.numSegments = [
             self.output_path("segmentLength.%d.%d-%d" % (index, start_ind_segment, end_ind_segment), cached=False)
             for index in self.data_indices
@@ -101,6 +147,8 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
         self.n_contexts = n_contexts
         self.n_state_classes = n_state_classes
         self.n_batch = n_batch
+        self.n_max_label_frames = n_max_label_frames
+        self.mem = mem
         self.tensor_map = tensor_map
         self.rqmt = {"cpu": cpu, "gpu": gpu, "mem": mem, "time": float(time)}
 
@@ -111,13 +159,12 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
     def get_dense_label(self, pastLabel, centerState, futureLabel=0):
         return (((centerState * self.n_contexts) + pastLabel) * self.n_contexts) + futureLabel
 
-    def getSegmentFeaturesFromHdf(self, dataIndex):
-        hf = h5py.File(self.data_paths[dataIndex].get_path())
-        segmentNames = list(hf["streams"]["features"]["data"])
-        segments = []
-        for name in segmentNames:
-            segments.append(hf["streams"]["features"]["data"][name])
-        return np.vstack(segments[self.segment_slice[0] : self.segment_slice[1]])
+    def iterSegmentFeaturesFromHdf(self, dataIndex):
+        with h5py.File(self.data_paths[dataIndex].get_path(), "r") as hf:
+            data = hf["streams"]["features"]["data"]
+            segmentNames = list(data)
+            for name in segmentNames[self.segment_slice[0] : self.segment_slice[1]]:
+                yield data[name][()]
 
     def getEncoderOutput(self, session, featureVector):
         return session.run(
@@ -128,7 +175,11 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
             },
         )
 
-    def getPosteriorsOfOutputsWithEncoderOutput(self, session, featureVector, classLabelVector):
+    def getPosteriorsOfOutputsWithEncoderOutput(self, session, featureVector, classLabels):
+        """
+        :param featureVector: encoder output frames of shape [1, T, D]
+        :param np.ndarray classLabels: dense label for every frame, shape [T]
+        """
         feature_in = (
             featureVector.reshape(featureVector.shape[1], 1, featureVector.shape[2])
             if "fwd" in self.tensor_map.in_encoder_output
@@ -138,49 +189,102 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
             [self.tensor_map.out_left_context, self.tensor_map.out_center_state, self.tensor_map.out_right_context],
             feed_dict={
                 self.tensor_map.in_encoder_output: feature_in,
-                self.tensor_map.in_seq_length: [[classLabelVector] * featureVector.shape[1]],
+                self.tensor_map.in_seq_length: [classLabels],
             },
         )
 
+    def getAllDenseLabels(self):
+        """
+        :return: dense labels of all (pastContext, centerState) pairs, shape [n_contexts * n_state_classes],
+            ordered such that the result reshapes to [n_contexts, n_state_classes]
+        """
+        pastLabels, centerStates = np.meshgrid(
+            np.arange(self.n_contexts), np.arange(self.n_state_classes), indexing="ij"
+        )
+        return self.get_dense_label(pastLabel=pastLabels, centerState=centerStates).reshape(-1)
+
+    def getFramesPerRun(self, nLabels, featureDim):
+        """
+        :param int nLabels: number of label combinations every encoder frame is tiled over
+        :param int featureDim: encoder output dim
+        :return: number of encoder frames per session.run
+        :rtype: int
+        """
+        if self.n_max_label_frames is not None:
+            maxLabelFrames = self.n_max_label_frames
+        else:
+            # the requested mem is the budget of the label batch,
+            # the additional mem granted in tasks() is left for the graph, the encoder run and the accumulators
+            bytesPerLabelFrame = 4 * featureDim * self.ACTIVATIONS_PER_FEATURE_DIM
+            maxLabelFrames = int(self.mem * 1024**3 / bytesPerLabelFrame)
+        return max(1, maxLabelFrames // nLabels)
+
     def calculateMeanPosteriors(self, session, taskId):
-        sampleCount = 0
-        segments = self.getSegmentFeaturesFromHdf(self.data_indices[taskId - 1])
+        """
+        Feeds every chunk of encoder frames together with all (pastContext, centerState) label combinations
+        as one batch and accumulates the summed posteriors in dense arrays.
+        The means are the frame-weighted averages over all batches.
+        """
+        denseLabels = self.getAllDenseLabels()  # [L]
+        nLabels = len(denseLabels)
+
+        triphoneSums = np.zeros((self.n_contexts, self.n_state_classes, self.n_contexts))
+        diphoneSums = np.zeros((self.n_contexts, self.n_state_classes))
+        contextSums = np.zeros(self.n_contexts)
 
-        for batch in get_batch_from_segments(segments, self.n_batch):
+        sampleCount = 0
+        segments = self.iterSegmentFeaturesFromHdf(self.data_indices[taskId - 1])
+        for batch in stream_batches_from_segments(segments, self.n_batch):
             bSize = len(batch)
-            denom = sampleCount + bSize
-            if len(batch) == 0:
-                break
-            encoderOutput = self.getEncoderOutput(session, batch)
-            for pastContextId in range(self.n_contexts):
-                for currentState in range(self.n_state_classes):
-                    denselabel = self.get_dense_label(pastLabel=pastContextId, centerState=currentState)
-                    p = self.getPosteriorsOfOutputsWithEncoderOutput(session, encoderOutput[0], denselabel)
-                    # triphone is calculates for each center and left context
-                    tri = (sampleCount * self.triphone_means[pastContextId][currentState]) + (
-                        bSize * np.mean(p[0][0], axis=0)
-                    )
-                    self.triphone_means[pastContextId][currentState] = np.divide(tri, denom)
-                    # diphone is calculated for each context with centerstate 0
-                    if not currentState:
-                        di = (sampleCount * self.diphone_means[pastContextId]) + (bSize * np.mean(p[1][0], axis=0))
-                        self.diphone_means[pastContextId] = np.divide(di, denom)
-                        # context is not label dependent
-                        if not pastContextId:
-                            ctx = (sampleCount * self.context_means) + (bSize * np.mean(p[2][0], axis=0))
-                            self.context_means = np.divide(ctx, denom)
+            encoderOutput = self.getEncoderOutput(session, batch)[0]  # [1, T', D]
+            nEncFrames = encoderOutput.shape[1]
+            framesPerRun = self.getFramesPerRun(nLabels, encoderOutput.shape[2])
+
+            triphoneBatch = np.zeros_like(triphoneSums)
+            diphoneBatch = np.zeros_like(diphoneSums)
+            contextBatch = np.zeros_like(contextSums)
+            for start in range(0, nEncFrames, framesPerRun):
+                chunk = encoderOutput[:, start : start + framesPerRun]  # [1, C, D]
+                chunkLen = chunk.shape[1]
+                # all label combinations in one batch, ordered label-major: [1, L * C, D] and [L * C]
+                # only valid as the output network is framewise, see the class docstring
+                features = np.tile(chunk, (1, nLabels, 1))
+                labels = np.repeat(denseLabels, chunkLen)
+                p = self.getPosteriorsOfOutputsWithEncoderOutput(session, features, labels)
+                # triphone is calculated for each center and left context
+                tri = np.reshape(p[0][0], (self.n_contexts, self.n_state_classes, chunkLen, -1))
+                triphoneBatch += np.sum(tri, axis=2)
+                # diphone is calculated for each context with centerstate 0
+                di = np.reshape(p[1][0], (self.n_contexts, self.n_state_classes, chunkLen, -1))
+                diphoneBatch += np.sum(di[:, 0], axis=1)
+                # context is not label dependent
+                ctx = np.reshape(p[2][0], (nLabels, chunkLen, -1))
+                contextBatch += np.sum(ctx[0], axis=0)
+
+            # weight the mean over the encoder frames with the number of input frames of the batch
+            triphoneSums += bSize * triphoneBatch / nEncFrames
+            diphoneSums += bSize * diphoneBatch / nEncFrames
+            contextSums += bSize * contextBatch / nEncFrames
             sampleCount += bSize
 
         with open(self.numSegments[taskId - 1].get_path(), "wb") as fp:
             pickle.dump(sampleCount, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
-    def dumpMeans(self, taskId):
+        denom = max(sampleCount, 1)
+        return triphoneSums / denom, diphoneSums / denom, contextSums / denom
+
+    def dumpMeans(self, taskId, triphoneMeans, diphoneMeans, contextMeans):
+        # keep the nested dict layout expected by DumpXmlForTriphoneForwardJob
+        triphoneDict = {
+            i: {j: triphoneMeans[i, j] for j in range(self.n_state_classes)} for i in range(self.n_contexts)
+        }
+        diphoneDict = {i: diphoneMeans[i] for i in range(self.n_contexts)}
         with open(self.triphone_files[taskId - 1].get_path(), "wb") as f1:
-            pickle.dump(self.triphone_means, f1, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(triphoneDict, f1, protocol=pickle.HIGHEST_PROTOCOL)
         with open(self.diphone_files[taskId - 1].get_path(), "wb") as f2:
-            pickle.dump(self.diphone_means, f2, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(diphoneDict, f2, protocol=pickle.HIGHEST_PROTOCOL)
         with open(self.context_means[taskId - 1].get_path(), "wb") as f3:
-            pickle.dump(self.context_means, f3, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(contextMeans, f3, protocol=pickle.HIGHEST_PROTOCOL)
 
     def run(self, taskId):
         tf.load_op_library(self.tf_lib)
@@ -189,10 +293,10 @@ class EstimateSprintTriphoneForwardPriorsJob(Job):
         tf.compat.v1.import_graph_def(mg.graph_def, name="")
         # session
         s = tf.compat.v1.Session()
-        returnValue = s.run(["save/restore_all"], feed_dict={"save/Const:0": self.model.get_path()})
+        returnValue = s.run(["save/restore_all"], feed_dict={"save/Const:0": self.model_path.get_path()})
 
-        self.calculateMeanPosteriors(s, taskId)
-        self.dumpMeans(taskId)
+        means = self.calculateMeanPosteriors(s, taskId)
+        self.dumpMeans(taskId, *means)
 
 
 class DumpXmlForTriphoneForwardJob(Job):
@@ -0,0 +1,74 @@
+"""
+Compares the torch monotonic alignment search against the Cython version and the numpy version in commons.py
+regarding the resulting paths and the runtime for typical GlowTTS (t_x, t_y, batch) sizes.
+
+Usage: python3 -m <package>.monotonic_align.benchmark [--device cuda]
+"""
+import argparse
+import time
+
+import torch
+
+from .. import commons
+from . import maximum_path_c, maximum_path_cython, maximum_path_torch
+
+
+def _random_inputs(batch_size, t_x, t_y, device):
+    assert t_y >= t_x
+    x_lengths = torch.randint(t_x // 2, t_x + 1, (batch_size,))
+    y_lengths = torch.maximum(torch.randint(t_y // 2, t_y + 1, (batch_size,)), x_lengths)
+    x_lengths[0], y_lengths[0] = t_x, t_y
+    x_mask = torch.arange(t_x).unsqueeze(0) < x_lengths.unsqueeze(1)  # [b, t_x]
+    y_mask = torch.arange(t_y).unsqueeze(0) < y_lengths.unsqueeze(1)  # [b, t_y]
+    mask = (x_mask.unsqueeze(2) & y_mask.unsqueeze(1)).float()  # [b, t_x, t_y]
+    value = -torch.rand(mask.shape) * 10.0  # log-likelihoods
+    return value.to(device), mask.to(device)
+
+
+def _timed(fn, value, mask, repetitions):
+    fn(value, mask)  # warm-up
+    if value.is_cuda:
+        torch.cuda.synchronize(value.device)
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        path = fn(value, mask)
+    if value.is_cuda:
+        torch.cuda.synchronize(value.device)
+    return path, (time.perf_counter() - start) / repetitions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repetitions", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(42)
+
+    # (batch, t_x: tokens, t_y: frames)
+    sizes = [(16, 100, 400), (32, 150, 600), (32, 200, 1000), (64, 250, 1200)]
+
+    implementations = {"torch": maximum_path_torch, "numpy": commons.maximum_path}
+    if maximum_path_c is not None:
+        implementations["cython"] = maximum_path_cython
+    else:
+        print("Cython extension not available, skipping maximum_path_c")
+
+    print("batch   t_x   t_y | " + " | ".join(f"{name:>10}" for name in implementations) + " | equal paths")
+    for batch_size, t_x, t_y in sizes:
+        value, mask = _random_inputs(batch_size, t_x, t_y, device)
+        paths, times = {}, {}
+        for name, fn in implementations.items():
+            paths[name], times[name] = _timed(fn, value, mask, args.repetitions)
+        reference = paths["cython"] if "cython" in paths else paths["numpy"]
+        equal = torch.equal(paths["torch"].cpu(), reference.cpu())
+        print(
+            f"{batch_size:>5} {t_x:>5} {t_y:>5} | "
+            + " | ".join(f"{times[name]:>9.4f}s" for name in implementations)
+            + f" | {equal}"
+        )
+
+
+if __name__ == "__main__":
+    main()
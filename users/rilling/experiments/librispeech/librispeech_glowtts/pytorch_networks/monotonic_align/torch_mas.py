@@ -0,0 +1,55 @@
+import torch
+
+
+def maximum_path_torch(value, mask, max_neg_val=-1e9):
+    """Pure torch version of the monotonic alignment search, runs on the device of the input.
+    Produces the same paths as maximum_path_c (same float32 accumulation and tie-breaking).
+
+    The cumulative score of column y only depends on column y - 1, so the forward pass
+    processes one column of all text positions of all sequences per step (wavefront over t_y).
+    The backtracking is vectorized over the batch.
+
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    """
+    device = value.device
+    dtype = value.dtype
+    value = (value * mask).detach().float()
+    mask = mask.detach()
+    b, t_x, t_y = value.shape
+
+    t_xs = mask.sum(1)[:, 0].long()  # [b]
+    t_ys = mask.sum(2)[:, 0].long()  # [b]
+
+    x_range = torch.arange(t_x, device=device).unsqueeze(0)  # [1, t_x]
+    neg = torch.full((b, 1), max_neg_val, dtype=torch.float32, device=device)  # [b, 1]
+
+    cum = value.clone()  # [b, t_x, t_y], cumulative scores within the band, original values outside
+    prev = torch.zeros((b, t_x), dtype=torch.float32, device=device)  # [b, t_x], column y - 1
+    for y in range(t_y):
+        v_cur = torch.where(x_range == y, torch.full_like(prev, max_neg_val), prev)  # [b, t_x]
+        first = torch.zeros_like(neg) if y == 0 else neg  # [b, 1]
+        v_prev = torch.cat([first, prev[:, :-1]], dim=1)  # [b, t_x]
+        band = (
+            (x_range <= y)
+            & (x_range >= (t_xs + y - t_ys).unsqueeze(1))
+            & (x_range < t_xs.unsqueeze(1))
+            & (y < t_ys).unsqueeze(1)
+        )  # [b, t_x]
+        column = torch.where(band, torch.maximum(v_cur, v_prev) + value[:, :, y], value[:, :, y])  # [b, t_x]
+        cum[:, :, y] = column
+        prev = column
+
+    path = torch.zeros((b, t_x, t_y), dtype=torch.int32, device=device)
+    batch_range = torch.arange(b, device=device)
+    index = t_xs - 1  # [b]
+    for y in range(t_y - 1, -1, -1):
+        active = (y < t_ys) & (t_xs > 0)  # [b]
+        path[batch_range[active], index[active], y] = 1
+        if y == 0:
+            break
+        v_stay = cum[batch_range, index, y - 1]  # [b]
+        v_diag = cum[batch_range, (index - 1).clamp(min=0), y - 1]  # [b]
+        move = active & (index != 0) & ((index == y) | (v_stay < v_diag))  # [b]
+        index = index - move.long()
+    return path.to(dtype=dtype)
@@ -1,5 +1,6 @@
 import h5py
 import numpy
+import typing
 
 
 def hdf5_strings(handle, name, data):
@@ -27,9 +28,15 @@ class SimpleHDFWriter:
   which can be read later by :class:`HDFDataset`.
 
   Note that we dump to a temp file first, and only at :func:`close` we move it over to the real destination.
+
+  With ``buffer_size_bytes``, the inserted seqs are buffered in memory and written in one go
+  once the buffer is full, and the datasets grow geometrically (with chunks of ``chunk_size_bytes``)
+  and are truncated to their final size at :func:`close`.
+  This is much faster when inserting many small seqs one by one.
   """
 
-  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, swmr=False, extend_existing_file=False):
+  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, swmr=False, extend_existing_file=False,
+               buffer_size_bytes=None, chunk_size_bytes=1024 * 1024):
     """
     :param str filename: Create file, truncate if exists
     :param int|None dim:
@@ -38,6 +45,9 @@ class SimpleHDFWriter:
     :param dict[str,(int,int,str)]|None extra_type: key -> (dim,ndim,dtype)
     :param bool swmr: see http://docs.h5py.org/en/stable/swmr.html
     :param bool extend_existing_file: True also means we expect that it exists
+    :param int|None buffer_size_bytes: if set, buffer the inserted seqs in memory up to this size
+    :param int chunk_size_bytes: approx. HDF chunk size with buffer_size_bytes.
+      Should be large for fast sequential reads, but not larger than the HDF chunk cache (1MB by default).
     """
     import tempfile
     import os
@@ -53,6 +63,11 @@ class SimpleHDFWriter:
     if labels:
       assert len(labels) == dim
     self.filename = filename
+    self.buffer_size_bytes = buffer_size_bytes
+    self.chunk_size_bytes = chunk_size_bytes
+    # seq tag, inputs, extra (key -> (raw_data,dim,dtype))
+    self._buffer = []  # type: typing.List[typing.Tuple[str, numpy.ndarray, typing.Dict[str, typing.Any]]]
+    self._buffer_bytes = 0
     tmp_fd, self.tmp_filename = tempfile.mkstemp(suffix=".hdf")
     os.close(tmp_fd)
     self.extend_existing_file = extend_existing_file
@@ -86,7 +101,8 @@ class SimpleHDFWriter:
     if extend_existing_file:
       self._seq_lengths = self._file["seqLengths"]
     else:
-      self._seq_lengths = self._file.create_dataset("seqLengths", (0, 2), dtype='i', maxshape=(None, None))
+      self._seq_lengths = self._file.create_dataset(
+        "seqLengths", (0, 2), dtype='i', maxshape=(None, None), chunks=self._get_chunks((2,), 'i'))
     # Note about strings in HDF: http://docs.h5py.org/en/stable/strings.html
     # Earlier we used S%i, i.e. fixed-sized strings, with the calculated max string length.
     if extend_existing_file:
@@ -94,7 +110,8 @@ class SimpleHDFWriter:
     else:
       # noinspection PyUnresolvedReferences
       dt = h5py.special_dtype(vlen=str)
-      self._seq_tags = self._file.create_dataset('seqTags', (0,), dtype=dt, maxshape=(None,))
+      self._seq_tags = self._file.create_dataset(
+        'seqTags', (0,), dtype=dt, maxshape=(None,), chunks=self._get_chunks((), dt))
 
     self._extra_num_time_steps = {}  # type: typing.Dict[str,int]  # key -> num-steps
     self._prepared_extra = set()
@@ -107,6 +124,19 @@ class SimpleHDFWriter:
       # See comments in test_SimpleHDFWriter_swmr...
       raise NotImplementedError("SimpleHDFWriter SWMR is not really finished...")
 
+  def _get_chunks(self, row_shape, dtype):
+    """
+    :param tuple[int]|list[int] row_shape: shape without the time axis
+    :param str|numpy.dtype dtype:
+    :return: chunk shape, or None for the automatic chunking of h5py
+    :rtype: tuple[int]|None
+    """
+    if not self.buffer_size_bytes:
+      return None
+    row_shape = tuple(d or 1 for d in row_shape)
+    row_bytes = int(numpy.prod(row_shape)) * numpy.dtype(dtype).itemsize
+    return (max(1, self.chunk_size_bytes // max(row_bytes, 1)),) + row_shape
+
   def __del__(self):
     if self._file:
       self._file.close()
@@ -143,7 +173,8 @@ class SimpleHDFWriter:
         self._extra_num_time_steps[data_key] = self._datasets[data_key].shape[0]
       else:
         self._datasets[data_key] = self._file['targets/data'].create_dataset(
-          data_key, shape=[d if d else 0 for d in shape], dtype=dtype, maxshape=shape)
+          data_key, shape=[d if d else 0 for d in shape], dtype=dtype, maxshape=shape,
+          chunks=self._get_chunks(shape[1:], dtype))
         self._file['targets/size'].attrs[data_key] = [dim or 1, ndim]
         self._extra_num_time_steps[data_key] = 0
       self._prepared_extra.add(data_key)
@@ -176,13 +207,15 @@ class SimpleHDFWriter:
     self._file.attrs['numTimesteps'] += raw_data.shape[0]
     self._file.attrs['numSeqs'] += 1
 
-  def _insert_h5_other(self, data_key, raw_data, dtype=None, add_time_dim=False, dim=None):
+  @staticmethod
+  def _prepare_extra_data(raw_data, dtype=None, add_time_dim=False, dim=None):
     """
-    :param str data_key:
     :param numpy.ndarray|int|float|list[int] raw_data: shape=(time,data) or shape=(time,) or shape=()...
     :param str|None dtype:
     :param bool add_time_dim:
     :param int|None dim:
+    :return: raw_data with time axis, dim, dtype name (or "string")
+    :rtype: (numpy.ndarray, int, str)
     """
     if isinstance(raw_data, (int, float, list, numpy.float32)):
       raw_data = numpy.array(raw_data)
@@ -197,17 +230,28 @@ class SimpleHDFWriter:
         dim = raw_data.shape[-1]
       else:
         dim = 1  # dummy
-
-    # We assume that _insert_h5_inputs was called before.
-    assert self._file.attrs['numSeqs'] > 0 and self._seq_lengths.shape[0] > 0
-    seq_idx = self._file.attrs['numSeqs'] - 1
-
-    if raw_data.dtype == numpy.object:
+    if raw_data.dtype == object:
       # Is this a string?
       assert isinstance(raw_data.flat[0], (str, bytes))
       dtype = "string"
     else:
       dtype = raw_data.dtype.name
+    return raw_data, dim, dtype
+
+  def _insert_h5_other(self, data_key, raw_data, dtype=None, add_time_dim=False, dim=None):
+    """
+    :param str data_key:
+    :param numpy.ndarray|int|float|list[int] raw_data: shape=(time,data) or shape=(time,) or shape=()...
+    :param str|None dtype:
+    :param bool add_time_dim:
+    :param int|None dim:
+    """
+    raw_data, dim, dtype = self._prepare_extra_data(raw_data, dtype=dtype, add_time_dim=add_time_dim, dim=dim)
+
+    # We assume that _insert_h5_inputs was called before.
+    assert self._file.attrs['numSeqs'] > 0 and self._seq_lengths.shape[0] > 0
+    seq_idx = self._file.attrs['numSeqs'] - 1
+
     if self._prepare_extra({data_key: (dim, raw_data.ndim, dtype)}):
       # We added it now. Maybe other extra data keys were added before. The data_key_idx is different now.
       # Thus, seq_lengths might have become invalid. Reinit them.
@@ -258,12 +302,12 @@ class SimpleHDFWriter:
       assert all([n_batch == value.shape[0] for value in extra.values()]), (
         "n_batch %i, extra shapes: %r" % (n_batch, {key: value.shape for (key, value) in extra.items()}))
 
-    seqlen_offset = self._seq_lengths.shape[0]
-    self._seq_lengths.resize(seqlen_offset + n_batch, axis=0)
-    self._seq_tags.resize(seqlen_offset + n_batch, axis=0)
+    if not self.buffer_size_bytes:
+      seqlen_offset = self._seq_lengths.shape[0]
+      self._seq_lengths.resize(seqlen_offset + n_batch, axis=0)
+      self._seq_tags.resize(seqlen_offset + n_batch, axis=0)
 
     for i in range(n_batch):
-      self._seq_tags[seqlen_offset + i] = numpy.array(seq_tag[i], dtype=self._seq_tags.dtype)
       # Note: Currently, our HDFDataset does not support to have multiple axes with dynamic length.
       # Thus, we flatten all together, and calculate the flattened seq len.
       # (Ignore this if there is only a single time dimension.)
@@ -272,10 +316,21 @@ class SimpleHDFWriter:
       flat_shape = [flat_seq_len]
       if self.dim and not sparse:
         flat_shape.append(self.dim)
-      self._seq_lengths[seqlen_offset + i, 0] = flat_seq_len
       data = inputs[i]
       data = data[tuple([slice(None, seq_len[axis][i]) for axis in range(ndim_with_seq_len)])]
       data = numpy.reshape(data, flat_shape)
+      if self.buffer_size_bytes:
+        seq_extra = {}
+        if len(seq_len) > 1:
+          seq_extra["sizes"] = self._prepare_extra_data(
+            [seq_len[axis][i] for axis in range(ndim_with_seq_len)], add_time_dim=False, dtype="int32")
+        if extra:
+          for key, value in extra.items():
+            seq_extra[key] = self._prepare_extra_data(value[i])
+        self._insert_buffered(seq_tag[i], data, seq_extra)
+        continue
+      self._seq_tags[seqlen_offset + i] = numpy.array(seq_tag[i], dtype=self._seq_tags.dtype)
+      self._seq_lengths[seqlen_offset + i, 0] = flat_seq_len
       self._insert_h5_inputs(data)
       if len(seq_len) > 1:
         # Note: Because we have flattened multiple axes with dynamic len into a single one,
@@ -295,12 +350,98 @@ class SimpleHDFWriter:
             {key: value.shape if isinstance(value, numpy.ndarray) else repr(value) for (key, value) in extra.items()}))
           raise
 
+  def _insert_buffered(self, seq_tag, data, extra):
+    """
+    :param str|bytes seq_tag:
+    :param numpy.ndarray data: flattened inputs of the seq
+    :param dict[str,(numpy.ndarray,int,str)] extra: key -> (raw_data,dim,dtype), via :func:`_prepare_extra_data`
+    """
+    self._buffer.append((seq_tag, data, extra))
+    self._buffer_bytes += data.nbytes + sum(value.nbytes for (value, _, _) in extra.values()) + len(seq_tag)
+    if self._buffer_bytes >= self.buffer_size_bytes:
+      self._flush_buffer()
+
+  @staticmethod
+  def _write_rows(dataset, offset, values):
+    """
+    Writes values at offset, and grows the dataset geometrically if needed.
+
+    :param h5py.Dataset dataset:
+    :param int offset:
+    :param numpy.ndarray values:
+    """
+    end = offset + values.shape[0]
+    if end > dataset.shape[0]:
+      dataset.resize(max(end, 2 * dataset.shape[0]), axis=0)
+    dataset[offset:end] = values
+
+  def _flush_buffer(self):
+    """
+    Writes all buffered seqs to the file.
+    """
+    if not self._buffer:
+      return
+    new_extra = {}
+    for _, _, extra in self._buffer:
+      for key, (value, dim, dtype) in extra.items():
+        if key not in self._prepared_extra and key not in new_extra:
+          new_extra[key] = (dim, value.ndim, dtype)
+    if new_extra:
+      # The data_key_idx would change, so this is only possible in the beginning, as in _insert_h5_other.
+      assert self._file.attrs['numSeqs'] == 0 or self.extend_existing_file
+      self._prepare_extra(new_extra)
+    extra_keys = sorted(self._prepared_extra)
+
+    inputs = numpy.concatenate([data for _, data, _ in self._buffer], axis=0)
+    name = "inputs"
+    if name not in self._datasets:
+      if self.extend_existing_file:
+        self._datasets[name] = self._file[name]
+      else:
+        self._datasets[name] = self._file.create_dataset(
+          name, (0,) + inputs.shape[1:], inputs.dtype, maxshape=tuple(None for _ in inputs.shape),
+          chunks=self._get_chunks(inputs.shape[1:], inputs.dtype))
+    self._write_rows(self._datasets[name], int(self._file.attrs['numTimesteps']), inputs)
+
+    for key in extra_keys:
+      values = [extra[key][0] for _, _, extra in self._buffer if key in extra]
+      if values:
+        values = numpy.concatenate(values, axis=0)
+        self._write_rows(self._datasets[key], self._extra_num_time_steps[key], values)
+        self._extra_num_time_steps[key] += values.shape[0]
+
+    num_seqs = int(self._file.attrs['numSeqs'])
+    # by default there are 2 columns, even without extra data, see __init__
+    seq_lengths = numpy.zeros((len(self._buffer), self._seq_lengths.shape[1]), dtype="int32")
+    for i, (_, data, extra) in enumerate(self._buffer):
+      seq_lengths[i, 0] = data.shape[0]
+      for data_key_idx_0, key in enumerate(extra_keys):
+        if key in extra:
+          seq_lengths[i, data_key_idx_0 + 1] = extra[key][0].shape[0]
+    self._write_rows(self._seq_lengths, num_seqs, seq_lengths)
+    seq_tags = numpy.array([tag for tag, _, _ in self._buffer], dtype=self._seq_tags.dtype)
+    self._write_rows(self._seq_tags, num_seqs, seq_tags)
+
+    self._file.attrs['numTimesteps'] += inputs.shape[0]
+    self._file.attrs['numSeqs'] += len(self._buffer)
+    self._buffer = []
+    self._buffer_bytes = 0
+
   def close(self):
     """
     Closes the file.
     """
     import os
     import shutil
+    if self._file and self.buffer_size_bytes:
+      self._flush_buffer()
+      # truncate the geometrically grown datasets to their final size
+      if "inputs" in self._datasets:
+        self._datasets["inputs"].resize(int(self._file.attrs['numTimesteps']), axis=0)
+      for key, num_time_steps in self._extra_num_time_steps.items():
+        self._datasets[key].resize(num_time_steps, axis=0)
+      self._seq_lengths.resize(int(self._file.attrs['numSeqs']), axis=0)
+      self._seq_tags.resize(int(self._file.attrs['numSeqs']), axis=0)
     if self._file:
       self._file.close()
       self._file = None
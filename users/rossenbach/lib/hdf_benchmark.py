@@ -0,0 +1,94 @@
+"""
+Write-throughput benchmark for :class:`SimpleHDFWriter`, inserting many small seqs one by one,
+as done e.g. in the TTS feature/duration extraction jobs.
+
+Usage::
+
+    python -m i6_experiments.users.rossenbach.lib.hdf_benchmark [--num-seqs 100000]
+
+Compares the default writer with the buffered mode, and checks that both files have the same content.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy
+
+from .hdf import SimpleHDFWriter
+
+
+def write_hdf(filename, seqs, **writer_opts):
+  """
+  :param str filename:
+  :param list[(str,numpy.ndarray,numpy.ndarray)] seqs: seq tag, features [T,F], durations [N]
+  :return: secs
+  :rtype: float
+  """
+  start_time = time.perf_counter()
+  writer = SimpleHDFWriter(filename, dim=seqs[0][1].shape[-1], ndim=2, **writer_opts)
+  for seq_tag, features, durations in seqs:
+    writer.insert_batch(
+      features[None], [features.shape[0]], [seq_tag], extra={"durations": durations[None]})
+  writer.close()
+  return time.perf_counter() - start_time
+
+
+def assert_same_content(filename_a, filename_b):
+  """
+  :param str filename_a:
+  :param str filename_b:
+  """
+  def _assert_same_attrs(obj_a, obj_b):
+    assert sorted(obj_a.attrs.keys()) == sorted(obj_b.attrs.keys()), obj_a.name
+    for key in obj_a.attrs.keys():
+      assert numpy.array_equal(obj_a.attrs[key], obj_b.attrs[key]), (obj_a.name, key)
+
+  with h5py.File(filename_a, "r") as a, h5py.File(filename_b, "r") as b:
+    _assert_same_attrs(a, b)
+    names = []
+    a.visit(names.append)
+    b_names = []
+    b.visit(b_names.append)
+    assert names == b_names, (names, b_names)
+    for name in names:
+      if isinstance(a[name], h5py.Dataset):
+        assert a[name].shape == b[name].shape and a[name].dtype == b[name].dtype, name
+        assert numpy.array_equal(a[name][...], b[name][...]), name
+      _assert_same_attrs(a[name], b[name])
+
+
+def main():
+  """main"""
+  arg_parser = argparse.ArgumentParser()
+  arg_parser.add_argument("--num-seqs", type=int, default=100_000)
+  arg_parser.add_argument("--dim", type=int, default=80)
+  arg_parser.add_argument("--max-seq-len", type=int, default=20)
+  arg_parser.add_argument("--buffer-size-bytes", type=int, default=64 * 1024 * 1024)
+  args = arg_parser.parse_args()
+
+  rnd = numpy.random.RandomState(42)
+  seqs = []
+  for i in range(args.num_seqs):
+    seq_len = rnd.randint(1, args.max_seq_len + 1)
+    seqs.append(
+      ("corpus/seq-%i/%i" % (i, i),
+       rnd.randn(seq_len, args.dim).astype("float32"),
+       rnd.randint(1, 10, size=(rnd.randint(1, 5),)).astype("int32")))
+  num_bytes = sum(features.nbytes + durations.nbytes for _, features, durations in seqs)
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    filenames = {}
+    for name, opts in [("default", {}), ("buffered", {"buffer_size_bytes": args.buffer_size_bytes})]:
+      filenames[name] = os.path.join(tmp_dir, "%s.hdf" % name)
+      secs = write_hdf(filenames[name], seqs, **opts)
+      print("%s: %.2f secs, %.0f seqs/sec, %.1f MB/sec, file size %.1f MB" % (
+        name, secs, len(seqs) / secs, num_bytes / secs / 1e6, os.path.getsize(filenames[name]) / 1e6))
+    assert_same_content(filenames["default"], filenames["buffered"])
+    print("same content")
+
+
+if __name__ == "__main__":
+  main()
@@ -8,7 +8,34 @@ from i6_core.lib.hdf import get_returnn_simple_hdf_writer, get_input_dict_from_r
 from i6_core.lib.rasr_cache import FileArchive
 from i6_core.lib.corpus import Corpus
 
-from i6_experiments.users.rossenbach.lib.hdf import load_default_data
+from i6_experiments.users.rossenbach.lib.hdf import SimpleHDFWriter
+
+
+def alignment_to_durations(alignment: numpy.ndarray, skip_token: int) -> numpy.ndarray:
+    """
+    Run-length encoding of a frame-level (Viterbi/CTC) alignment into label durations.
+
+    A new label starts at each frame which is not the skip token and differs from the previous frame.
+    Repetitions and skip tokens are added to the duration of the previous label,
+    i.e. skip tokens only separate two identical labels: [1, skip_token, 1] -> [1, 1] with durations [2, 1].
+
+    :param alignment: [T] (or [T, 1]) label indices
+    :param skip_token: blank/silence index, must not be the first frame
+    :return: [num_labels] durations, summing up to T
+    """
+    alignment = numpy.asarray(alignment)
+    if alignment.ndim == 2:
+        assert alignment.shape[1] == 1, f"unexpected alignment shape {alignment.shape}"
+        alignment = alignment[:, 0]
+    assert alignment.ndim == 1, f"unexpected alignment shape {alignment.shape}"
+    if len(alignment) == 0:
+        return numpy.zeros((0,), dtype=numpy.int32)
+    assert alignment[0] != skip_token, "alignment must not start with the skip token"
+
+    is_start = alignment != skip_token
+    is_start[1:] &= alignment[1:] != alignment[:-1]
+    starts = numpy.flatnonzero(is_start)
+    return numpy.diff(numpy.append(starts, len(alignment))).astype(numpy.int32)
 
 
 class ViterbiAlignmentToDurationsJob(Job):
@@ -25,31 +52,32 @@ class ViterbiAlignmentToDurationsJob(Job):
             dataset_to_check=None,
             time_rqmt=2,
             mem_rqmt=4,
+            num_shards: int = 1,
     ):
         """
         :param Path viterbi_alignment: Path to the alignment HDF produced by CTC/Viterbi
         :param Path bliss_lexicon: used to determine the epsilon and do some verification
-        :param tk.Path|None returnn_root:
+        :param tk.Path|None returnn_root: not used anymore, the durations HDF is written
+            with :class:`i6_experiments.users.rossenbach.lib.hdf.SimpleHDFWriter`
         :param blank_token: Value of the blank token in CTC, or the phoneme string of the lexicon.
             Will use the last phoneme-inventory index if not provided.
         :param tk.Path|None dataset_to_check:
+        :param num_shards: split the seqs into this many parallel tasks
         """
         self.viterbi_alignment_hdf = viterbi_alignment_hdf
         self.bliss_lexicon = bliss_lexicon
         self.returnn_root = returnn_root
         self.blank_token = blank_token
         self.check = dataset_to_check
+        self.num_shards = num_shards
         self.out_durations_hdf = self.output_path("durations.hdf")
         self.rqmt = {"time": time_rqmt, "mem": mem_rqmt}
 
     def tasks(self):
-        yield Task("run", rqmt=self.rqmt)
-
-    def run(self):
-        # Load HDF data
-        alignment, tags = load_default_data(self.viterbi_alignment_hdf.get_path())
-        durations_total = []
+        yield Task("run", rqmt=self.rqmt, args=range(1, self.num_shards + 1))
+        yield Task("merge", mini_task=True)
 
+    def run(self, shard_idx: int):
         lex = lexicon.Lexicon()
         lex.load(self.bliss_lexicon.get_path())
         if isinstance(self.blank_token, str):
@@ -60,47 +88,62 @@ class ViterbiAlignmentToDurationsJob(Job):
             assert self.blank_token is None
             skip_token = len(lex.phonemes) - 1
 
-        # sort based on tags
+        # Only the seq lengths are needed for the check
         if self.check is not None:
-            check, check_tag = load_default_data(self.check.get_path())
+            with h5py.File(self.check.get_path(), "r") as check_file:
+                check_lengths = check_file["seqLengths"][:, 0]
+
+        tags = []
+        durations_total = []
+        with h5py.File(self.viterbi_alignment_hdf.get_path(), "r") as alignment_file:
+            inputs = alignment_file["inputs"]
+            lengths = alignment_file["seqLengths"][:, 0]
+            offsets = numpy.concatenate([[0], numpy.cumsum(lengths, dtype=numpy.int64)])
+            shard_seq_indices = numpy.array_split(numpy.arange(len(lengths)), self.num_shards)[shard_idx - 1]
+            if len(shard_seq_indices) > 0:
+                shard_tags = alignment_file["seqTags"][shard_seq_indices[0] : shard_seq_indices[-1] + 1]
+            else:
+                shard_tags = []
+
+            # Read in blocks of seqs, the shard is contiguous
+            block_size = 1000
+            for block_start in range(0, len(shard_seq_indices), block_size):
+                block_seq_indices = shard_seq_indices[block_start : block_start + block_size]
+                block_offset = offsets[block_seq_indices[0]]
+                block = inputs[block_offset : offsets[block_seq_indices[-1] + 1]]
+                for alignment_idx in block_seq_indices:
+                    s = block[offsets[alignment_idx] - block_offset : offsets[alignment_idx + 1] - block_offset]
+                    durations = alignment_to_durations(s, skip_token)
+                    # Check if lengths match if dataset is provided
+                    if self.check is not None:
+                        assert sum(durations) == check_lengths[alignment_idx], (
+                            f"durations {sum(durations)} and spectrogram length {check_lengths[alignment_idx]}"
+                            f"do not match in length "
+                        )
+                    durations_total.append(durations)
+            for tag in shard_tags:
+                tags.append(tag if isinstance(tag, str) else tag.decode())
 
-        # Alignemnt to duration conversion
-        for alignment_idx, s in enumerate(alignment):
-            durations = []
-            for idx, p in enumerate(s):
-                # Skip_token only appears now if 2 labels following each other are the same.
-                #   Example [1,skip_token,1] -> [1,1]
-                if p == skip_token:
-                    durations[-1] += 1
-                    continue
-                if idx != 0 and s[idx] != s[idx - 1]:
-                    durations.append(1)
-                elif idx != 0 and s[idx] == s[idx - 1]:
-                    durations[-1] += 1
-                else:
-                    durations.append(1)
-            # Check if lengths match if dataset is provided
-            if self.check is not None:
-                assert sum(durations) == len(check[alignment_idx]), (
-                    f"durations {sum(durations)} and spectrogram length {len(check[alignment_idx])}"
-                    f"do not match in length "
-                )
-            durations_total.append(durations)
+        numpy.savez(
+            f"durations.{shard_idx}.npz",
+            tags=numpy.array(tags, dtype=str),
+            lengths=numpy.array([len(durations) for durations in durations_total], dtype=numpy.int64),
+            durations=numpy.concatenate(durations_total) if durations_total else numpy.zeros((0,), dtype=numpy.int32),
+        )
 
-        # Dump into HDF
-        new_lengths = []
-        for seq in durations_total:
-            new_lengths.append([len(seq), 2, 2])
-        duration_sequence = numpy.hstack(durations_total).astype(numpy.int32)
-        dim = 1
-        hdf_writer = get_returnn_simple_hdf_writer(self.returnn_root)
-        writer = hdf_writer(self.out_durations_hdf.get_path(), dim=dim, ndim=2)
-        offset = 0
-        for tag, length in zip(tags, new_lengths):
-            in_data = duration_sequence[offset : offset + length[0]]
-            in_data = numpy.expand_dims(in_data, axis=1)
-            offset += length[0]
-            writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
+    def merge(self):
+        # Dump into HDF, in the original seq order
+        writer = SimpleHDFWriter(self.out_durations_hdf.get_path(), dim=1, ndim=2, buffer_size_bytes=64 * 1024 * 1024)
+        for shard_idx in range(1, self.num_shards + 1):
+            with numpy.load(f"durations.{shard_idx}.npz") as shard:
+                # NpzFile reads the whole array on every access, so only once per shard
+                tags, lengths, durations = shard["tags"], shard["lengths"], shard["durations"]
+            offset = 0
+            for tag, length in zip(tags, lengths):
+                in_data = durations[offset : offset + length]
+                in_data = numpy.expand_dims(in_data, axis=1)
+                offset += length
+                writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [str(tag)])
         print(f"Succesfully converted durations into {(self.out_durations_hdf.get_path())}")
         writer.close()
 
@@ -0,0 +1,45 @@
+"""
+Equivalence test of the vectorized alignment to durations conversion against the previous per-frame loop
+"""
+
+import numpy
+
+from .duration_extraction import alignment_to_durations
+
+
+def _alignment_to_durations_reference(s, skip_token):
+    """previous implementation in ViterbiAlignmentToDurationsJob.run"""
+    durations = []
+    for idx, p in enumerate(s):
+        # Skip_token only appears now if 2 labels following each other are the same.
+        #   Example [1,skip_token,1] -> [1,1]
+        if p == skip_token:
+            durations[-1] += 1
+            continue
+        if idx != 0 and s[idx] != s[idx - 1]:
+            durations.append(1)
+        elif idx != 0 and s[idx] == s[idx - 1]:
+            durations[-1] += 1
+        else:
+            durations.append(1)
+    return durations
+
+
+def test_alignment_to_durations():
+    rnd = numpy.random.RandomState(42)
+    skip_token = 4
+    for _ in range(1000):
+        # small label inventory, such that repetitions and skips between identical labels are frequent
+        alignment = rnd.randint(0, skip_token + 1, size=(rnd.randint(1, 50),)).astype(numpy.int32)
+        alignment[0] = rnd.randint(0, skip_token)  # must not start with the skip token
+        if rnd.rand() < 0.5:
+            alignment = numpy.expand_dims(alignment, axis=1)  # as loaded from the HDF with dim 1
+        durations = alignment_to_durations(alignment, skip_token)
+        assert durations.tolist() == _alignment_to_durations_reference(alignment, skip_token)
+        assert durations.sum() == len(alignment)
+
+
+def test_alignment_to_durations_examples():
+    assert alignment_to_durations(numpy.array([1, 9, 1]), 9).tolist() == [2, 1]
+    assert alignment_to_durations(numpy.array([1, 1, 9, 9, 2, 2, 9, 3]), 9).tolist() == [4, 3, 1]
+    assert alignment_to_durations(numpy.array([], dtype=numpy.int32), 9).tolist() == []
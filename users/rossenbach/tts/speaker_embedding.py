@@ -39,7 +39,9 @@ class SpeakerLabelHDFFromBliss(Job):
 
         pickle.dump(speaker_by_index, uopen(self.out_speaker_dict, "wb"))
 
-        hdf_writer = SimpleHDFWriter(self.out_speaker_hdf.get_path(), dim=num_speakers, ndim=1)
+        hdf_writer = SimpleHDFWriter(
+            self.out_speaker_hdf.get_path(), dim=num_speakers, ndim=1, buffer_size_bytes=64 * 1024 * 1024
+        )
 
         for recording in bliss.all_recordings():
             for segment in recording.segments:
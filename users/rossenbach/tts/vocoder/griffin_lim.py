@@ -28,7 +28,8 @@ class PhaseReconstructor():
                  preemphasis,
                  peak_normalization,
                  file_format,
-                 corpus_format):
+                 corpus_format,
+                 momentum=0.0):
         """
 
         :param str out_folder:
@@ -42,6 +43,7 @@ class PhaseReconstructor():
         :param bool peak_normalization:
         :param str file_format:
         :param str|None corpus_format:
+        :param float momentum: for the torch backend, >0 for "fast Griffin-Lim", see :func:`griffin_lim_torch`
         """
         self.out_folder = out_folder
         self.backend = backend
@@ -54,13 +56,15 @@ class PhaseReconstructor():
         self.peak_normalization = peak_normalization
         self.file_format = file_format
         self.corpus_format = corpus_format
-
+        self.momentum = momentum
 
         self.reconstruct_function = None
         if self.backend in ['legacy', 'numpy']:
             self.reconstruct_function = self.griffin_lim
         elif self.backend in ['librosa']:
             self.reconstruct_function = self.librosa_griffin_lim
+        elif self.backend in ['torch']:
+            self.reconstruct_function = self.torch_griffin_lim
         else:
             assert False, "invalid backend: %s" % self.backend
 
@@ -111,6 +115,44 @@ class PhaseReconstructor():
                                   win_length=int(self.sample_rate*self.window_size),)
 
 
+    def torch_griffin_lim(self, spectrogram):
+        return self.torch_griffin_lim_batch([spectrogram])[0]
+
+    def torch_griffin_lim_batch(self, spectrograms):
+        """
+        :param list[np.array] spectrograms: each [n_fft/2+1, time]
+        :return: waveforms
+        :rtype: list[np.array]
+        """
+        import torch
+        lengths = [spectrogram.shape[1] for spectrogram in spectrograms]
+        magnitudes = np.zeros((len(spectrograms), spectrograms[0].shape[0], max(lengths)), dtype=np.float32)
+        for i, spectrogram in enumerate(spectrograms):
+            magnitudes[i, :, :lengths[i]] = np.abs(spectrogram)
+        waveforms, waveform_lengths = griffin_lim_torch(
+            torch.from_numpy(magnitudes), torch.tensor(lengths),
+            n_fft=self.n_fft,
+            hop_length=int(self.sample_rate*self.window_shift),
+            win_length=int(self.sample_rate*self.window_size),
+            iterations=self.iterations,
+            momentum=self.momentum)
+        return [waveform[:length].numpy() for waveform, length in zip(waveforms, waveform_lengths.tolist())]
+
+    def prepare_spectrogram(self, lin_spec):
+        """
+        :param np.array lin_spec: [n_fft/2 or n_fft/2+1, time]
+        :return: [n_fft/2+1, time] with zero DC bin
+        """
+        spec_width = int(self.n_fft/2)
+        if lin_spec.shape[0] == spec_width:
+            lin_spec = np.pad(lin_spec, ((1,0),(0,0)), mode='constant', constant_values=0)
+        elif lin_spec.shape[0] == spec_width + 1:
+            lin_spec = lin_spec.copy()
+            lin_spec[0, :] = 0
+        else:
+            assert False, "invalid feature shape %i in data, n_fft/2 is %i" % (lin_spec.shape[0], spec_width)
+        return lin_spec
+
     def convert(self, data_tuple):
         """
         perform the conversion, possibly multithreaded
@@ -120,8 +162,42 @@ class PhaseReconstructor():
         """
         tag = data_tuple[0]
         print("reconstructing phase for %s" % tag)
-        lin_spec = data_tuple[1]
+        lin_spec = self.prepare_spectrogram(data_tuple[1])
+
+        waveform = self.reconstruct_function(lin_spec)
 
+        return self.save(tag, waveform, lin_spec.shape[1])
+
+    def convert_batch(self, data_tuples, pool=None):
+        """
+        perform the conversion of multiple seqs at once with the torch backend,
+        ideally with similar lengths, as they are padded
+
+        :param list[tuple(str, np.array)] data_tuples:
+        :param multiprocessing.pool.ThreadPool|None pool: to save the audio files in parallel
+        :return: per seq, as :func:`convert`
+        :rtype: list
+        """
+        assert self.backend == 'torch'
+        print("reconstructing phase for batch of %i seqs, %s ... %s" % (
+            len(data_tuples), data_tuples[0][0], data_tuples[-1][0]))
+        lin_specs = [self.prepare_spectrogram(lin_spec) for _, lin_spec in data_tuples]
+        waveforms = self.torch_griffin_lim_batch(lin_specs)
+        args = [(tag, waveform, lin_spec.shape[1])
+                for (tag, _), waveform, lin_spec in zip(data_tuples, waveforms, lin_specs)]
+        if pool is None:
+            return [self.save(*arg) for arg in args]
+        return pool.starmap(self.save, args)
+
+    def save(self, tag, waveform, num_frames):
+        """
+        write the audio file
+
+        :param str tag:
+        :param np.array waveform:
+        :param int num_frames: of the spectrogram, for the length check
+        :return: bliss recording or path, depending on corpus_format
+        """
         # in compliance with the bliss format, create folders if tag is seperated by slashes
         if "/" in tag:
             tag_split = tag.split("/")
@@ -129,17 +205,6 @@ class PhaseReconstructor():
             print("create folder %s" % folder)
             mkdir_p(self.out_folder + "/" + folder)
 
-        # if
-        spec_width = int(self.n_fft/2)
-        if lin_spec.shape[0] == spec_width:
-            lin_spec = np.pad(lin_spec, ((1,0),(0,0)), mode='constant', constant_values=0)
-        elif lin_spec.shape[0] == spec_width + 1:
-            lin_spec = lin_spec[0, :] = 0
-        else:
-            assert False, "invalid feature shape %i in data, n_fft/2 is %i" % (lin_spec.shape[0], spec_width)
-
-        waveform = self.reconstruct_function(lin_spec)
-
         if self.preemphasis != 0:
             waveform = self.inv_preemphasis(waveform)
 
@@ -152,7 +217,7 @@ class PhaseReconstructor():
             save_ogg(waveform, path, self.sample_rate, self.peak_normalization)
             data, sr = soundfile.read(path)
 
-            target_len = self.window_shift * (lin_spec.shape[1] - 2)
+            target_len = self.window_shift * (num_frames - 2)
             file_len = (len(data) / float(self.sample_rate))
 
             error = False
@@ -185,6 +250,67 @@ class PhaseReconstructor():
             return path
 
 
+def griffin_lim_torch(magnitudes, lengths, *, n_fft, hop_length, win_length, iterations, momentum=0.0, seed=42,
+                      angles=None):
+    """
+    Batched Griffin-Lim on padded magnitude spectrograms.
+    Same STFT setup as :func:`PhaseReconstructor._stft` (Hann window, centered, zero padding).
+    Each seq gives the same waveform as if it was run on its own (with the same initial phases).
+
+    With momentum > 0, this is the "fast Griffin-Lim" (Perraudin et al., 2013), as in librosa.griffinlim,
+    otherwise the plain Griffin-Lim as in :func:`PhaseReconstructor.griffin_lim`.
+
+    :param torch.Tensor magnitudes: [B, n_fft/2+1, T], zero padded
+    :param torch.Tensor lengths: [B], number of frames per seq
+    :param int n_fft:
+    :param int hop_length:
+    :param int win_length:
+    :param int iterations:
+    :param float momentum: e.g. 0.99
+    :param int seed: for the random initial phase
+    :param torch.Tensor|None angles: initial phases as complex unit values [B, n_fft/2+1, T]. random by default
+    :return: waveforms [B, L] (zero padded), lengths [B]
+    :rtype: (torch.Tensor, torch.Tensor)
+    """
+    import torch
+    window = torch.hann_window(win_length, dtype=magnitudes.dtype)
+    wav_lengths = hop_length * (lengths - 1)
+    wav_mask = torch.arange(hop_length * (magnitudes.shape[-1] - 1))[None, :] < wav_lengths[:, None]  # [B, L]
+
+    # istft normalizes by the window envelope (sum of squared windows) of all frames, including the padded ones,
+    # which is too large at the end of the shorter seqs. Rescale to the envelope of the frames of the seq.
+    # The padding also masks the waveform, such that the padding does not leak into the STFT of the next iteration.
+    window_left = (n_fft - win_length) // 2
+    window_sq = torch.nn.functional.pad(window, (window_left, n_fft - win_length - window_left)) ** 2
+    frame_mask = torch.arange(magnitudes.shape[-1])[None, :] < lengths[:, None]  # [B, T]
+    envelopes = torch.nn.functional.conv_transpose1d(
+        torch.cat([torch.ones_like(frame_mask[:1]), frame_mask]).to(window.dtype)[:, None],
+        window_sq[None, None], stride=hop_length)[:, 0, n_fft // 2:n_fft // 2 + wav_mask.shape[1]]  # [1+B, L]
+    wav_scale = torch.where(wav_mask, envelopes[:1] / envelopes[1:].clamp(min=1e-11), 0.)  # [B, L]
+
+    def _istft(spec):
+        wav = torch.istft(spec, n_fft=n_fft, hop_length=hop_length, win_length=win_length, window=window,
+                          center=True, length=wav_mask.shape[1])
+        return wav * wav_scale
+
+    def _stft(wav):
+        return torch.stft(wav, n_fft=n_fft, hop_length=hop_length, win_length=win_length, window=window,
+                          center=True, pad_mode="constant", return_complex=True)
+
+    if angles is None:
+        generator = torch.Generator().manual_seed(seed)
+        angles = torch.polar(
+            torch.ones_like(magnitudes),
+            2 * np.pi * torch.rand(magnitudes.shape, generator=generator, dtype=magnitudes.dtype))
+    rebuilt = torch.zeros_like(angles)
+    for _ in range(iterations):
+        prev_rebuilt = rebuilt
+        rebuilt = _stft(_istft(magnitudes * angles))
+        angles = rebuilt - (momentum / (1 + momentum)) * prev_rebuilt if momentum > 0 else rebuilt
+        angles = angles / (angles.abs() + 1e-16)
+    return _istft(magnitudes * angles), wav_lengths
+
+
 def mkdir_p(path):
     try:
         os.makedirs(path)
@@ -226,19 +352,21 @@ def save_ogg(wav, path, sr, peak_normalization=True):
 
 class HDFPhaseReconstruction(Job):
 
-    __sis_hash_exclude__ = {"peak_normalization": True}
+    __sis_hash_exclude__ = {"peak_normalization": True, "momentum": 0.0, "batch_size": 32}
 
     def __init__(self, hdf_file, backend, iterations, sample_rate, window_shift, window_size, preemphasis, file_format, peak_normalization=True,
-                 time_rqmt=8, mem_rqmt=8, cpu_rqmt=4):
+                 time_rqmt=8, mem_rqmt=8, cpu_rqmt=4, momentum=0.0, batch_size=32):
         """
 
         :param tk.Path hdf_file:
-        :param str backend:
+        :param str backend: "legacy"/"numpy", "librosa", or "torch" for batched Griffin-Lim
         :param int iterations:
         :param int sample_rate:
         :param float window_shift:
         :param float window_size:
         :param str file_format:
+        :param float momentum: only for the torch backend, e.g. 0.99 for "fast Griffin-Lim"
+        :param int batch_size: only for the torch backend, number of seqs (of similar length) per batch
         """
         self.hdf_file = hdf_file
         self.backend = backend
@@ -249,6 +377,8 @@ class HDFPhaseReconstruction(Job):
         self.preemphasis = preemphasis
         self.file_format = file_format
         self.peak_normalization = peak_normalization
+        self.momentum = momentum
+        self.batch_size = batch_size
 
         self.out_folder = self.output_path("corpus", directory=True)
         self.out_corpus = self.output_path("corpus/corpus.xml.gz")
@@ -260,6 +390,10 @@ class HDFPhaseReconstruction(Job):
 
 
     def run(self):
+        if self.backend == 'torch':
+            self.run_torch()
+            return
+
         import h5py
 
         temp_dir = tempfile.TemporaryDirectory(prefix="hdf_reconstruction_")
@@ -328,6 +462,72 @@ class HDFPhaseReconstruction(Job):
         shutil.move("corpus.xml.gz", self.out_corpus.get_path())
         print("done")
 
+    def run_torch(self):
+        """
+        batched Griffin-Lim, with torch using all CPU threads,
+        writing the audio files directly into the output folder
+        """
+        import h5py
+        import torch
+        from multiprocessing.pool import ThreadPool
+
+        torch.set_num_threads(self.rqmt['cpu'])
+
+        ref_linear_data = h5py.File(self.hdf_file.get_path(), 'r')
+        rl_inputs = ref_linear_data['inputs']
+        rl_tags = ref_linear_data['seqTags']
+        rl_lengths = ref_linear_data['seqLengths']
+
+        n_fft = rl_inputs[0].shape[0]*2
+        print("N_FFT from HDF: % i" % n_fft)
+
+        converter = PhaseReconstructor(out_folder=self.out_folder.get_path(),
+                                       backend=self.backend,
+                                       sample_rate=self.sample_rate,
+                                       window_shift=self.window_shift,
+                                       window_size=self.window_size,
+                                       n_fft=n_fft,
+                                       iterations=self.iterations,
+                                       preemphasis=self.preemphasis,
+                                       peak_normalization=self.peak_normalization,
+                                       file_format=self.file_format,
+                                       corpus_format="bliss",
+                                       momentum=self.momentum)
+
+        corpus = bliss_corpus.Corpus()
+        # ffmpeg and the file writing of the seqs of a batch run in parallel
+        pool = ThreadPool(self.rqmt['cpu'])
+
+        def _process(spectrograms):
+            # bucketing: sort by length, such that the batches have little padding
+            order = sorted(range(len(spectrograms)), key=lambda i: spectrograms[i][1].shape[1])
+            recordings = [None] * len(spectrograms)
+            for i in range(0, len(order), self.batch_size):
+                batch = order[i:i + self.batch_size]
+                for j, recording in zip(batch, converter.convert_batch([spectrograms[j] for j in batch], pool=pool)):
+                    recordings[j] = recording
+            # keep the original order in the corpus
+            for recording in recordings:
+                corpus.add_recording(recording)
+
+        loaded_spectograms = []
+        offset = 0
+        for tag, length in zip(rl_tags, rl_lengths):
+            tag = tag if isinstance(tag, str) else tag.decode()
+            loaded_spectograms.append((tag, np.asarray(rl_inputs[offset:offset + length[0]]).T))
+            offset += length[0]
+            if len(loaded_spectograms) >= 16 * self.batch_size:
+                _process(loaded_spectograms)
+                loaded_spectograms = []
+        if len(loaded_spectograms) > 0:
+            _process(loaded_spectograms)
+        pool.close()
+
+        corpus.name = tag.split("/")[0]
+        print("dump corpus")
+        corpus.dump(self.out_corpus.get_path())
+        print("done")
+
     @classmethod
     def hash(cls, kwargs):
         kwargs.pop('time_rqmt')
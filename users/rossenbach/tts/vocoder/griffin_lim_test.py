@@ -0,0 +1,29 @@
+"""
+Test that the batched torch Griffin-Lim gives the same waveforms as running each seq on its own
+"""
+
+import numpy
+import torch
+
+from .griffin_lim import griffin_lim_torch
+
+
+def test_griffin_lim_torch_batched_equals_single():
+    n_fft, hop_length, win_length = 1024, 200, 800
+    lengths = torch.tensor([40, 23, 7])
+    rnd = numpy.random.RandomState(42)
+    magnitudes = torch.tensor(rnd.uniform(0.0, 1.0, size=(len(lengths), n_fft // 2 + 1, int(lengths.max()))))
+    magnitudes = magnitudes * (torch.arange(magnitudes.shape[-1])[None, None, :] < lengths[:, None, None])
+    angles = torch.polar(torch.ones_like(magnitudes), torch.tensor(rnd.uniform(0.0, 2 * numpy.pi, magnitudes.shape)))
+    for momentum in [0.0, 0.99]:
+        opts = dict(n_fft=n_fft, hop_length=hop_length, win_length=win_length, iterations=5, momentum=momentum)
+        waveforms, wav_lengths = griffin_lim_torch(magnitudes, lengths, angles=angles, **opts)
+        for i, length in enumerate(lengths.tolist()):
+            waveform, wav_length = griffin_lim_torch(
+                magnitudes[i : i + 1, :, :length], lengths[i : i + 1], angles=angles[i : i + 1, :, :length], **opts
+            )
+            assert wav_lengths[i] == wav_length[0] == hop_length * (length - 1)
+            numpy.testing.assert_allclose(
+                waveforms[i, : wav_lengths[i]].numpy(), waveform[0].numpy(), rtol=0.0, atol=1e-10
+            )
+            assert not waveforms[i, wav_lengths[i] :].any()
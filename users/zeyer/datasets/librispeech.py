@@ -3,8 +3,9 @@ Librispeech dataset
 """
 
 from __future__ import annotations
-from typing import Optional, Any, Union, Tuple, Dict
+from typing import Optional, Any, Union, Tuple, Dict, Collection
 from copy import deepcopy
+import functools
 
 from sisyphus import tk
 from i6_core.corpus.convert import CorpusToTxtJob
@@ -485,10 +486,17 @@ def get_librispeech_task_raw(
     vocab: VocabConfig,
     audio_opts: Optional[Dict[str, Any]] = None,
     audio_dim: int = 1,
+    fused_scoring: bool = False,
+    sclite_report_datasets: Collection[str] = (),
     **dataset_train_opts,
 ) -> Task:
     """
     Librispeech
+
+    :param fused_scoring: score all eval datasets of a recog in a single job (:func:`score_many`),
+        instead of the sclite pipeline per dataset.
+        Off by default, as long as ``score_wer_test.test_align_counts_batched_sclite`` was not run against sclite.
+    :param sclite_report_datasets: with fused_scoring, for these datasets, additionally get the full sclite report
     """
     if isinstance(vocab, Bpe):
         vocab_to_words = _bpe_to_words
@@ -521,6 +529,9 @@ def get_librispeech_task_raw(
         main_measure_name="dev-other",
         score_recog_output_func=score,
         recog_post_proc_funcs=[vocab_to_words],
+        score_recog_outputs_func=(
+            functools.partial(score_many, sclite_report_datasets=sclite_report_datasets) if fused_scoring else None
+        ),
     )
 
 
@@ -532,13 +543,27 @@ def _bpe_to_words(bpe: RecogOutput) -> RecogOutput:
     """BPE to words"""
     from i6_core.returnn.search import SearchBPEtoWordsJob
 
+    if bpe.nbest_store:
+        from i6_experiments.users.zeyer.returnn.search import SearchNBestStoreRawReplaceJob
+
+        # same as SearchBPEtoWordsJob
+        words = SearchNBestStoreRawReplaceJob(bpe.output, [("@@ ", "")]).out_nbest_store
+        return RecogOutput(output=words, nbest_store=True)
+
     words = SearchBPEtoWordsJob(bpe.output, output_gzip=True).out_word_search_results
     return RecogOutput(output=words)
 
 
 def _spm_to_words(bpe: RecogOutput) -> RecogOutput:
     """BPE to words"""
-    from i6_experiments.users.zeyer.returnn.search import SearchOutputRawReplaceJob  # TODO move to i6_core
+    from i6_experiments.users.zeyer.returnn.search import (  # TODO move to i6_core
+        SearchOutputRawReplaceJob,
+        SearchNBestStoreRawReplaceJob,
+    )
+
+    if bpe.nbest_store:
+        words = SearchNBestStoreRawReplaceJob(bpe.output, [(" ", ""), ("▁", " ")]).out_nbest_store
+        return RecogOutput(output=words, nbest_store=True)
 
     words = SearchOutputRawReplaceJob(bpe.output, [(" ", ""), ("▁", " ")], output_gzip=True).out_search_results
     return RecogOutput(output=words)
@@ -571,3 +596,27 @@ def _score(*, hyp_words: tk.Path, corpus_name: str) -> ScoreResult:
 def score(dataset: DatasetConfig, recog_output: RecogOutput) -> ScoreResult:
     """score"""
     return _score(hyp_words=recog_output.output, corpus_name=dataset.get_main_name())
+
+
+def score_many(
+    recog_outputs: Dict[str, Tuple[DatasetConfig, RecogOutput]], *, sclite_report_datasets: Collection[str] = ()
+) -> Dict[str, ScoreResult]:
+    """
+    Score all recog outputs in a single job (:class:`ScoreRecogOutputsWerJob`), without sclite.
+    The full sclite pipeline is only used for the report of the datasets in sclite_report_datasets.
+    """
+    from .score_wer import ScoreRecogOutputsWerJob
+
+    corpus_names = {key: dataset.get_main_name() for key, (dataset, _) in recog_outputs.items()}
+    score_job = ScoreRecogOutputsWerJob(
+        {key: recog_output.output for key, (_, recog_output) in recog_outputs.items()},
+        {key: bliss_corpus_dict[corpus_name] for key, corpus_name in corpus_names.items()},
+        precision_ndigit=2,
+    )
+    res = {}
+    for key, corpus_name in corpus_names.items():
+        report = None
+        if key in sclite_report_datasets:
+            report = _score(hyp_words=recog_outputs[key][1].output, corpus_name=corpus_name).report
+        res[key] = ScoreResult(dataset_name=corpus_name, main_measure_value=score_job.out_wers[key], report=report)
+    return res
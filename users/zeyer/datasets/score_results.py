@@ -15,6 +15,8 @@ class RecogOutput:
     Corresponds to the target values of datasets defined by :class:`Task`
     """
     output: tk.Path
+    # If True, output is an n-best store (see returnn/nbest_store.py), otherwise RETURNN search output Python format.
+    nbest_store: bool = False
 
 
 @dataclasses.dataclass
@@ -0,0 +1,244 @@
+"""
+In-process WER scoring of many recog outputs at once.
+
+Instead of SearchWordsToCTMJob + CorpusToStmJob + ScliteJob per recog output,
+a single job reads all recog outputs and reference corpora and aligns all seqs in a batched (vectorized) DP.
+
+The alignment uses the same costs as sclite (correct 0, substitution 4, insertion 3, deletion 3),
+and words are compared case-insensitively, as sclite does by default,
+so that the numbers match sclite for simple cases like LibriSpeech
+(one segment per recording, no optionally deletable words, no GLM).
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, Union, Any, Dict, List, Sequence, Tuple
+import re
+from sisyphus import Job, Task, tk
+
+if TYPE_CHECKING:
+    import numpy
+
+CostSub = 4
+CostIns = 3
+CostDel = 3
+
+
+class ScoreRecogOutputsWerJob(Job):
+    """
+    Computes WER, substitutions, deletions, insertions for many recog outputs at once.
+
+    Output JSON format (``out_results_json``)::
+
+        {key: {"wer": ..., "sub": ..., "del": ..., "ins": ...,  (all in %)
+               "num_errors": ..., "num_sub": ..., "num_del": ..., "num_ins": ...,
+               "num_ref_words": ..., "num_seqs": ...},
+         ...}
+
+    Additionally, ``out_wers[key]`` contains the single WER value, like :class:`ScliteJob.out_wer`,
+    and ``out_wers_json`` is a dict key -> WER, like :class:`JoinScoreResultsJob.out_score_results`.
+    """
+
+    def __init__(
+        self,
+        recog_outputs: Dict[str, tk.Path],
+        corpus: Union[tk.Path, Dict[str, tk.Path]],
+        *,
+        case_sensitive: bool = False,
+        precision_ndigit: int = 2,
+    ):
+        """
+        :param recog_outputs: key -> search output in Python format, with words (e.g. after BPE merging).
+            Either a single hyp per seq, or an n-best list, where the hyp with the best score is used.
+        :param corpus: reference Bliss corpus, either the same for all recog outputs, or key -> corpus.
+            Every segment of the corpus must be in the recog output.
+        :param case_sensitive: sclite is case-insensitive by default
+        :param precision_ndigit: rounding of the (percentage) values, like in ScliteJob
+        """
+        if isinstance(corpus, dict):
+            assert set(corpus.keys()) == set(recog_outputs.keys())
+        self.recog_outputs = recog_outputs
+        self.corpus = corpus
+        self.case_sensitive = case_sensitive
+        self.precision_ndigit = precision_ndigit
+
+        self.out_results_json = self.output_path("results.json")
+        self.out_wers_json = self.output_path("wers.json")
+        self.out_wers = {}  # type: Dict[str, tk.Path]
+        filenames = set()
+        for key in recog_outputs.keys():
+            filename = "wer.%s.txt" % re.sub(r"[^\w.\-]", "_", key)
+            assert filename not in filenames, f"{self}: key {key!r} is ambiguous as filename {filename!r}"
+            filenames.add(filename)
+            self.out_wers[key] = self.output_path(filename)
+
+        self.rqmt = {"cpu": 1, "mem": 4, "time": 1}
+
+    def tasks(self):
+        """tasks"""
+        yield Task("run", rqmt=self.rqmt)
+
+    def run(self):
+        """run"""
+        import json
+        import numpy
+        import i6_core.util as util
+        from i6_core.lib import corpus
+
+        refs_by_corpus = {}  # corpus path -> seq tag -> words
+        keys = list(self.recog_outputs.keys())
+        refs, hyps, key_idx = [], [], []
+        for i, key in enumerate(keys):
+            corpus_path = (self.corpus[key] if isinstance(self.corpus, dict) else self.corpus).get_path()
+            if corpus_path not in refs_by_corpus:
+                c = corpus.Corpus()
+                c.load(corpus_path)
+                refs_by_corpus[corpus_path] = {seg.fullname(): self._words(seg.orth) for seg in c.segments()}
+            ref_words = refs_by_corpus[corpus_path]
+
+            d = eval(util.uopen(self.recog_outputs[key].get_path(), "rt").read(), {"nan": float("nan")})
+            assert isinstance(d, dict), f"{key}: expected dict, got {type(d)}"
+            for seq_tag, ref in ref_words.items():
+                assert seq_tag in d, f"{key}: seq tag {seq_tag!r} not in recog output"
+                hyp = d[seq_tag]
+                if isinstance(hyp, list):  # n-best list, [(score, text), ...]
+                    _, hyp = max(hyp, key=lambda entry: entry[0])
+                assert isinstance(hyp, str), f"{key}: unexpected type {type(hyp)} for {seq_tag!r}"
+                refs.append(ref)
+                hyps.append(self._words(hyp))
+                key_idx.append(i)
+
+        print(f"Aligning {len(refs)} seqs of {len(keys)} recog outputs...")
+        counts = align_counts_batched(refs, hyps)  # [seqs,3] (sub, del, ins)
+        key_idx = numpy.array(key_idx, dtype=numpy.int64)
+        ref_lens = numpy.array([len(ref) for ref in refs], dtype=numpy.int64)
+
+        results = {}
+        for i, key in enumerate(keys):
+            mask = key_idx == i
+            num_sub, num_del, num_ins = (int(v) for v in counts[mask].sum(axis=0))
+            num_ref_words = int(ref_lens[mask].sum())
+
+            def _percent(num: int) -> float:
+                return round(100.0 * num / max(num_ref_words, 1), self.precision_ndigit)
+
+            results[key] = {
+                "wer": _percent(num_sub + num_del + num_ins),
+                "sub": _percent(num_sub),
+                "del": _percent(num_del),
+                "ins": _percent(num_ins),
+                "num_errors": num_sub + num_del + num_ins,
+                "num_sub": num_sub,
+                "num_del": num_del,
+                "num_ins": num_ins,
+                "num_ref_words": num_ref_words,
+                "num_seqs": int(mask.sum()),
+            }
+            print(f"{key}: {results[key]}")
+            with open(self.out_wers[key].get_path(), "w") as f:
+                f.write(f"{results[key]['wer']}\n")
+
+        with open(self.out_results_json.get_path(), "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        with open(self.out_wers_json.get_path(), "w") as f:
+            f.write(json.dumps({key: res["wer"] for key, res in results.items()}))
+            f.write("\n")
+
+    def _words(self, text: str) -> List[str]:
+        return (text if self.case_sensitive else text.lower()).split()
+
+
+def align_counts_batched(
+    refs: Sequence[Sequence[Any]], hyps: Sequence[Sequence[Any]], *, chunk_size: int = 1024
+) -> numpy.ndarray:
+    """
+    Minimum cost alignment (sclite costs, see module docstring) for many (ref, hyp) pairs at once.
+
+    The DP runs row by row over the ref positions, each row for all pairs and all hyp positions at once.
+    Within a row, the insertion dependency is resolved via a cumulative min.
+    Along with the cost, we keep the number of substitutions, deletions and insertions of the best path.
+    Paths with equal cost can have a different number of errors
+    (e.g. 3 substitutions vs. 2 deletions + 2 insertions + 1 correct, both cost 12),
+    so we break ties like sclite does when it picks the predecessor of a DP cell:
+    deletion first, then insertion, then match/substitution.
+
+    :param refs: list of word seqs (any hashable tokens)
+    :param hyps: list of word seqs, same len as refs
+    :param chunk_size: max number of pairs per batch, to limit memory
+    :return: int64 array [len(refs),3] with (num sub, num del, num ins)
+    """
+    import numpy
+
+    assert len(refs) == len(hyps)
+    vocab = {}
+    refs = [[vocab.setdefault(w, len(vocab)) for w in ref] for ref in refs]
+    hyps = [[vocab.setdefault(w, len(vocab)) for w in hyp] for hyp in hyps]
+    # Sort by length, such that chunks have similar lengths and padding is small.
+    order = sorted(range(len(refs)), key=lambda i: (len(refs[i]), len(hyps[i])))
+    res = numpy.zeros((len(refs), 3), dtype=numpy.int64)
+    for start in range(0, len(order), chunk_size):
+        idx = order[start : start + chunk_size]
+        res[idx] = _align_counts_padded(
+            _pad([refs[i] for i in idx], pad_value=-1), _pad([hyps[i] for i in idx], pad_value=-2)
+        )
+    return res
+
+
+def _align_counts_padded(
+    refs: Tuple[numpy.ndarray, numpy.ndarray], hyps: Tuple[numpy.ndarray, numpy.ndarray]
+) -> numpy.ndarray:
+    """
+    :param refs: (tokens [B,R], lens [B])
+    :param hyps: (tokens [B,H], lens [B])
+    :return: [B,3] (sub, del, ins)
+    """
+    import numpy
+
+    ref, ref_lens = refs
+    hyp, hyp_lens = hyps
+    batch_size, max_hyp_len = hyp.shape
+    pos = numpy.arange(max_hyp_len + 1)[None, :]  # [1,H+1]
+    # state for ref prefix len 0: only insertions
+    cost = numpy.broadcast_to(CostIns * pos, (batch_size, max_hyp_len + 1))  # [B,H+1]
+    counts = numpy.zeros((batch_size, max_hyp_len + 1, 3), dtype=numpy.int64)  # [B,H+1,3] (sub, del, ins)
+    counts[:, :, 2] = pos
+    res = numpy.zeros((batch_size, 3), dtype=numpy.int64)
+    res[:, 2] = hyp_lens  # for ref len 0
+    batch_idx = numpy.arange(batch_size)[:, None]  # [B,1]
+    for i in range(1, ref.shape[1] + 1):
+        neq = (ref[:, i - 1 : i] != hyp).astype(numpy.int64)  # [B,H]
+        diag_cost = cost[:, :-1] + CostSub * neq  # [B,H]
+        del_cost = cost[:, 1:] + CostDel  # [B,H]
+        use_diag = diag_cost < del_cost  # [B,H], on ties prefer deletion
+        cand_cost = numpy.concatenate(
+            [numpy.full((batch_size, 1), CostDel * i), numpy.where(use_diag, diag_cost, del_cost)], axis=1
+        )  # [B,H+1]
+        cand_counts = numpy.where(use_diag[:, :, None], counts[:, :-1], counts[:, 1:])  # [B,H,3]
+        cand_counts = cand_counts + numpy.stack([neq * use_diag, ~use_diag, numpy.zeros_like(neq)], axis=2)
+        cand_counts = numpy.concatenate([numpy.zeros((batch_size, 1, 3), dtype=numpy.int64), cand_counts], axis=1)
+        cand_counts[:, 0, 1] = i  # [B,H+1,3]
+        # insertions: cost[j] = min_{k<=j} cand_cost[k] + CostIns * (j - k).
+        # Cell j takes its own candidate if it is cheaper than the insertion from j-1,
+        # or equally cheap and a deletion (preferred over insertion), otherwise it continues the insertions.
+        # Thus, among the argmins k, take the largest one with a deletion, otherwise the smallest one.
+        # Encode this tie-break and k into the key such that a single cumulative min gives us the argmin.
+        is_del = numpy.concatenate([numpy.full((batch_size, 1), True), ~use_diag], axis=1)  # [B,H+1]
+        tie_break = numpy.where(is_del, max_hyp_len - pos, max_hyp_len + 1 + pos)  # [B,H+1], in [0,2H+2)
+        key = (cand_cost - CostIns * pos) * (2 * max_hyp_len + 2) + tie_break  # [B,H+1]
+        tie_break = numpy.minimum.accumulate(key, axis=1) % (2 * max_hyp_len + 2)  # [B,H+1]
+        src = numpy.where(tie_break <= max_hyp_len, max_hyp_len - tie_break, tie_break - max_hyp_len - 1)  # -> k
+        cost = cand_cost[batch_idx, src] + CostIns * (pos - src)
+        counts = cand_counts[batch_idx, src]
+        counts[:, :, 2] += pos - src
+        res = numpy.where((ref_lens == i)[:, None], counts[numpy.arange(batch_size), hyp_lens], res)
+    return res
+
+
+def _pad(seqs: List[List[int]], *, pad_value: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    import numpy
+
+    lens = numpy.array([len(s) for s in seqs], dtype=numpy.int64)
+    out = numpy.full((len(seqs), max(int(lens.max()), 1)), pad_value, dtype=numpy.int64)
+    for i, s in enumerate(seqs):
+        out[i, : len(s)] = s
+    return out, lens
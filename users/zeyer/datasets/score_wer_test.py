@@ -0,0 +1,135 @@
+"""
+Tests for :mod:`score_wer`, i.e. that the batched alignment gives the same sub/del/ins counts as sclite.
+"""
+
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import Optional, Sequence, Tuple
+
+import numpy
+import pytest
+
+from .score_wer import CostDel, CostIns, CostSub, align_counts_batched
+
+# (ref, hyp) pairs, including cases where paths with equal cost have a different number of errors.
+_FIXTURE = [
+    ("a b c", "c x y"),  # 3 sub vs. 2 del + 2 ins (+ 1 cor), both cost 12
+    ("a b c d", "d x y z"),
+    ("x a b c", "a b c"),
+    ("a b c", "a b c d e"),
+    ("the cat sat on the mat", "cat sat on a mat today"),
+    ("one two three four five", "five four three two one"),
+    ("a a b b", "b b a a"),
+    ("hello world", ""),
+    ("", "hello world"),
+    ("a b a b a b", "b a b a b a"),
+]
+
+
+def _align_counts_reference(ref: Sequence[str], hyp: Sequence[str]) -> Tuple[int, int, int]:
+    """
+    Plain full-matrix DP with backpointers and backtrace, like sclite:
+    on ties, the predecessor is deletion, then insertion, then match/substitution.
+
+    :return: (num sub, num del, num ins)
+    """
+    inf = float("inf")
+    cost = [[inf] * (len(hyp) + 1) for _ in range(len(ref) + 1)]
+    back = [[None] * (len(hyp) + 1) for _ in range(len(ref) + 1)]
+    cost[0][0] = 0
+    for i in range(len(ref) + 1):
+        for j in range(len(hyp) + 1):
+            if i == 0 and j == 0:
+                continue
+            candidates = []
+            if i > 0:
+                candidates.append((cost[i - 1][j] + CostDel, "del"))
+            if j > 0:
+                candidates.append((cost[i][j - 1] + CostIns, "ins"))
+            if i > 0 and j > 0:
+                candidates.append((cost[i - 1][j - 1] + (CostSub if ref[i - 1] != hyp[j - 1] else 0), "diag"))
+            for c, op in candidates:
+                if c < cost[i][j]:
+                    cost[i][j], back[i][j] = c, op
+    num_sub = num_del = num_ins = 0
+    i, j = len(ref), len(hyp)
+    while i > 0 or j > 0:
+        op = back[i][j]
+        if op == "del":
+            num_del += 1
+            i -= 1
+        elif op == "ins":
+            num_ins += 1
+            j -= 1
+        else:
+            num_sub += int(ref[i - 1] != hyp[j - 1])
+            i, j = i - 1, j - 1
+    return num_sub, num_del, num_ins
+
+
+def test_align_counts_batched_tie_break():
+    # 2 del + 2 ins instead of 3 sub
+    assert align_counts_batched([["a", "b", "c"]], [["c", "x", "y"]]).tolist() == [[0, 2, 2]]
+
+
+def test_align_counts_batched_reference():
+    rnd = random.Random(42)
+    refs, hyps = [], []
+    for ref, hyp in _FIXTURE:
+        refs.append(ref.split())
+        hyps.append(hyp.split())
+    for _ in range(2000):
+        # small vocab, such that there are many ties
+        refs.append([rnd.choice("abcd") for _ in range(rnd.randint(0, 12))])
+        hyps.append([rnd.choice("abcd") for _ in range(rnd.randint(0, 12))])
+    res = align_counts_batched(refs, hyps, chunk_size=97)
+    ref_res = numpy.array([_align_counts_reference(ref, hyp) for ref, hyp in zip(refs, hyps)])
+    numpy.testing.assert_array_equal(res, ref_res)
+
+
+def _sclite_bin() -> Optional[str]:
+    """sclite binary, from $SCLITE (e.g. the output of :func:`compile_sctk` + "/sclite"), or from $PATH"""
+    return os.environ.get("SCLITE") or shutil.which("sclite")
+
+
+@pytest.mark.skipif(not _sclite_bin(), reason="sclite not available, set $SCLITE or add it to $PATH")
+def test_align_counts_batched_sclite():
+    refs = [ref.split() for ref, _ in _FIXTURE]
+    hyps = [hyp.split() for _, hyp in _FIXTURE]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, seqs in [("ref.trn", refs), ("hyp.trn", hyps)]:
+            with open(f"{tmp_dir}/{name}", "w") as f:
+                for i, seq in enumerate(seqs):
+                    f.write(f"{' '.join(seq)} (spk_{i:04d})\n")
+        out = subprocess.check_output(
+            [_sclite_bin(), "-r", "ref.trn", "trn", "-h", "hyp.trn", "trn", "-i", "rm", "-o", "pralign", "stdout"],
+            cwd=tmp_dir,
+            text=True,
+        )
+    sclite_res = _parse_sclite_pralign(out)
+    assert len(sclite_res) == len(_FIXTURE)
+    res = align_counts_batched(refs, hyps)
+    for i, (ref, hyp) in enumerate(_FIXTURE):
+        assert res[i].tolist() == list(sclite_res[f"spk_{i:04d}"]), f"ref {ref!r}, hyp {hyp!r}"
+
+
+def _parse_sclite_pralign(out: str) -> dict:
+    """:return: utt id -> (num sub, num del, num ins)"""
+    res = {}
+    utt_id = None
+    for line in out.splitlines():
+        m = re.match(r"^id: \((.*)\)$", line.strip())
+        if m:
+            utt_id = m.group(1).lower()
+            continue
+        m = re.match(r"^Scores: \(#C #S #D #I\) (\d+) (\d+) (\d+) (\d+)$", line.strip())
+        if m:
+            assert utt_id is not None
+            _, num_sub, num_del, num_ins = (int(v) for v in m.groups())
+            res[utt_id] = (num_sub, num_del, num_ins)
+            utt_id = None
+    return res
@@ -44,6 +44,13 @@ def get_switchboard_task_bpe1k(*, bpe_sample: float = 0.0) -> Task:
 
 def _bpe_to_words(bpe: RecogOutput) -> RecogOutput:
     """BPE to words"""
+    if bpe.nbest_store:
+        from i6_experiments.users.zeyer.returnn.search import SearchNBestStoreRawReplaceJob
+
+        # same as SearchBPEtoWordsJob
+        words = SearchNBestStoreRawReplaceJob(bpe.output, [("@@ ", "")]).out_nbest_store
+        return RecogOutput(output=words, nbest_store=True)
+
     words = SearchBPEtoWordsJob(bpe.output, output_gzip=True).out_word_search_results
     return RecogOutput(output=words)
 
@@ -3,7 +3,7 @@ Dataset / task interface
 """
 
 from __future__ import annotations
-from typing import Dict, Callable, Sequence
+from typing import Optional, Dict, Tuple, Callable, Sequence
 import dataclasses
 
 from returnn_common.datasets_old_2022_10.interface import DatasetConfig
@@ -36,6 +36,7 @@ class Task:
     score_recog_output_func: Callable[[DatasetConfig, RecogOutput], ScoreResult]
 
     # e.g. for bpe_to_words or so. This is here because it depends on the type of vocab.
+    # They need to handle RecogOutput.nbest_store, i.e. keep the n-best store or convert it.
     recog_post_proc_funcs: Sequence[Callable[[RecogOutput], RecogOutput]] = ()
 
     def default_collect_score_results(self, score_results: Dict[str, ScoreResult]) -> ScoreResultCollection:
@@ -45,6 +46,12 @@ class Task:
 
     collect_score_results_func: Callable[[Dict[str, ScoreResult]], ScoreResultCollection] = None
 
+    # Optional. Scores all recog outputs at once (dataset name -> (dataset, recog output)), e.g. in a single job.
+    # If set, this is used instead of score_recog_output_func.
+    score_recog_outputs_func: Optional[
+        Callable[[Dict[str, Tuple[DatasetConfig, RecogOutput]]], Dict[str, ScoreResult]]
+    ] = None
+
     def __post_init__(self):
         if self.collect_score_results_func is None:
             self.collect_score_results_func = self.default_collect_score_results
@@ -0,0 +1,94 @@
+"""
+Label scorer wrapper (for our pure torch beam search, see ``beam_search_torch``)
+which deduplicates identical label histories (prefixes) over the whole batch and beam.
+
+This is intended for label scorers which only depend on the label history, e.g. an external LM
+for shallow fusion (``trafo_lm.make_label_scorer_torch``).
+All hyps with the same prefix get the same log probs and the same state,
+so we compute every unique prefix only once and scatter the log probs back to ``[batch,beam,vocab]``.
+E.g. in the first step, all seqs of the batch have the same (empty) prefix,
+and later, hyps which differ only in the AED/CTC part of the search but not in the labels collapse to one LM hyp.
+
+The state visible to the beam search only contains the prefix id of each hyp (``[batch,beam]``, int64),
+which the beam search gathers like any other state.
+The state of the wrapped label scorer is kept in compact form, with batch 1 and beam = num unique prefixes,
+and is only gathered once per step by the unique (prefix id, label) pairs.
+Prefix ids are exact (via :func:`torch.unique`), so there are no hash collisions.
+
+Note that we do not keep a cache of prefix states across steps:
+in the ``[batch,beam]`` based beam search, all hyps of a step have the same length,
+so a prefix can only be shared with hyps of the same step, which is covered by the dedup.
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Tuple
+
+if TYPE_CHECKING:
+    import torch
+    from .beam_search_torch.interface import LabelScorerIntf
+
+
+def make_prefix_dedup_label_scorer(label_scorer: LabelScorerIntf) -> LabelScorerIntf:
+    """
+    :param label_scorer: must only depend on the labels (not on the batch entry, e.g. no encoder),
+        and its :func:`LabelScorerIntf.max_remaining_seq_score` must not depend on the state (e.g. just 0).
+    :return: label scorer with the same log probs, but computing every unique prefix only once
+    """
+    import torch
+    import tree
+    from .beam_search_torch.interface import LabelScorerIntf, StateObjTensorExt, StateObjIgnored
+
+    def _gather_compact(v: Any, *, idx: torch.Tensor) -> Any:
+        if isinstance(v, StateObjTensorExt):
+            assert v.tensor.shape[0] == 1, f"compact state expected, got shape {v.tensor.shape}"
+            return StateObjTensorExt(torch.index_select(v.tensor, 1, idx), v.extra)
+        elif isinstance(v, StateObjIgnored):
+            return v
+        else:
+            raise TypeError(f"_gather_compact: unexpected {v} ({type(v).__name__})")
+
+    class PrefixDedupLabelScorer(LabelScorerIntf):
+        """Wraps another label scorer, computing each unique label history only once."""
+
+        def get_initial_state(self, *, batch_size: int, device: torch.device) -> Any:
+            """Initial state."""
+            return {
+                # all seqs start with the same empty prefix
+                "prefix_id": StateObjTensorExt(torch.zeros((batch_size, 1), dtype=torch.int64, device=device), None),
+                "inner": StateObjIgnored(label_scorer.get_initial_state(batch_size=1, device=device)),
+            }
+
+        def max_remaining_seq_score(
+            self, *, state: Any, max_remaining_steps: torch.Tensor, device: torch.device
+        ) -> torch.Tensor:
+            """max remaining"""
+            res = label_scorer.max_remaining_seq_score(
+                state=state["inner"].content, max_remaining_steps=max_remaining_steps, device=device
+            )
+            assert res.numel() == 1, f"{label_scorer}: state-dependent max_remaining_seq_score not supported"
+            return res
+
+        def score_and_update_state(
+            self,
+            *,
+            prev_state: Any,
+            prev_label: torch.Tensor,
+        ) -> Tuple[torch.Tensor, Any]:
+            """update state"""
+            batch_size, beam_size = prev_label.shape
+            prefix_id = prev_state["prefix_id"].tensor  # [batch,beam] -> prev unique prefix
+            pairs = torch.stack([prefix_id, prev_label.to(torch.int64)], dim=-1).flatten(0, 1)  # [batch*beam,2]
+            unique_pairs, inverse = torch.unique(pairs, dim=0, return_inverse=True)  # [num_unique,2], [batch*beam]
+            inner_state = tree.map_structure(
+                lambda v: _gather_compact(v, idx=unique_pairs[:, 0]), prev_state["inner"].content
+            )
+            log_probs, inner_state = label_scorer.score_and_update_state(
+                prev_state=inner_state, prev_label=unique_pairs[None, :, 1].to(prev_label.dtype)
+            )  # [1,num_unique,vocab]
+            log_probs = torch.index_select(log_probs[0], 0, inverse).view(batch_size, beam_size, -1)
+            return log_probs, {
+                "prefix_id": StateObjTensorExt(inverse.view(batch_size, beam_size), None),
+                "inner": StateObjIgnored(inner_state),
+            }
+
+    return PrefixDedupLabelScorer()
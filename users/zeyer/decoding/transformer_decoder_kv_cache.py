@@ -0,0 +1,348 @@
+"""
+Fast-path label scorer (for our pure torch beam search, see ``beam_search_torch``)
+for the RF :class:`TransformerDecoder`.
+
+The generic label scorers (e.g. ``aed.get_label_scorer_pure_torch``, ``trafo_lm.make_label_scorer_torch``)
+call the RF decoder for every step and convert the whole decoder state between raw tensors and RF tensors
+(``copy_template_new_dim_tags``, ``copy_transpose``), and the self-attention keys/values grow by concatenation.
+For batch*beam decoding on CPU, this per-step Python and allocation overhead is significant.
+
+Here, we directly use the raw parameters with plain torch ops.
+The self-attention keys/values of all layers are kept in preallocated buffers ``[max_len, batch*beam, heads, dim]``,
+which are reordered in-place (double buffered) by the beam backrefs.
+To get the backrefs, the state which is visible to the beam search only contains the row index of each hyp
+(``arange(beam)`` after each step), which the beam search then gathers like any other state,
+i.e. in the next step, it contains the backrefs.
+This assumes that the beam search derives the next state only by gathering the last state along the beam,
+as the ``[batch,beam]`` based beam search implementations do (not the ``sep_ended`` variants).
+
+Only the standard layer types are supported, see :func:`is_supported`. Otherwise use the generic label scorer.
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, Optional, Any, List, Sequence, Tuple
+from returnn.tensor import Tensor, Dim
+import returnn.frontend as rf
+from returnn.frontend.decoder.transformer import TransformerDecoder, TransformerDecoderLayer, FeedForward
+
+if TYPE_CHECKING:
+    import torch
+    from .beam_search_torch.interface import LabelScorerIntf
+
+
+def is_supported(decoder: TransformerDecoder) -> bool:
+    """
+    :return: whether :func:`make_label_scorer` supports this decoder
+    """
+    if not isinstance(decoder, TransformerDecoder):
+        return False
+    if getattr(decoder, "input_embedding", None) is None:
+        return False
+    if not isinstance(decoder.final_layer_norm, rf.LayerNorm):
+        return False
+    for layer in decoder.layers:
+        if type(layer) is not TransformerDecoderLayer:
+            return False
+        if type(layer.self_att) is not rf.CausalSelfAttention:
+            return False
+        if layer.cross_att is not None and type(layer.cross_att) is not rf.CrossAttention:
+            return False
+        if type(layer.ff) is not FeedForward or _get_torch_activation(layer.ff.activation) is None:
+            return False
+        for ln in [layer.self_att_layer_norm, layer.cross_att_layer_norm, layer.ff_layer_norm]:
+            if ln is not None and type(ln) is not rf.LayerNorm:
+                return False
+    return True
+
+
+def make_label_scorer(
+    decoder: TransformerDecoder, *, batch_dim: Optional[Dim] = None, enc: Optional[rf.State] = None
+) -> LabelScorerIntf:
+    """
+    :param decoder: see :func:`is_supported`
+    :param batch_dim: for the encoder, if there is cross attention
+    :param enc: output of ``decoder.transform_encoder``, if there is cross attention. [batch_dim,enc_spatial,...]
+    :return: label scorer. log probs are of shape [batch,beam,vocab]
+    """
+    import torch
+    from .beam_search_torch.interface import LabelScorerIntf, StateObjTensorExt, StateObjIgnored
+
+    assert is_supported(decoder), f"{decoder} not supported, use the generic label scorer"
+    params = _DecoderParams(decoder, batch_dim=batch_dim, enc=enc)
+
+    class LabelScorer(LabelScorerIntf):
+        """TransformerDecoder label scorer with preallocated self-attention KV cache"""
+
+        def get_initial_state(self, *, batch_size: int, device: torch.device) -> Any:
+            """Initial state."""
+            return {
+                "row": StateObjTensorExt(torch.zeros((batch_size, 1), dtype=torch.int64, device=device), None),
+                "cache": StateObjIgnored(_KVCache(params, batch_size=batch_size, device=device)),
+            }
+
+        def max_remaining_seq_score(
+            self, *, state: Any, max_remaining_steps: torch.Tensor, device: torch.device
+        ) -> torch.Tensor:
+            """max remaining"""
+            return torch.zeros((1, 1), device=device)
+
+        def score_and_update_state(
+            self,
+            *,
+            prev_state: Any,
+            prev_label: torch.Tensor,
+        ) -> Tuple[torch.Tensor, Any]:
+            """update state"""
+            cache: _KVCache = prev_state["cache"].content
+            batch_size, beam_size = prev_label.shape
+            cache.reorder(prev_state["row"].tensor)
+            log_probs = params.step(prev_label.flatten(), cache=cache)  # [batch*beam,vocab]
+            row = torch.arange(beam_size, device=prev_label.device)[None, :].expand(batch_size, beam_size)
+            return log_probs.view(batch_size, beam_size, -1), {
+                "row": StateObjTensorExt(row, None),
+                "cache": prev_state["cache"],
+            }
+
+    return LabelScorer()
+
+
+class _KVCache:
+    """
+    Self-attention keys/values of all layers, ``[max_len, batch*beam, heads, dim]`` each,
+    for the hyps of the last step, in the order of the last step.
+    """
+
+    def __init__(self, params: _DecoderParams, *, batch_size: int, device: torch.device):
+        self.params = params
+        self.batch_size = batch_size
+        self.beam_size = 1
+        self.device = device
+        self.pos = 0  # num frames in the cache
+        self.max_len = 0
+        self.keys: List[torch.Tensor] = []  # per layer
+        self.values: List[torch.Tensor] = []  # per layer
+        # buffers for the reordering. we swap them with keys/values
+        self._keys_tmp: List[torch.Tensor] = []
+        self._values_tmp: List[torch.Tensor] = []
+
+    def _alloc(self, max_len: int, beam_size: int) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        import torch
+
+        num_rows = self.batch_size * beam_size
+        keys, values = [], []
+        for layer in self.params.layers:
+            keys.append(torch.empty((max_len, num_rows) + layer.key_shape, dtype=layer.dtype, device=self.device))
+            values.append(torch.empty((max_len, num_rows) + layer.value_shape, dtype=layer.dtype, device=self.device))
+        return keys, values
+
+    def reorder(self, backrefs: torch.Tensor):
+        """
+        :param backrefs: [batch,beam] -> prev beam. afterwards, the cache is in the order of the new beam,
+            and there is space for the next frame.
+        """
+        import torch
+
+        beam_size = backrefs.shape[1]
+        max_len = self.max_len if self.pos < self.max_len else max(16, self.max_len * 2)
+        realloc = beam_size != self.beam_size or max_len != self.max_len
+        if realloc:
+            # This only happens in the first steps (beam size changes), and rarely for the max len.
+            self._keys_tmp, self._values_tmp = self._alloc(max_len, beam_size)
+            new_keys, new_values = self._alloc(max_len, beam_size)
+        else:
+            new_keys, new_values = self._keys_tmp, self._values_tmp
+        if self.pos > 0:
+            flat_idx = (
+                torch.arange(self.batch_size, device=backrefs.device)[:, None] * self.beam_size + backrefs
+            ).flatten()  # [batch*beam] -> prev batch*beam
+            for src, dst in zip(self.keys + self.values, new_keys + new_values):
+                torch.index_select(src[: self.pos], 1, flat_idx, out=dst[: self.pos])
+        if not realloc:  # swap, the old buffers are reused for the next reordering
+            self._keys_tmp, self._values_tmp = self.keys, self.values
+        self.keys, self.values = new_keys, new_values
+        self.beam_size = beam_size
+        self.max_len = max_len
+
+
+class _LayerParams:
+    def __init__(self, layer: TransformerDecoderLayer, *, enc: Optional[rf.State], batch_dim: Optional[Dim]):
+        import torch
+
+        self_att = layer.self_att
+        self.num_heads = self_att.num_heads.dimension
+        self.key_dim = self_att.key_dim_per_head.dimension
+        self.value_dim = self_att.value_dim_per_head.dimension
+        self.key_shape = (self.num_heads, self.key_dim)
+        self.value_shape = (self.num_heads, self.value_dim)
+        self.self_att_ln = _layer_norm_params(layer.self_att_layer_norm)
+        self.self_att_qkv = _linear_params(self_att.qkv)
+        self.self_att_proj = _linear_params(self_att.proj) if self_att.proj is not None else None
+        self.dtype = self.self_att_qkv[0].dtype
+
+        self.cross_att = None
+        if layer.cross_att is not None:
+            cross_att = layer.cross_att
+            assert enc is not None and batch_dim is not None, "cross attention needs the encoder"
+            kv_axis: Dim = enc.kv_axis
+            k: Tensor = enc.k
+            v: Tensor = enc.v
+            k_raw = k.copy_transpose([batch_dim, kv_axis, cross_att.num_heads, cross_att.key_dim_per_head]).raw_tensor
+            v_raw = v.copy_transpose([batch_dim, kv_axis, cross_att.num_heads, cross_att.value_dim_per_head])
+            mask = None
+            if kv_axis.dyn_size_ext is not None and kv_axis.dyn_size_ext.dims:
+                seq_lens = kv_axis.dyn_size_ext.copy_compatible_to_dims_raw([batch_dim]).to(k_raw.device)  # [B]
+                mask = torch.arange(k_raw.shape[1], device=k_raw.device)[None, :] < seq_lens[:, None]  # [B,T]
+            self.cross_att = {
+                "ln": _layer_norm_params(layer.cross_att_layer_norm),
+                "query": _linear_params(cross_att.q),
+                "proj": _linear_params(cross_att.proj) if cross_att.proj is not None else None,
+                "num_heads": cross_att.num_heads.dimension,
+                "key_dim": cross_att.key_dim_per_head.dimension,
+                "k": k_raw.detach(),  # [B,T,H,Dk]
+                "v": v_raw.raw_tensor.detach(),  # [B,T,H,Dv]
+                "mask": mask,  # [B,T] or None
+            }
+
+        self.ff_ln = _layer_norm_params(layer.ff_layer_norm)
+        self.ff_in = _linear_params(layer.ff.linear_ff)
+        self.ff_out = _linear_params(layer.ff.linear_out)
+        self.ff_activation = _get_torch_activation(layer.ff.activation)
+
+    def step(self, x: torch.Tensor, *, keys: torch.Tensor, values: torch.Tensor, pos: int, beam_size: int):
+        """
+        :param x: [batch*beam,model]
+        :param keys: cache [max_len,batch*beam,heads,key_dim], updated in-place at pos
+        :param values: cache [max_len,batch*beam,heads,value_dim], updated in-place at pos
+        :param pos:
+        :param beam_size:
+        :return: [batch*beam,model]
+        """
+        import torch
+
+        num_rows = x.shape[0]
+        h = _layer_norm(x, self.self_att_ln)
+        qkv = _linear(h, self.self_att_qkv).view(num_rows, self.num_heads, 2 * self.key_dim + self.value_dim)
+        q, k, v = qkv.split([self.key_dim, self.key_dim, self.value_dim], dim=-1)
+        keys[pos] = k
+        values[pos] = v
+        energy = torch.einsum("nhd,tnhd->nht", q * self.key_dim**-0.5, keys[: pos + 1])
+        att_weights = torch.softmax(energy, dim=-1)
+        att = torch.einsum("nht,tnhd->nhd", att_weights, values[: pos + 1]).reshape(num_rows, -1)
+        if self.self_att_proj is not None:
+            att = _linear(att, self.self_att_proj)
+        x = x + att
+
+        if self.cross_att is not None:
+            p = self.cross_att
+            h = _layer_norm(x, p["ln"])
+            q = _linear(h, p["query"]).view(-1, beam_size, p["num_heads"], p["key_dim"])  # [B,K,H,Dk]
+            energy = torch.einsum("bkhd,bthd->bkht", q * p["key_dim"] ** -0.5, p["k"])
+            if p["mask"] is not None:
+                energy = energy.masked_fill(~p["mask"][:, None, None, :], float("-inf"))
+            att_weights = torch.softmax(energy, dim=-1)
+            att = torch.einsum("bkht,bthd->bkhd", att_weights, p["v"]).reshape(num_rows, -1)
+            if p["proj"] is not None:
+                att = _linear(att, p["proj"])
+            x = x + att
+
+        h = _layer_norm(x, self.ff_ln)
+        x = x + _linear(self.ff_activation(_linear(h, self.ff_in)), self.ff_out)
+        return x
+
+
+class _DecoderParams:
+    def __init__(self, decoder: TransformerDecoder, *, batch_dim: Optional[Dim], enc: Optional[rf.State]):
+        self.decoder = decoder
+        self.embedding = _raw_param(
+            decoder.input_embedding.weight, [decoder.vocab_dim, decoder.input_embedding.out_dim]
+        )
+        self.embedding_scale = decoder.input_embedding_scale
+        input_embedding_proj = getattr(decoder, "input_embedding_proj", None)
+        self.embedding_proj = _linear_params(input_embedding_proj) if input_embedding_proj is not None else None
+        self.layers = [
+            _LayerParams(layer, enc=enc[name].cross_att if layer.cross_att is not None else None, batch_dim=batch_dim)
+            for name, layer in decoder.layers.items()
+        ]
+        self.final_ln = _layer_norm_params(decoder.final_layer_norm)
+        self.logits = _linear_params(decoder.logits)
+        self._pos_enc_table: Optional[torch.Tensor] = None  # [max_len,embed]
+
+    def _get_pos_enc(self, pos: int) -> Optional[torch.Tensor]:
+        """:return: [embed]"""
+        if self.decoder.pos_enc is None:
+            return None
+        if self._pos_enc_table is None or pos >= self._pos_enc_table.shape[0]:
+            num_pos = max(64, pos * 2)
+            pos_dim = Dim(num_pos, name="dec-pos")
+            table = self.decoder.pos_enc(spatial_dim=pos_dim)
+            feat_dims = [dim for dim in table.dims if dim != pos_dim]
+            assert len(feat_dims) == 1, f"unexpected pos enc {table}"
+            self._pos_enc_table = table.copy_transpose([pos_dim] + feat_dims).raw_tensor.detach()
+        return self._pos_enc_table[pos]
+
+    def step(self, labels: torch.Tensor, *, cache: _KVCache) -> torch.Tensor:
+        """
+        :param labels: [batch*beam], the prev labels
+        :param cache: already reordered to the current beam, see :func:`_KVCache.reorder`. pos is increased
+        :return: log probs [batch*beam,vocab]
+        """
+        import torch
+
+        pos = cache.pos
+        x = torch.nn.functional.embedding(labels, self.embedding) * self.embedding_scale
+        pos_enc = self._get_pos_enc(pos)
+        if pos_enc is not None:
+            x = x + pos_enc.to(x.device)
+        if self.embedding_proj is not None:
+            x = _linear(x, self.embedding_proj)
+        for layer, keys, values in zip(self.layers, cache.keys, cache.values):
+            x = layer.step(x, keys=keys, values=values, pos=pos, beam_size=cache.beam_size)
+        x = _layer_norm(x, self.final_ln)
+        logits = _linear(x, self.logits)
+        cache.pos += 1
+        return torch.log_softmax(logits, dim=-1)
+
+
+def _raw_param(param: Tensor, dims: Sequence[Dim]) -> torch.Tensor:
+    return param.copy_transpose(dims).raw_tensor.detach()
+
+
+def _linear_params(linear: rf.Linear) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    # The weight is [in_dim, out_dim], where in_dim has a match priority if in_dim == out_dim,
+    # so copy_transpose by the dims would be ambiguous.
+    assert len(linear.weight.dims) == 2 and linear.weight.dims[1] == linear.out_dim
+    weight = linear.weight.raw_tensor.detach()
+    bias = _raw_param(linear.bias, [linear.out_dim]) if linear.bias is not None else None
+    return weight, bias
+
+
+def _linear(x: torch.Tensor, params: Tuple[torch.Tensor, Optional[torch.Tensor]]) -> torch.Tensor:
+    import torch
+
+    weight, bias = params
+    return torch.addmm(bias, x, weight) if bias is not None else torch.matmul(x, weight)
+
+
+def _layer_norm_params(ln: rf.LayerNorm) -> Tuple[torch.Tensor, torch.Tensor, float]:
+    return _raw_param(ln.scale, [ln.in_dim]), _raw_param(ln.bias, [ln.in_dim]), ln.eps
+
+
+def _layer_norm(x: torch.Tensor, params: Tuple[torch.Tensor, torch.Tensor, float]) -> torch.Tensor:
+    import torch
+
+    scale, bias, eps = params
+    return torch.nn.functional.layer_norm(x, scale.shape, scale, bias, eps)
+
+
+def _get_torch_activation(func: Any):
+    import torch
+
+    for rf_name, torch_func in [
+        ("relu", torch.relu),
+        ("gelu", torch.nn.functional.gelu),
+        ("silu", torch.nn.functional.silu),
+        ("swish", torch.nn.functional.silu),
+    ]:
+        if func is getattr(rf, rf_name, None):
+            return torch_func
+    return None
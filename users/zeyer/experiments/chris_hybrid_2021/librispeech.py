@@ -650,7 +650,7 @@ def test_run():
     gs.SHOW_JOB_TARGETS = False
 
     new_obj = get_chris_hybrid_system_init_args()
-    orig_obj = dependency_boundary(get_orig_chris_hybrid_system_init_args, hash="SfEtodPqm7gG")
+    orig_obj = dependency_boundary(get_orig_chris_hybrid_system_init_args, hash="SfEtodPqm7gG", fast_cache=True)
 
     # Small cleanup in orig object, which should not be needed.
     orig_obj['dev_data']['dev-other'].feature_scorers = {}
@@ -0,0 +1,218 @@
+"""
+Step-time benchmark of the pure torch label scorers for the TransformerDecoder:
+the generic one (RF decoder per step, :func:`aed.get_label_scorer_pure_torch`)
+vs. the fast path with preallocated self-att KV cache
+(:mod:`i6_experiments.users.zeyer.decoding.transformer_decoder_kv_cache`).
+
+Uses a randomly initialized AED-like decoder (6 layers, dim 512, 10k vocab) with random encoder output,
+and simulates beam search steps with random labels and random backrefs.
+Also checks that both scorers give the same log probs.
+
+:func:`benchmark_lm` does the same for a Transformer LM (decoder without encoder) for shallow fusion,
+i.e. :func:`trafo_lm.make_label_scorer_torch` with and without ``kv_cache``,
+each also wrapped with :func:`make_prefix_dedup_label_scorer`.
+
+Run::
+
+    export PYTHONPATH tools/sisyphus:recipe
+    python3 -m i6_experiments.users.zeyer.experiments.exp2023_04_25_rf._label_scorer_kv_cache_benchmark
+"""
+
+from __future__ import annotations
+from typing import Any, Callable, Dict
+import time
+import tree
+from returnn.tensor import Dim
+import returnn.frontend as rf
+from returnn.frontend.decoder.transformer import TransformerDecoder
+
+
+def benchmark(
+    *,
+    batch_size: int = 10,
+    beam_sizes=(12, 64),
+    num_steps: int = 50,
+    enc_len: int = 200,
+    num_layers: int = 6,
+    model_dim: int = 512,
+    vocab_size: int = 10_025,
+    device: str = "cpu",
+) -> Dict[int, Dict[str, float]]:
+    """
+    :return: beam size -> {"generic": secs per step, "kv_cache": secs per step, "max_abs_diff": ...}
+    """
+    import torch
+    from i6_experiments.users.zeyer.decoding import transformer_decoder_kv_cache
+    from .aed import get_label_scorer_pure_torch
+
+    rf.select_backend_torch()
+    rf.init_forward_step_run_ctx()
+    torch.manual_seed(42)
+
+    batch_dim = Dim(batch_size, name="batch")
+    enc_dim = Dim(model_dim, name="enc")
+    enc_spatial_dim = Dim(
+        rf.convert_to_tensor(
+            torch.randint(enc_len // 2, enc_len + 1, (batch_size,), dtype=torch.int32), dims=[batch_dim]
+        ),
+        name="enc_spatial",
+    )
+    vocab_dim = Dim(vocab_size, name="vocab")
+    with rf.set_default_device_ctx(device):
+        decoder = TransformerDecoder(
+            encoder_dim=enc_dim, vocab_dim=vocab_dim, model_dim=Dim(model_dim, name="model"), num_layers=num_layers
+        )
+        for param in decoder.parameters():
+            param.raw_tensor.data.normal_(0.0, 0.05)
+        enc_out = rf.random_normal([batch_dim, enc_spatial_dim, enc_dim])
+        enc = decoder.transform_encoder(enc_out, axis=enc_spatial_dim)
+
+    class _Model:
+        pass
+
+    model = _Model()
+    model.decoder = decoder
+    model.target_dim = vocab_dim
+    assert transformer_decoder_kv_cache.is_supported(decoder)
+
+    return _run_label_scorers(
+        {
+            "generic": lambda: get_label_scorer_pure_torch(model=model, batch_dim=batch_dim, enc=enc),
+            "kv_cache": lambda: transformer_decoder_kv_cache.make_label_scorer(decoder, batch_dim=batch_dim, enc=enc),
+        },
+        batch_size=batch_size,
+        beam_sizes=beam_sizes,
+        num_steps=num_steps,
+        vocab_size=vocab_size,
+        device=device,
+    )
+
+
+def benchmark_lm(
+    *,
+    batch_size: int = 10,
+    beam_sizes=(12, 64),
+    num_steps: int = 50,
+    num_layers: int = 12,
+    model_dim: int = 512,
+    vocab_size: int = 10_025,
+    device: str = "cpu",
+) -> Dict[int, Dict[str, float]]:
+    """
+    :return: beam size -> {"generic": secs per step, "kv_cache": ..., "generic_dedup": ..., "kv_cache_dedup": ...,
+        "max_abs_diff": ...}
+    """
+    import torch
+    from i6_experiments.users.zeyer.decoding import transformer_decoder_kv_cache
+    from i6_experiments.users.zeyer.decoding.prefix_dedup_label_scorer import make_prefix_dedup_label_scorer
+    from .trafo_lm import make_label_scorer_torch
+
+    rf.select_backend_torch()
+    rf.init_forward_step_run_ctx()
+    torch.manual_seed(42)
+
+    vocab_dim = Dim(vocab_size, name="vocab")
+    with rf.set_default_device_ctx(device):
+        lm = TransformerDecoder(
+            encoder_dim=None, vocab_dim=vocab_dim, model_dim=Dim(model_dim, name="model"), num_layers=num_layers
+        )
+        for param in lm.parameters():
+            param.raw_tensor.data.normal_(0.0, 0.05)
+    assert transformer_decoder_kv_cache.is_supported(lm)
+
+    return _run_label_scorers(
+        {
+            "generic": lambda: make_label_scorer_torch(lm),
+            "kv_cache": lambda: make_label_scorer_torch(lm, kv_cache=True),
+            "generic_dedup": lambda: make_prefix_dedup_label_scorer(make_label_scorer_torch(lm)),
+            "kv_cache_dedup": lambda: make_prefix_dedup_label_scorer(make_label_scorer_torch(lm, kv_cache=True)),
+        },
+        batch_size=batch_size,
+        beam_sizes=beam_sizes,
+        num_steps=num_steps,
+        vocab_size=vocab_size,
+        device=device,
+    )
+
+
+def _run_label_scorers(
+    label_scorers: Dict[str, Callable[[], Any]],
+    *,
+    batch_size: int,
+    beam_sizes,
+    num_steps: int,
+    vocab_size: int,
+    device: str,
+) -> Dict[int, Dict[str, float]]:
+    """
+    Runs all label scorers on the same random labels and backrefs, and compares them against the first one.
+
+    :param label_scorers: name -> func to create the label scorer. the first one is the reference
+    :return: beam size -> {name: secs per step, "max_abs_diff": max over all label scorers}
+    """
+    import torch
+
+    ref_name = next(iter(label_scorers))
+    res = {}
+    for beam_size in beam_sizes:
+        labels = torch.randint(0, vocab_size, (num_steps, batch_size, beam_size), device=device)
+        backrefs = torch.randint(0, beam_size, (num_steps, batch_size, beam_size), device=device)
+        backrefs[1] = torch.zeros_like(backrefs[1])  # prev beam is 1 in the first step
+
+        outputs = {}
+        timings = {}
+        for name, make_label_scorer in label_scorers.items():
+            label_scorer = make_label_scorer()
+            with torch.no_grad():
+                state = label_scorer.get_initial_state(batch_size=batch_size, device=torch.device(device))
+                log_probs = []
+                step_times = []
+                for step in range(num_steps):
+                    prev_label = labels[step, :, :1] if step == 0 else labels[step]
+                    if step > 0:
+                        state = _gather_state(state, backrefs[step])
+                    start = time.perf_counter()
+                    step_log_probs, state = label_scorer.score_and_update_state(prev_state=state, prev_label=prev_label)
+                    if step_log_probs.device.type == "cuda":
+                        torch.cuda.synchronize(step_log_probs.device)
+                    step_times.append(time.perf_counter() - start)
+                    log_probs.append(step_log_probs)
+            outputs[name] = log_probs
+            timings[name] = sum(step_times[1:]) / (num_steps - 1)  # first step has beam 1
+        max_abs_diff = max(
+            float((a - b).abs().max()) for name in outputs for a, b in zip(outputs[ref_name], outputs[name])
+        )
+        res[beam_size] = {**timings, "max_abs_diff": max_abs_diff}
+        print(
+            f"beam {beam_size}: "
+            + ", ".join(
+                f"{name} {timings[name] * 1000:.2f} ms/step ({timings[ref_name] / timings[name]:.2f}x)"
+                for name in label_scorers
+            )
+            + f", max abs diff {max_abs_diff:.2e}"
+        )
+        assert max_abs_diff < 1e-3, f"beam {beam_size}: log probs mismatch, max abs diff {max_abs_diff}"
+    return res
+
+
+def _gather_state(state: Any, backrefs):
+    """like the beam search does it: gather all [batch,beam,...] tensors by backrefs [batch,beam] -> prev beam"""
+    import torch
+    from i6_experiments.users.zeyer.decoding.beam_search_torch.interface import StateObjTensorExt, StateObjIgnored
+
+    def _gather(v):
+        if isinstance(v, StateObjTensorExt):
+            idx = backrefs.reshape(backrefs.shape + (1,) * (v.tensor.ndim - 2)).expand(
+                backrefs.shape + v.tensor.shape[2:]
+            )
+            return StateObjTensorExt(torch.gather(v.tensor, 1, idx), v.extra)
+        elif isinstance(v, StateObjIgnored):
+            return v
+        raise TypeError(f"unexpected state {v} ({type(v).__name__})")
+
+    return tree.map_structure(_gather, state)
+
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark_lm()
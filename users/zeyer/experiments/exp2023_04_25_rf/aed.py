@@ -1096,8 +1096,10 @@ def model_recog_pure_torch(
             )
         )
     else:
+        kv_cache = config.bool("beam_search_kv_cache", False)
+        assert not kv_cache or isinstance(beam_search_version, int), "beam_search_kv_cache needs [batch,beam] states"
         label_scorer.label_scorers["decoder"] = (
-            get_label_scorer_pure_torch(model=model, batch_dim=batch_dim, enc=enc),
+            get_label_scorer_pure_torch(model=model, batch_dim=batch_dim, enc=enc, kv_cache=kv_cache),
             1.0,
         )
     if isinstance(beam_search_version, str) or beam_search_version >= 5:
@@ -1169,15 +1171,27 @@ def get_label_scorer_pure_torch(
     model: Model,
     batch_dim: Dim,
     enc: rf.State,
+    kv_cache: bool = False,
 ):
+    """
+    :param model:
+    :param batch_dim:
+    :param enc:
+    :param kv_cache: if possible, use the fast path with preallocated self-att KV cache,
+        see :mod:`i6_experiments.users.zeyer.decoding.transformer_decoder_kv_cache`
+    """
     import torch
     import functools
+    from i6_experiments.users.zeyer.decoding import transformer_decoder_kv_cache
     from i6_experiments.users.zeyer.decoding.beam_search_torch.interface import (
         LabelScorerIntf,
         StateObjTensorExt,
         StateObjIgnored,
     )
 
+    if kv_cache and transformer_decoder_kv_cache.is_supported(model.decoder):
+        return transformer_decoder_kv_cache.make_label_scorer(model.decoder, batch_dim=batch_dim, enc=enc)
+
     class LabelScorer(LabelScorerIntf):
         """label scorer"""
 
@@ -1357,7 +1357,17 @@ def model_recog_pure_torch(
             label_scorer.label_scorers["length_reward"] = (LengthRewardScorer(), len_reward)
     if model.language_model:
         lm_scale = beam_search_opts.pop("lm_scale")  # must be defined with LM
-        label_scorer.label_scorers["lm"] = (model.language_model_make_label_scorer(), lm_scale)
+        if config.bool("beam_search_lm_kv_cache", False):
+            assert isinstance(beam_search_version, int), "beam_search_lm_kv_cache needs [batch,beam] states"
+            lm_label_scorer = model.language_model_make_label_scorer(kv_cache=True)
+        else:
+            lm_label_scorer = model.language_model_make_label_scorer()
+        if config.bool("beam_search_lm_prefix_dedup", False):
+            from i6_experiments.users.zeyer.decoding.prefix_dedup_label_scorer import make_prefix_dedup_label_scorer
+
+            assert isinstance(beam_search_version, int), "beam_search_lm_prefix_dedup needs [batch,beam] states"
+            lm_label_scorer = make_prefix_dedup_label_scorer(lm_label_scorer)
+        label_scorer.label_scorers["lm"] = (lm_label_scorer, lm_scale)
 
     print("** max seq len:", max_seq_len.raw_tensor)
 
@@ -69,19 +69,29 @@ class MakeModel:
 
 def make_label_scorer_torch(
     model: TransformerDecoder,
+    *,
+    kv_cache: bool = False,
 ) -> TorchLabelScorerIntf:
     """
     Make label scorer
+
+    :param model:
+    :param kv_cache: if possible, use the fast path with preallocated self-att KV cache,
+        see :mod:`i6_experiments.users.zeyer.decoding.transformer_decoder_kv_cache`
     """
     import torch
     import tree
     import functools
+    from i6_experiments.users.zeyer.decoding import transformer_decoder_kv_cache
     from i6_experiments.users.zeyer.decoding.beam_search_torch.interface import (
         LabelScorerIntf,
         StateObjTensorExt,
         StateObjIgnored,
     )
 
+    if kv_cache and transformer_decoder_kv_cache.is_supported(model):
+        return transformer_decoder_kv_cache.make_label_scorer(model)
+
     class LabelScorer(LabelScorerIntf):
         """TransformerDecoder label scorer"""
 
@@ -26,6 +26,7 @@ from i6_experiments.users.zeyer.datasets.score_results import RecogOutput, Score
 from i6_experiments.users.zeyer.model_interfaces import ModelDef, ModelDefWithCfg, RecogDef, serialize_model_def
 from i6_experiments.users.zeyer.model_with_checkpoints import ModelWithCheckpoint, ModelWithCheckpoints
 from i6_experiments.users.zeyer.returnn.training import get_relevant_epochs_from_training_learning_rate_scores
+from i6_experiments.users.zeyer.returnn.search import SearchNBestStoreToPyJob, SearchNBestStoreRemoveLabelJob
 
 if TYPE_CHECKING:
     from returnn.tensor import TensorDict
@@ -144,6 +145,7 @@ def recog_model(
     if dev_sets is not None:
         assert all(k in task.eval_datasets for k in dev_sets)
     outputs = {}
+    recog_outputs = {}
     for dataset_name, dataset in task.eval_datasets.items():
         if dev_sets is not None:
             if dataset_name not in dev_sets:
@@ -159,8 +161,13 @@ def recog_model(
             search_alias_name=f"{name}/search/{dataset_name}" if name else None,
             recog_post_proc_funcs=task.recog_post_proc_funcs,
         )
+        if task.score_recog_outputs_func:
+            recog_outputs[dataset_name] = (dataset, recog_out)
+            continue
         score_out = task.score_recog_output_func(dataset, recog_out)
         outputs[dataset_name] = score_out
+    if task.score_recog_outputs_func:
+        outputs = task.score_recog_outputs_func(recog_outputs)
     return task.collect_score_results_func(outputs)
 
 
@@ -178,12 +185,17 @@ def search_dataset(
 ) -> RecogOutput:
     """
     recog on the specific dataset
+
+    With ``config["__recog_nbest_store"]``, the search writes an n-best store (see :mod:`returnn.nbest_store`),
+    which is kept for the label removal and the post-processing funcs which support it
+    (``RecogOutput.nbest_store``), and is only converted to the Python format at the end.
     """
     env_updates = None
     if (config and config.get("__env_updates")) or (search_post_config and search_post_config.get("__env_updates")):
         env_updates = (config and config.pop("__env_updates", None)) or (
             search_post_config and search_post_config.pop("__env_updates", None)
         )
+    nbest_store = False
     if getattr(model.definition, "backend", None) is None:
         search_job = ReturnnSearchJobV2(
             search_data=dataset.get_main_dataset(),
@@ -199,9 +211,13 @@ def search_dataset(
         )
         res = search_job.out_search_file
     else:
-        out_files = [_v2_forward_out_filename]
-        if config and config.get("__recog_def_ext", False):
-            out_files.append(_v2_forward_ext_out_filename)
+        nbest_store = bool(config and config.get("__recog_nbest_store", False))
+        if nbest_store:
+            out_files = [_v2_forward_nbest_store_filename]
+        else:
+            out_files = [_v2_forward_out_filename]
+            if config and config.get("__recog_def_ext", False):
+                out_files.append(_v2_forward_ext_out_filename)
         search_job = ReturnnForwardJobV2(
             model_checkpoint=model.checkpoint,
             returnn_config=search_config_v2(
@@ -212,7 +228,10 @@ def search_dataset(
             returnn_root=tools_paths.get_returnn_root(),
             mem_rqmt=search_mem_rqmt,
         )
-        res = search_job.out_files[_v2_forward_out_filename]
+        if nbest_store:
+            res = search_job.out_files[_v2_forward_nbest_store_filename]
+        else:
+            res = search_job.out_files[_v2_forward_out_filename]
     if search_rqmt:
         search_job.rqmt.update(search_rqmt)
     if env_updates:
@@ -221,9 +240,19 @@ def search_dataset(
     if search_alias_name:
         search_job.add_alias(search_alias_name)
     if recog_def.output_blank_label:
-        res = SearchRemoveLabelJob(res, remove_label=recog_def.output_blank_label, output_gzip=True).out_search_results
+        if nbest_store:
+            res = SearchNBestStoreRemoveLabelJob(res, remove_label=recog_def.output_blank_label).out_nbest_store
+        else:
+            res = SearchRemoveLabelJob(
+                res, remove_label=recog_def.output_blank_label, output_gzip=True
+            ).out_search_results
     for f in recog_post_proc_funcs:  # for example BPE to words
-        res = f(RecogOutput(output=res)).output
+        recog_out = f(RecogOutput(output=res, nbest_store=nbest_store))
+        res, nbest_store = recog_out.output, recog_out.nbest_store
+    if nbest_store:
+        # Convert only at the end. The Python format is expected by the scoring.
+        res = SearchNBestStoreToPyJob(res, output_gzip=True, take_best=recog_def.output_with_beam).out_search_results
+        return RecogOutput(output=res)
     if recog_def.output_with_beam:
         # Don't join scores here (SearchBeamJoinScoresJob).
         #   It's not clear whether this is helpful in general.
@@ -533,6 +562,8 @@ def _returnn_v2_forward_step(*, model, extern_data: TensorDict, **_kwargs_unused
 
 _v2_forward_out_filename = "output.py.gz"
 _v2_forward_ext_out_filename = "output_ext.py.gz"
+# Alternative to the above, if __recog_nbest_store is set. See nbest_store.py.
+_v2_forward_nbest_store_filename = "output.nbest"
 
 
 def _returnn_v2_get_forward_callback():
@@ -543,15 +574,20 @@ def _returnn_v2_get_forward_callback():
 
     config = get_global_config()
     recog_def_ext = config.bool("__recog_def_ext", False)
+    recog_nbest_store = config.bool("__recog_nbest_store", False)
 
     class _ReturnnRecogV2ForwardCallbackIface(ForwardCallbackIface):
         def __init__(self):
             self.out_file: Optional[TextIO] = None
             self.out_ext_file: Optional[TextIO] = None
+            self.out_nbest_store = None  # NBestStoreWriter, created with the first seq, when we know the vocab
 
         def init(self, *, model):
             import gzip
 
+            if recog_nbest_store:
+                return
+
             self.out_file = gzip.open(_v2_forward_out_filename, "wt")
             self.out_file.write("{\n")
 
@@ -570,6 +606,11 @@ def _returnn_v2_get_forward_callback():
             if hyps_len.raw_tensor.shape:
                 assert scores.raw_tensor.shape == hyps_len.raw_tensor.shape  # (beam,)
             num_beam = hyps.raw_tensor.shape[0]
+
+            if recog_nbest_store:
+                self._write_nbest_store_seq(seq_tag=seq_tag, outputs=outputs)
+                return
+
             # Consistent to old search task, list[(float,str)].
             self.out_file.write(f"{seq_tag!r}: [\n")
             for i in range(num_beam):
@@ -590,7 +631,42 @@ def _returnn_v2_get_forward_callback():
                     self.out_ext_file.write(f"  {d!r},\n")
                 self.out_ext_file.write("],\n")
 
+        def _write_nbest_store_seq(self, *, seq_tag: str, outputs: TensorDict):
+            from i6_experiments.users.zeyer.returnn.nbest_store import NBestStoreWriter
+
+            hyps: Tensor = outputs["hyps"]  # [beam, out_spatial]
+            hyps_len = hyps.dims[1].dyn_size_ext  # [beam] or []
+            num_beam = hyps.raw_tensor.shape[0]
+            hyps_ids = [
+                hyps.raw_tensor[i, : hyps_len.raw_tensor[i] if hyps_len.raw_tensor.shape else hyps_len.raw_tensor]
+                for i in range(num_beam)
+            ]
+            if self.out_nbest_store is None:
+                vocab = hyps.sparse_dim.vocab
+                self.out_nbest_store = NBestStoreWriter(_v2_forward_nbest_store_filename, labels=vocab.labels)
+                # The store reconstructs the text by joining the labels, check that this is consistent.
+                for hyp_ids in hyps_ids:
+                    assert vocab.get_seq_labels(hyp_ids) == self.out_nbest_store.label_sep.join(
+                        vocab.labels[i] for i in hyp_ids
+                    ), f"vocab {vocab} get_seq_labels not supported by the n-best store"
+            scores = {"score": outputs["scores"].raw_tensor}  # [beam]
+            if recog_def_ext:
+                for k, v in outputs.data.items():
+                    if k in {"hyps", "scores"}:
+                        continue
+                    assert v.raw_tensor.shape == (num_beam,), f"n-best store only supports scalars per hyp, got {v}"
+                    scores[k] = v.raw_tensor
+            self.out_nbest_store.add_seq(seq_tag, hyps=hyps_ids, scores=scores)
+
         def finish(self):
+            if recog_nbest_store:
+                if self.out_nbest_store is None:  # no seqs
+                    from i6_experiments.users.zeyer.returnn.nbest_store import NBestStoreWriter
+
+                    self.out_nbest_store = NBestStoreWriter(_v2_forward_nbest_store_filename, labels=[])
+                self.out_nbest_store.close()
+                return
+
             self.out_file.write("}\n")
             self.out_file.close()
             if self.out_ext_file:
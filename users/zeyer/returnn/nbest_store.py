@@ -0,0 +1,319 @@
+"""
+Compact binary n-best store for recognition outputs.
+
+Alternative to the ``output.py.gz`` / ``output_ext.py.gz`` files (Python literals, read via ``eval``),
+which become very large and slow to parse for big beams with per-hypothesis score breakdowns.
+
+The file is written incrementally, seq by seq, and can be read via memory mapping,
+i.e. without loading the whole file into memory.
+
+Layout (all little endian)::
+
+    magic (8 bytes)
+    per seq, each part aligned to 8 bytes:
+        hyp lens: int32 [beam]
+        token ids: int32 [sum(hyp lens)]
+        scores: float64 [beam, num_score_keys]
+    index: utf8 JSON (seq tags, offsets, beam sizes, num tokens, score keys, labels)
+    footer: index offset uint64, index size uint64, magic (8 bytes)
+
+The first score key is always "score", the (main) score of the hyp as in ``output.py.gz``,
+the others are the per-hyp outputs of ``output_ext.py.gz``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Optional, Union, Any, Callable, Dict, List, Sequence, Tuple, Iterator, BinaryIO
+
+import numpy
+
+_Magic = b"NBEST\x00\x01\x00"
+_Alignment = 8
+_FooterStruct = numpy.dtype([("index_offset", "<u8"), ("index_size", "<u8")])
+
+
+class NBestStoreWriter:
+    """
+    Writes the n-best store incrementally. Use as context manager or call :func:`close` at the end.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        *,
+        labels: Sequence[str],
+        label_sep: str = " ",
+        score_keys: Optional[Sequence[str]] = None,
+    ):
+        """
+        :param filename:
+        :param labels: vocab labels, to convert the token ids back to text
+        :param label_sep: separator between labels when converting to text
+        :param score_keys: if not given, taken from the first seq (in the given order, "score" first).
+            the first key must be "score"
+        """
+        self.filename = filename
+        self.labels = list(labels)
+        self.label_sep = label_sep
+        self.score_keys = list(score_keys) if score_keys is not None else None
+        assert self.score_keys is None or self.score_keys[0] == "score"
+        self._file: Optional[BinaryIO] = open(filename, "wb")
+        self._file.write(_Magic)
+        self._pos = len(_Magic)
+        self._seq_tags: List[str] = []
+        self._offsets: List[int] = []
+        self._beam_sizes: List[int] = []
+        self._num_tokens: List[int] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_aligned(self, data: bytes):
+        self._file.write(data)
+        self._pos += len(data)
+        pad = -self._pos % _Alignment
+        if pad:
+            self._file.write(b"\x00" * pad)
+            self._pos += pad
+
+    def add_seq(self, seq_tag: str, *, hyps: Sequence[Sequence[int]], scores: Dict[str, Sequence[float]]):
+        """
+        :param seq_tag:
+        :param hyps: token ids per hyp, len beam
+        :param scores: score key -> values per hyp, each len beam. must contain "score"
+        """
+        if self.score_keys is None:
+            self.score_keys = ["score"] + [k for k in scores.keys() if k != "score"]
+        assert set(scores.keys()) == set(self.score_keys), f"score keys {list(scores.keys())} != {self.score_keys}"
+        num_beam = len(hyps)
+        hyp_lens = numpy.array([len(hyp) for hyp in hyps], dtype="<i4")
+        tokens = (
+            numpy.concatenate([numpy.asarray(hyp, dtype="<i4") for hyp in hyps])
+            if num_beam > 0
+            else numpy.zeros((0,), dtype="<i4")
+        )
+        score_mat = numpy.stack([numpy.asarray(scores[k], dtype="<f8") for k in self.score_keys], axis=1)
+        assert score_mat.shape == (num_beam, len(self.score_keys))
+
+        self._seq_tags.append(seq_tag)
+        self._offsets.append(self._pos)
+        self._beam_sizes.append(num_beam)
+        self._num_tokens.append(int(tokens.shape[0]))
+        self._write_aligned(hyp_lens.tobytes())
+        self._write_aligned(tokens.tobytes())
+        self._write_aligned(score_mat.tobytes())
+
+    def close(self):
+        """write index and footer"""
+        if not self._file:
+            return
+        index = {
+            "version": 1,
+            "labels": self.labels,
+            "label_sep": self.label_sep,
+            "score_keys": self.score_keys or ["score"],
+            "seq_tags": self._seq_tags,
+            "offsets": self._offsets,
+            "beam_sizes": self._beam_sizes,
+            "num_tokens": self._num_tokens,
+        }
+        index_raw = json.dumps(index).encode("utf8")
+        index_offset = self._pos
+        self._file.write(index_raw)
+        footer = numpy.array([(index_offset, len(index_raw))], dtype=_FooterStruct)
+        self._file.write(footer.tobytes())
+        self._file.write(_Magic)
+        self._file.close()
+        self._file = None
+
+
+class NBestEntry:
+    """
+    N-best list of one seq. The arrays are views into the memory mapped file.
+    """
+
+    def __init__(
+        self, *, reader: NBestStoreReader, hyp_lens: numpy.ndarray, tokens: numpy.ndarray, scores: numpy.ndarray
+    ):
+        self.reader = reader
+        self.hyp_lens = hyp_lens  # [beam]
+        self.tokens = tokens  # [sum(hyp_lens)], all hyps concatenated
+        self.scores = scores  # [beam, num_score_keys]
+        self._hyp_ends = numpy.cumsum(hyp_lens)
+
+    def __len__(self) -> int:
+        return self.hyp_lens.shape[0]
+
+    def get_hyp_tokens(self, hyp_idx: int) -> numpy.ndarray:
+        """token ids of hyp"""
+        end = int(self._hyp_ends[hyp_idx])
+        return self.tokens[end - int(self.hyp_lens[hyp_idx]) : end]
+
+    def get_hyp_text(self, hyp_idx: int) -> str:
+        """hyp as text, as in output.py.gz"""
+        return self.reader.tokens_to_text(self.get_hyp_tokens(hyp_idx))
+
+    def get_scores(self, key: str = "score") -> numpy.ndarray:
+        """[beam]"""
+        return self.scores[:, self.reader.score_keys.index(key)]
+
+    def as_score_text_list(self) -> List[Tuple[float, str]]:
+        """same as the entry in output.py.gz"""
+        scores = self.get_scores("score")
+        return [(float(scores[i]), self.get_hyp_text(i)) for i in range(len(self))]
+
+    def as_ext_list(self) -> List[Dict[str, float]]:
+        """same as the entry in output_ext.py.gz"""
+        keys = self.reader.score_keys[1:]
+        return [{k: float(v) for k, v in zip(keys, row[1:])} for row in self.scores.tolist()]
+
+
+class NBestStoreReader:
+    """
+    Reads the n-best store via memory mapping. Entries are only loaded when accessed.
+    """
+
+    def __init__(self, filename: Union[str, os.PathLike]):
+        self.filename = os.fspath(filename)
+        self._data = numpy.memmap(self.filename, dtype=numpy.uint8, mode="r")
+        assert bytes(self._data[: len(_Magic)]) == _Magic, f"{self.filename}: not an n-best store"
+        assert bytes(self._data[-len(_Magic) :]) == _Magic, f"{self.filename}: incomplete n-best store"
+        footer_start = len(self._data) - len(_Magic) - _FooterStruct.itemsize
+        footer = self._data[footer_start : footer_start + _FooterStruct.itemsize].view(_FooterStruct)[0]
+        index_offset, index_size = int(footer["index_offset"]), int(footer["index_size"])
+        index = json.loads(bytes(self._data[index_offset : index_offset + index_size]).decode("utf8"))
+        assert index["version"] == 1
+        self.labels: List[str] = index["labels"]
+        self.label_sep: str = index["label_sep"]
+        self.score_keys: List[str] = index["score_keys"]
+        self.seq_tags: List[str] = index["seq_tags"]
+        self._offsets: List[int] = index["offsets"]
+        self._beam_sizes: List[int] = index["beam_sizes"]
+        self._num_tokens: List[int] = index["num_tokens"]
+        self._seq_tag_to_idx = {seq_tag: i for i, seq_tag in enumerate(self.seq_tags)}
+
+    def __len__(self) -> int:
+        return len(self.seq_tags)
+
+    def __contains__(self, seq_tag: str) -> bool:
+        return seq_tag in self._seq_tag_to_idx
+
+    def __getitem__(self, seq_tag: str) -> NBestEntry:
+        return self.get_entry(self._seq_tag_to_idx[seq_tag])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.seq_tags)
+
+    def items(self) -> Iterator[Tuple[str, NBestEntry]]:
+        """seq tag, entry, in the order as written"""
+        for i, seq_tag in enumerate(self.seq_tags):
+            yield seq_tag, self.get_entry(i)
+
+    def get_entry(self, seq_idx: int) -> NBestEntry:
+        """by index, in the order as written"""
+        pos = self._offsets[seq_idx]
+        num_beam = self._beam_sizes[seq_idx]
+        num_tokens = self._num_tokens[seq_idx]
+        num_scores = len(self.score_keys)
+
+        def _take(num_bytes: int, dtype: str) -> numpy.ndarray:
+            nonlocal pos
+            arr = self._data[pos : pos + num_bytes].view(dtype)
+            pos += num_bytes + (-num_bytes % _Alignment)
+            return arr
+
+        hyp_lens = _take(num_beam * 4, "<i4")
+        tokens = _take(num_tokens * 4, "<i4")
+        scores = _take(num_beam * num_scores * 8, "<f8").reshape(num_beam, num_scores)
+        return NBestEntry(reader=self, hyp_lens=hyp_lens, tokens=tokens, scores=scores)
+
+    def tokens_to_text(self, tokens: Sequence[int]) -> str:
+        """token ids to text, like Vocabulary.get_seq_labels"""
+        return self.label_sep.join(self.labels[i] for i in tokens)
+
+
+def transform_nbest_store(
+    in_filename: Union[str, os.PathLike],
+    out_filename: str,
+    *,
+    remove_labels: Sequence[str] = (),
+    text_transform: Optional[Callable[[str], str]] = None,
+):
+    """
+    Streams an n-best store into a new one, seq by seq, keeping the order and all scores.
+
+    :param in_filename: n-best store
+    :param out_filename: n-best store
+    :param remove_labels: removes these labels from all hyps, like ``SearchRemoveLabelJob``
+    :param text_transform: applied on the text of every hyp (after removing the labels), e.g. BPE to words.
+        The resulting text is split by the label separator again,
+        so the labels of the new store are then e.g. the words, and the text of the new store is the transformed text.
+    """
+    reader = NBestStoreReader(in_filename)
+    remove_ids = numpy.array([i for i, label in enumerate(reader.labels) if label in set(remove_labels)], dtype="<i4")
+    new_labels: List[str] = []  # only with text_transform
+    new_label_to_idx: Dict[str, int] = {}
+
+    def _text_to_tokens(text: str) -> List[int]:
+        tokens = []
+        for label in text.split(reader.label_sep) if text else []:
+            if label not in new_label_to_idx:
+                new_label_to_idx[label] = len(new_labels)
+                new_labels.append(label)
+            tokens.append(new_label_to_idx[label])
+        return tokens
+
+    # The writer only writes the labels in close(), so we can extend them on the fly.
+    with NBestStoreWriter(
+        out_filename,
+        labels=reader.labels if text_transform is None else [],
+        label_sep=reader.label_sep,
+        score_keys=reader.score_keys,
+    ) as writer:
+        if text_transform is not None:
+            writer.labels = new_labels
+        for seq_tag, entry in reader.items():
+            hyp_idx = numpy.repeat(numpy.arange(len(entry)), entry.hyp_lens)  # [sum(hyp_lens)]
+            keep = ~numpy.isin(entry.tokens, remove_ids)
+            hyp_lens = numpy.bincount(hyp_idx[keep], minlength=len(entry))
+            hyps = numpy.split(entry.tokens[keep], numpy.cumsum(hyp_lens)[:-1]) if len(entry) > 0 else []
+            if text_transform is not None:
+                hyps = [_text_to_tokens(text_transform(reader.tokens_to_text(hyp))) for hyp in hyps]
+            writer.add_seq(
+                seq_tag, hyps=hyps, scores={key: entry.scores[:, i] for i, key in enumerate(reader.score_keys)}
+            )
+
+
+def is_nbest_store(filename: Union[str, os.PathLike]) -> bool:
+    """whether the file is an n-best store (otherwise e.g. a search output in Python format)"""
+    with open(filename, "rb") as f:
+        return f.read(len(_Magic)) == _Magic
+
+
+def iter_search_output(
+    filename: Union[str, os.PathLike], *, sorted_by_seq_tag: bool = False
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Iterates over a search output, either an n-best store (streamed via memory mapping),
+    or a RETURNN search output in Python format (which has to be read completely).
+
+    :param filename:
+    :param sorted_by_seq_tag: otherwise in the order as written
+    :return: seq tag, entry. for the n-best store, the entry is a list [(score, text), ...]
+    """
+    if is_nbest_store(filename):
+        reader = NBestStoreReader(filename)
+        for seq_tag in sorted(reader.seq_tags) if sorted_by_seq_tag else reader.seq_tags:
+            yield seq_tag, reader[seq_tag].as_score_text_list()
+        return
+
+    import i6_core.util as util
+
+    d = eval(util.uopen(filename, "rt").read(), {"nan": float("nan"), "inf": float("inf")})
+    assert isinstance(d, dict)
+    yield from sorted(d.items()) if sorted_by_seq_tag else d.items()
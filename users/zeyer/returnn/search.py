@@ -15,7 +15,8 @@ class SearchOutputRawReplaceJob(Job):
         self, search_py_output: Path, replacement_list: Sequence[Tuple[str, str]], *, output_gzip: bool = False
     ):
         """
-        :param search_py_output: a search output file from RETURNN in python format (single or n-best)
+        :param search_py_output: a search output file from RETURNN in python format (single or n-best),
+            or an n-best store (see :mod:`nbest_store`), which is streamed
         :param replacement_list: list/sequence of (old, new) pairs to perform ``s.replace(old,new)`` on the raw text
         :param output_gzip: if True, gzip the output
         """
@@ -27,8 +28,8 @@ class SearchOutputRawReplaceJob(Job):
         yield Task("run", mini_task=True)
 
     def run(self):
-        d = eval(util.uopen(self.search_py_output, "rt").read(), {"nan": float("nan"), "inf": float("inf")})
-        assert isinstance(d, dict)  # seq_tag -> bpe string
+        from .nbest_store import iter_search_output
+
         assert not os.path.exists(self.out_search_results.get_path())
 
         def _transform_text(s: str):
@@ -38,7 +39,8 @@ class SearchOutputRawReplaceJob(Job):
 
         with util.uopen(self.out_search_results, "wt") as out:
             out.write("{\n")
-            for seq_tag, entry in sorted(d.items()):
+            # seq_tag -> bpe string or n-best list
+            for seq_tag, entry in iter_search_output(self.search_py_output.get_path(), sorted_by_seq_tag=True):
                 if isinstance(entry, list):
                     # n-best list as [(score, text), ...]
                     out.write("%r: [\n" % (seq_tag,))
@@ -48,3 +50,117 @@ class SearchOutputRawReplaceJob(Job):
                 else:
                     out.write("%r: %r,\n" % (seq_tag, _transform_text(entry)))
             out.write("}\n")
+
+
+class SearchNBestStoreRemoveLabelJob(Job):
+    """
+    Like ``SearchRemoveLabelJob``, but from n-best store to n-best store (see :mod:`nbest_store`), streamed.
+    """
+
+    def __init__(self, nbest_store: Path, *, remove_label: str):
+        """
+        :param nbest_store:
+        :param remove_label: e.g. the blank label
+        """
+        self.nbest_store = nbest_store
+        self.remove_label = remove_label
+        self.out_nbest_store = self.output_path("output.nbest")
+
+    def tasks(self):
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        from .nbest_store import transform_nbest_store
+
+        transform_nbest_store(
+            self.nbest_store.get_path(), self.out_nbest_store.get_path(), remove_labels=[self.remove_label]
+        )
+
+
+class SearchNBestStoreRawReplaceJob(Job):
+    """
+    Like :class:`SearchOutputRawReplaceJob`, but from n-best store to n-best store (see :mod:`nbest_store`), streamed.
+    E.g. for BPE to words, where the labels of the resulting store are the words.
+    """
+
+    def __init__(self, nbest_store: Path, replacement_list: Sequence[Tuple[str, str]]):
+        """
+        :param nbest_store:
+        :param replacement_list: list/sequence of (old, new) pairs to perform ``s.replace(old,new)`` on the raw text
+        """
+        self.nbest_store = nbest_store
+        self.replacement_list = replacement_list
+        self.out_nbest_store = self.output_path("output.nbest")
+
+    def tasks(self):
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        from .nbest_store import transform_nbest_store
+
+        def _transform_text(s: str):
+            for in_, out_ in self.replacement_list:
+                s = s.replace(in_, out_)
+            return s
+
+        transform_nbest_store(
+            self.nbest_store.get_path(), self.out_nbest_store.get_path(), text_transform=_transform_text
+        )
+
+
+class SearchNBestStoreToPyJob(Job):
+    """
+    Converts an n-best store (see :mod:`nbest_store`) to the RETURNN search output Python format,
+    i.e. ``output.py.gz`` (and optionally ``output_ext.py.gz``) as written by our recog forward callback.
+    The store is streamed, i.e. this does not need to hold all entries in memory.
+    """
+
+    __sis_hash_exclude__ = {"take_best": False}
+
+    def __init__(
+        self, nbest_store: Path, *, output_gzip: bool = True, output_ext: bool = False, take_best: bool = False
+    ):
+        """
+        :param nbest_store: written by the recog forward callback with ``__recog_nbest_store``
+        :param output_gzip: if True, gzip the output
+        :param output_ext: if True, also write the other per-hyp scores (``out_ext_search_results``)
+        :param take_best: if True, only write the best hyp per seq, like ``SearchTakeBestJob``
+        """
+        self.nbest_store = nbest_store
+        self.output_ext = output_ext
+        self.take_best = take_best
+        assert not (output_ext and take_best)
+        self.out_search_results = self.output_path("search_results.py" + (".gz" if output_gzip else ""))
+        if output_ext:
+            self.out_ext_search_results = self.output_path("search_results_ext.py" + (".gz" if output_gzip else ""))
+
+    def tasks(self):
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        from .nbest_store import NBestStoreReader
+
+        reader = NBestStoreReader(self.nbest_store.get_path())
+
+        with util.uopen(self.out_search_results, "wt") as out:
+            out.write("{\n")
+            for seq_tag, entry in reader.items():
+                if self.take_best:
+                    _, best_text = max(entry.as_score_text_list())
+                    out.write(f"{seq_tag!r}: {best_text!r},\n")
+                    continue
+                out.write(f"{seq_tag!r}: [\n")
+                for score, text in entry.as_score_text_list():
+                    out.write(f"  ({score!r}, {text!r}),\n")
+                out.write("],\n")
+            out.write("}\n")
+
+        if self.output_ext:
+            with util.uopen(self.out_ext_search_results, "wt") as out:
+                out.write("{\n")
+                for seq_tag, entry in reader.items():
+                    out.write(f"{seq_tag!r}: [\n")
+                    for d in entry.as_ext_list():
+                        out.write(f"  {d!r},\n")
+                    out.write("],\n")
+                out.write("}\n")
@@ -0,0 +1,88 @@
+"""
+Sisyphus jobs for scale tuning on n-best lists, see :mod:`nbest_data` and :mod:`multi_start`.
+
+Usage::
+
+    nbest = ScaleTuningPrepareNBestJob([search_job.out_files["output.nbest"]]).out_nbest_data
+    tune_job = ScaleTuningJob(nbest)
+    scales = tune_job.out_scales  # dict, see multi_start._make_result
+
+The prepare job parses the n-best lists and computes the error counts once,
+so that multiple tuning jobs (e.g. with different settings) can share it.
+"""
+
+from __future__ import annotations
+from typing import Optional, Any, Dict, Sequence, Tuple, Union
+import json
+from sisyphus import Job, Task, tk
+
+
+class ScaleTuningPrepareNBestJob(Job):
+    """
+    Reads n-best lists with individual scores from our recog (``__recog_def_ext``)
+    and stores them together with the error counts of all hyps (:class:`NBestData`).
+    """
+
+    def __init__(self, sources: Sequence[Union[tk.Path, Tuple[tk.Path, tk.Path]]]):
+        """
+        :param sources: n-best stores (see :mod:`i6_experiments.users.zeyer.returnn.nbest_store`),
+            or tuples (search py output, search ext py output), i.e. ``output.py.gz`` and ``output_ext.py.gz``.
+            the first entry of each n-best list is assumed to be the ground truth
+        """
+        self.sources = sources
+        self.out_nbest_data = self.output_path("nbest_data.pt")
+
+    def tasks(self):
+        yield Task("run", rqmt={"cpu": 1, "mem": 8, "time": 1})
+
+    def run(self):
+        """run"""
+        from .nbest_data import NBestData
+
+        data = NBestData.from_sources(
+            [
+                tuple(p.get_path() for p in source) if isinstance(source, (tuple, list)) else source.get_path()
+                for source in self.sources
+            ]
+        )
+        print(data)
+        data.save(self.out_nbest_data.get_path())
+
+
+class ScaleTuningJob(Job):
+    """
+    Tunes the scales of the individual scores (and the length normalization) on the n-best lists,
+    with many starts in parallel and early stopping on held-out seqs, see :func:`multi_start.tune_scales`.
+    """
+
+    def __init__(self, nbest_data: tk.Path, *, opts: Optional[Dict[str, Any]] = None, device: str = "cpu"):
+        """
+        :param nbest_data: :class:`ScaleTuningPrepareNBestJob.out_nbest_data`
+        :param opts: kwargs for :func:`multi_start.tune_scales`
+        :param device: "cpu" or "gpu"
+        """
+        assert device in {"cpu", "gpu"}
+        self.nbest_data = nbest_data
+        self.opts = opts
+        self.device = device
+
+        self.out_scales_json = self.output_path("scales.json")
+        self.out_scales = self.output_var("scales.txt")
+
+    def tasks(self):
+        yield Task("run", rqmt={"cpu": 2, "mem": 8, "time": 4, "gpu": 1 if self.device == "gpu" else 0})
+
+    def run(self):
+        """run"""
+        import torch
+        from .nbest_data import NBestData
+        from .multi_start import tune_scales
+
+        print("PyTorch:", torch.__version__)
+        data = NBestData.load(self.nbest_data.get_path())
+        print(data)
+        res = tune_scales(data, device="cuda" if self.device == "gpu" else "cpu", **(self.opts or {}))
+        with open(self.out_scales_json.get_path(), "w") as f:
+            json.dump(res, f, indent=2)
+            f.write("\n")
+        self.out_scales.set(res)
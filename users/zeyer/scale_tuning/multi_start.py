@@ -0,0 +1,273 @@
+"""
+Batched scale tuning on n-best lists (:class:`NBestData`).
+
+Same model as in ``tuner_torch.py``: the hyp score is ``sum_s scale_s * sign_s * score_s``,
+length normalized by ``(num_tokens + 1) ** -len_norm``, and we minimize the expected (normalized) number of
+word errors under the softmax over the n-best list.
+
+Instead of a single trajectory from a single initial point, we evaluate a coarse grid and many random starts
+at once, as one batched tensor op over all candidates (``[cands,seqs,beam]``),
+and train all starts in parallel (the loss is a sum over independent starts, so this is the same as training
+them one after another). Held-out seqs are used for early stopping and for selecting the final start.
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, Optional, Any, Dict, List, Sequence
+import sys
+import itertools
+
+if TYPE_CHECKING:
+    import torch
+    from .nbest_data import NBestData
+
+
+def tune_scales(
+    data: NBestData,
+    *,
+    num_random_starts: int = 32,
+    grid_values: Sequence[float] = (0.0, 0.25, 0.5, 1.0, 2.0),
+    grid_len_norm_values: Sequence[float] = (0.0, 0.5, 1.0),
+    num_grid_starts: int = 8,
+    init_scales: Optional[Sequence[float]] = None,
+    init_len_norm: float = 1.0,
+    train_len_norm: bool = True,
+    fix_scale0: bool = True,
+    softmax_temperature: float = 10.0,
+    opt: str = "Adam",
+    lr: float = 0.01,
+    num_steps: int = 10_000,
+    held_out_fraction: float = 0.1,
+    eval_interval: int = 100,
+    patience: int = 10,
+    max_cands_per_batch: int = 256,
+    random_seed: int = 42,
+    device: str = "cpu",
+    log_stream: Optional[Any] = sys.stdout,
+) -> Dict[str, Any]:
+    """
+    :param data: n-best lists
+    :param num_random_starts: random initial points, scales uniform in [0, max(grid_values)]
+    :param grid_values: coarse grid values for each scale (except scale0 if fix_scale0)
+    :param grid_len_norm_values: grid values for the len norm exponent, if train_len_norm
+    :param num_grid_starts: the best grid points (on the train seqs) are used as additional starts
+    :param init_scales: always used as start. default is all 1
+    :param init_len_norm:
+    :param train_len_norm:
+    :param fix_scale0: normalize such that the first scale is 1
+    :param softmax_temperature:
+    :param opt: optimizer name in torch.optim
+    :param lr:
+    :param num_steps: max num steps
+    :param held_out_fraction: fraction of seqs (randomly selected) used for early stopping and start selection.
+        if 0, the train seqs are used instead
+    :param eval_interval: in steps
+    :param patience: stop after this many evals without improvement on held-out seqs for any start
+    :param max_cands_per_batch: for the grid eval, limits memory (cands*seqs*beam)
+    :param random_seed:
+    :param device:
+    :param log_stream:
+    :return: JSON-serializable dict with the result, see :func:`_make_result`
+    """
+    import torch
+
+    def _log(*args):
+        if log_stream:
+            print(*args, file=log_stream)
+
+    generator = torch.Generator().manual_seed(random_seed)
+    num_seqs = len(data)
+    num_held_out = int(round(held_out_fraction * num_seqs))
+    perm = torch.randperm(num_seqs, generator=generator)
+    train_data = data.select_seqs(perm[num_held_out:]).to(device)
+    held_out_data = data.select_seqs(perm[:num_held_out]).to(device) if num_held_out > 0 else train_data
+    _log(f"Num seqs: train {len(train_data)}, held-out {num_held_out}, score keys {data.keys}")
+    num_scales = len(data.keys)
+    key_signs = torch.tensor(data.key_signs, device=device)  # [scales]
+
+    # Grid over all scales (scale0 fixed to 1 if fix_scale0) and len norm values.
+    scales_axes = [[1.0] if (fix_scale0 and i == 0) else list(grid_values) for i in range(num_scales)]
+    len_norm_axis = list(grid_len_norm_values) if train_len_norm else [init_len_norm]
+    grid = torch.tensor(
+        [list(p) for p in itertools.product(*scales_axes, len_norm_axis)], device=device
+    )  # [grid,scales+1]
+    grid_err = _eval_err_batched(
+        train_data, key_signs, grid[:, :num_scales], grid[:, num_scales], max_cands_per_batch=max_cands_per_batch
+    )  # [grid]
+    grid_best = torch.argsort(grid_err, stable=True)[:num_grid_starts]
+    _log(
+        f"Grid: {grid.shape[0]} points, best train err {grid_err[grid_best[0]]:.4f}"
+        f" at {_cand_str(grid[grid_best[0], :num_scales], grid[grid_best[0], num_scales])}"
+    )
+
+    init_scales = list(init_scales) if init_scales is not None else [1.0] * num_scales
+    assert len(init_scales) == num_scales
+    random_scales = torch.rand((num_random_starts, num_scales), generator=generator) * max(grid_values)
+    random_len_norm = (
+        torch.rand((num_random_starts,), generator=generator) * max(grid_len_norm_values)
+        if train_len_norm
+        else torch.full((num_random_starts,), init_len_norm)
+    )
+    starts = torch.cat(
+        [
+            torch.tensor([init_scales + [init_len_norm]], device=device),
+            grid[grid_best],
+            torch.cat([random_scales, random_len_norm[:, None]], dim=1).to(device),
+        ]
+    )  # [starts,scales+1]
+    num_starts = starts.shape[0]
+    _log(f"Num starts: {num_starts} (init 1, grid {len(grid_best)}, random {num_random_starts})")
+
+    scales = torch.nn.Parameter(starts[:, :num_scales].clone())  # [starts,scales]
+    len_norm_scale = torch.nn.Parameter(starts[:, num_scales].clone())  # [starts]
+    params = [scales, len_norm_scale] if train_len_norm else [scales]
+
+    def _scales_fix():
+        scales.data = torch.nn.functional.relu(scales)  # keep positive
+        len_norm_scale.data = torch.nn.functional.relu(len_norm_scale)
+        if fix_scale0:
+            scales.data *= 1.0 / torch.maximum(scales[:, :1], torch.tensor(0.01, device=device))
+
+    def _loss():
+        logits = _logits(train_data, key_signs, scales, len_norm_scale) * softmax_temperature  # [starts,seqs,beam]
+        probs = torch.nn.functional.softmax(logits, dim=-1)  # [starts,seqs,beam]
+        # sum over starts: the starts are independent
+        return torch.einsum("ksb,sb->", probs, train_data.num_err) / train_data.num_ref_words.sum()
+
+    _scales_fix()
+    with torch.no_grad():
+        init_held_out_err = _eval_err(held_out_data, key_signs, scales, len_norm_scale)  # [starts]
+    best_held_out_err = init_held_out_err.clone()
+    best_scales = scales.detach().clone()
+    best_len_norm = len_norm_scale.detach().clone()
+    _log(f"Initial held-out err: {init_held_out_err[0]:.4f}, best start: {init_held_out_err.min():.4f}")
+
+    opt_ = getattr(torch.optim, opt)(params, lr=lr)
+    num_evals_without_improvement = 0
+    step = 0
+    for step in range(1, num_steps + 1):
+        opt_.zero_grad()
+        loss = _loss()
+        loss.backward()
+        opt_.step()
+        _scales_fix()
+
+        if step % eval_interval == 0 or step == num_steps:
+            with torch.no_grad():
+                held_out_err = _eval_err(held_out_data, key_signs, scales, len_norm_scale)  # [starts]
+                improved = held_out_err < best_held_out_err  # [starts]
+                best_held_out_err = torch.where(improved, held_out_err, best_held_out_err)
+                best_scales[improved] = scales[improved]
+                best_len_norm[improved] = len_norm_scale[improved]
+            _log(
+                f"step {step}, loss (sum over starts): {loss:.4f},"
+                f" held-out err best start: {held_out_err.min():.4f}, overall: {best_held_out_err.min():.4f},"
+                f" improved starts: {int(improved.sum())}"
+            )
+            num_evals_without_improvement = 0 if improved.any() else num_evals_without_improvement + 1
+            if num_evals_without_improvement >= patience:
+                _log(f"Early stopping after step {step}.")
+                break
+
+    with torch.no_grad():
+        train_err = _eval_err(train_data, key_signs, best_scales, best_len_norm)  # [starts]
+        # select by held-out err, ties by train err
+        cands = (best_held_out_err == best_held_out_err.min()).nonzero()[:, 0]
+        best = int(cands[torch.argmin(train_err[cands])])
+        if not fix_scale0:
+            # does not change the argmax, so it is just a more canonical form
+            best_scales[best] *= 1.0 / torch.maximum(best_scales[best, 0], torch.tensor(0.01, device=device))
+        _log(
+            f"Finished after {step} steps. Best start {best}: held-out err {best_held_out_err[best]:.4f},"
+            f" train err {train_err[best]:.4f}, {_cand_str(best_scales[best], best_len_norm[best])}"
+        )
+        return _make_result(
+            keys=data.keys,
+            scales=best_scales[best].tolist(),
+            len_norm_scale=float(best_len_norm[best]),
+            stats={
+                "train_err": float(train_err[best]),
+                "held_out_err": float(best_held_out_err[best]),
+                "init_held_out_err": float(init_held_out_err[0]),
+                "grid_best_train_err": float(grid_err[grid_best[0]]),
+                "best_start": best,
+                "num_starts": num_starts,
+                "num_steps": step,
+                "num_train_seqs": len(train_data),
+                "num_held_out_seqs": num_held_out,
+            },
+        )
+
+
+def _make_result(
+    *, keys: List[str], scales: List[float], len_norm_scale: float, stats: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    :return: dict with:
+        "scales": score key -> scale (the sign for "_neg_" keys is not included),
+        "length_normalization_exponent": len norm scale,
+        "stats": some statistics of the tuning
+    """
+    return {
+        "scales": dict(zip(keys, scales)),
+        "length_normalization_exponent": len_norm_scale,
+        "stats": stats,
+    }
+
+
+def _logits(
+    data: NBestData, key_signs: torch.Tensor, scales: torch.Tensor, len_norm_scale: torch.Tensor
+) -> torch.Tensor:
+    """
+    :param data:
+    :param key_signs: [scales]
+    :param scales: [cands,scales]
+    :param len_norm_scale: [cands]
+    :return: [cands,seqs,beam], padded hyps are -inf
+    """
+    import torch
+
+    len_norm = torch.reciprocal(data.hyp_num_tokens + 1)[None] ** len_norm_scale[:, None, None]  # [cands,seqs,beam]
+    logits = torch.einsum("ks,s,abs,kab->kab", scales, key_signs, data.scores, len_norm)
+    return logits.masked_fill(~data.hyp_mask[None], float("-inf"))
+
+
+def _eval_err(
+    data: NBestData, key_signs: torch.Tensor, scales: torch.Tensor, len_norm_scale: torch.Tensor
+) -> torch.Tensor:
+    """
+    :return: [cands], normalized num errors of the best hyps
+    """
+    import torch
+
+    best = _logits(data, key_signs, scales, len_norm_scale).argmax(dim=-1)  # [cands,seqs] -> beam
+    err = torch.gather(data.num_err[None].expand(best.shape[0], -1, -1), dim=2, index=best[:, :, None])[:, :, 0]
+    return err.sum(dim=1) / data.num_ref_words.sum()
+
+
+def _eval_err_batched(
+    data: NBestData,
+    key_signs: torch.Tensor,
+    scales: torch.Tensor,
+    len_norm_scale: torch.Tensor,
+    *,
+    max_cands_per_batch: int,
+) -> torch.Tensor:
+    import torch
+
+    return torch.cat(
+        [
+            _eval_err(
+                data,
+                key_signs,
+                scales[i : i + max_cands_per_batch],
+                len_norm_scale[i : i + max_cands_per_batch],
+            )
+            for i in range(0, scales.shape[0], max_cands_per_batch)
+        ]
+    )
+
+
+def _cand_str(scales: torch.Tensor, len_norm_scale: torch.Tensor) -> str:
+    res = "scales [%s]" % ", ".join(f"{s:.4f}" for s in scales.detach().cpu())
+    res += f", len_norm {float(len_norm_scale):.4f}"
+    return res
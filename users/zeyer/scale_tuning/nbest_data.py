@@ -0,0 +1,325 @@
+"""
+N-best data for scale tuning: per seq the n-best list with the individual scores of each hyp,
+the number of (word) errors of each hyp, and the number of hyp tokens.
+
+The error counts are computed once, in a batched edit distance pass, and can be cached
+(:func:`NBestData.save`, :func:`NBestData.load`), so that different tuning runs on the same n-best lists
+do not need to parse and score the recog outputs again.
+
+As in our recog with ``__recog_def_ext``, we assume that the first entry of each n-best list is the ground truth.
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, Optional, Union, Any, Dict, List, Sequence, Tuple, Iterator
+import os
+import sys
+import gzip
+
+if TYPE_CHECKING:
+    import torch
+
+# Either a dir from our recog (output.nbest, or output.py.gz and output_ext.py.gz),
+# an n-best store file, or a tuple (search py output, search ext py output).
+NBestSource = Union[str, os.PathLike, Tuple[Union[str, os.PathLike], Union[str, os.PathLike]]]
+
+
+class NBestData:
+    """
+    All n-best lists as padded tensors. Beams of different size are padded, see :attr:`hyp_mask`.
+    """
+
+    def __init__(
+        self,
+        *,
+        keys: List[str],
+        seq_tags: List[str],
+        scores: torch.Tensor,
+        hyp_num_tokens: torch.Tensor,
+        num_err: torch.Tensor,
+        num_ref_words: torch.Tensor,
+        hyp_mask: torch.Tensor,
+    ):
+        """
+        :param keys: score keys, len: scores
+        :param seq_tags: len: seqs
+        :param scores: [seqs,beam,scores]
+        :param hyp_num_tokens: [seqs,beam]
+        :param num_err: [seqs,beam], number of word errors (not normalized)
+        :param num_ref_words: [seqs]
+        :param hyp_mask: [seqs,beam], False for padded hyps
+        """
+        self.keys = keys
+        self.seq_tags = seq_tags
+        self.scores = scores
+        self.hyp_num_tokens = hyp_num_tokens
+        self.num_err = num_err
+        self.num_ref_words = num_ref_words
+        self.hyp_mask = hyp_mask
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(keys={self.keys}, scores={list(self.scores.shape)})"
+
+    def __len__(self) -> int:
+        return len(self.seq_tags)
+
+    @property
+    def key_signs(self) -> List[float]:
+        """score sign per key, keys with "_neg_" in the name are subtracted"""
+        return [1.0 if "_neg_" not in key else -1.0 for key in self.keys]
+
+    def select_seqs(self, indices: torch.Tensor) -> NBestData:
+        """
+        :param indices: [new_seqs] -> seqs
+        :return: subset of the seqs
+        """
+        return NBestData(
+            keys=self.keys,
+            seq_tags=[self.seq_tags[i] for i in indices.tolist()],
+            scores=self.scores[indices],
+            hyp_num_tokens=self.hyp_num_tokens[indices],
+            num_err=self.num_err[indices],
+            num_ref_words=self.num_ref_words[indices],
+            hyp_mask=self.hyp_mask[indices],
+        )
+
+    def to(self, device: Union[str, torch.device]) -> NBestData:
+        """move tensors to device"""
+        return NBestData(
+            keys=self.keys,
+            seq_tags=self.seq_tags,
+            scores=self.scores.to(device),
+            hyp_num_tokens=self.hyp_num_tokens.to(device),
+            num_err=self.num_err.to(device),
+            num_ref_words=self.num_ref_words.to(device),
+            hyp_mask=self.hyp_mask.to(device),
+        )
+
+    def save(self, filename: str):
+        """save, via torch.save"""
+        import torch
+
+        torch.save(
+            {
+                "version": 1,
+                "keys": self.keys,
+                "seq_tags": self.seq_tags,
+                "scores": self.scores.cpu(),
+                "hyp_num_tokens": self.hyp_num_tokens.cpu(),
+                "num_err": self.num_err.cpu(),
+                "num_ref_words": self.num_ref_words.cpu(),
+                "hyp_mask": self.hyp_mask.cpu(),
+            },
+            filename,
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> NBestData:
+        """load, from :func:`save`"""
+        import torch
+
+        d = torch.load(filename)
+        assert d.pop("version") == 1
+        return cls(**d)
+
+    @classmethod
+    def from_sources(cls, sources: Sequence[NBestSource], *, log_stream: Optional[Any] = sys.stdout) -> NBestData:
+        """
+        Reads the given n-best lists and computes the error counts (batched).
+
+        :param sources: see :class:`NBestSource`. seq tags must be unique over all sources
+        :param log_stream:
+        """
+        import torch
+
+        keys = None
+        seq_tags = []
+        hyps_texts = []  # per seq, list over beam
+        seqs_scores = []  # per seq, tensor [beam,scores]
+        for source in sources:
+            if log_stream:
+                print(f"* Reading entries from {source}...", file=log_stream)
+            for seq_tag, source_keys, hyp_texts, seq_scores in iter_nbest_lists(source):
+                if keys is None:
+                    keys = source_keys
+                    if log_stream:
+                        print("Score keys:", keys, file=log_stream)
+                if source_keys != keys:
+                    assert set(source_keys) == set(keys), f"{source}: score keys {source_keys} != {keys}"
+                    seq_scores = seq_scores[:, [source_keys.index(key) for key in keys]]
+                seq_tags.append(seq_tag)
+                hyps_texts.append(hyp_texts)
+                seqs_scores.append(seq_scores)
+        assert seq_tags, f"no seqs in {sources}"
+        assert len(set(seq_tags)) == len(seq_tags), "seq tags not unique over the given sources"
+
+        if log_stream:
+            print(f"* Computing error counts for {sum(len(h) for h in hyps_texts)} hyps...", file=log_stream)
+        ref_words, hyp_words = [], []
+        for hyp_texts in hyps_texts:
+            ref = _text_to_words(hyp_texts[0])
+            for hyp in hyp_texts:
+                ref_words.append(ref)
+                hyp_words.append(_text_to_words(hyp))
+        num_err_flat = batched_edit_distance(ref_words, hyp_words)
+
+        num_seqs = len(seq_tags)
+        max_beam = max(len(hyp_texts) for hyp_texts in hyps_texts)
+        scores = torch.zeros((num_seqs, max_beam, len(keys)))
+        hyp_num_tokens = torch.zeros((num_seqs, max_beam))
+        num_err = torch.zeros((num_seqs, max_beam))
+        hyp_mask = torch.zeros((num_seqs, max_beam), dtype=torch.bool)
+        num_ref_words = torch.zeros((num_seqs,))
+        pos = 0
+        for i, (hyp_texts, seq_scores) in enumerate(zip(hyps_texts, seqs_scores)):
+            beam = len(hyp_texts)
+            scores[i, :beam] = seq_scores
+            hyp_num_tokens[i, :beam] = torch.tensor([float(len(hyp.split())) for hyp in hyp_texts])
+            num_err[i, :beam] = num_err_flat[pos : pos + beam].float()
+            hyp_mask[i, :beam] = True
+            num_ref_words[i] = len(ref_words[pos])
+            pos += beam
+        assert pos == len(ref_words)
+        return cls(
+            keys=keys,
+            seq_tags=seq_tags,
+            scores=scores,
+            hyp_num_tokens=hyp_num_tokens,
+            num_err=num_err,
+            num_ref_words=num_ref_words,
+            hyp_mask=hyp_mask,
+        )
+
+
+def get_nbest_data(
+    sources: Sequence[NBestSource], *, cache_filename: Optional[str] = None, log_stream: Optional[Any] = sys.stdout
+) -> NBestData:
+    """
+    :param sources:
+    :param cache_filename: if given and it exists, load from there, otherwise store there
+    :param log_stream:
+    """
+    if cache_filename and os.path.exists(cache_filename):
+        if log_stream:
+            print(f"* Loading cached n-best data from {cache_filename}", file=log_stream)
+        return NBestData.load(cache_filename)
+    data = NBestData.from_sources(sources, log_stream=log_stream)
+    if cache_filename:
+        if log_stream:
+            print(f"* Storing n-best data in {cache_filename}", file=log_stream)
+        data.save(cache_filename)
+    return data
+
+
+def iter_nbest_lists(source: NBestSource) -> Iterator[Tuple[str, List[str], List[str], torch.Tensor]]:
+    """
+    :param source:
+    :return: per seq: seq tag, score keys, hyp texts (len beam), scores [beam,scores]
+    """
+    import torch
+
+    if isinstance(source, (tuple, list)):
+        py_fn, ext_fn = source
+    elif os.path.isdir(source) and not os.path.exists(os.path.join(source, "output.nbest")):
+        py_fn, ext_fn = os.path.join(source, "output.py.gz"), os.path.join(source, "output_ext.py.gz")
+    else:
+        reader = _get_nbest_store_reader_cls()(
+            os.path.join(source, "output.nbest") if os.path.isdir(source) else source
+        )
+        keys = reader.score_keys[1:]
+        for seq_tag, entry in reader.items():
+            hyp_texts = [entry.get_hyp_text(i) for i in range(len(entry))]
+            yield seq_tag, keys, hyp_texts, torch.from_numpy(entry.scores[:, 1:].astype("float32"))
+        return
+
+    hyps = _read_py(py_fn)
+    exts = _read_py(ext_fn)
+    assert isinstance(hyps, dict) and isinstance(exts, dict) and set(hyps) == set(exts)
+    for seq_tag, hyps_ in hyps.items():
+        exts_ = exts[seq_tag]
+        assert isinstance(hyps_, list) and isinstance(exts_, list) and len(hyps_) == len(exts_)
+        keys = list(exts_[0].keys())
+        yield seq_tag, keys, [hyp for _, hyp in hyps_], torch.tensor([[ext[key] for key in keys] for ext in exts_])
+
+
+def batched_edit_distance(refs: Sequence[Sequence[Any]], hyps: Sequence[Sequence[Any]], *, chunk_size: int = 4096):
+    """
+    Levenshtein distance for many (ref, hyp) pairs at once, same as ``torchaudio.functional.edit_distance``
+    per pair, but batched over the pairs.
+
+    The DP runs row by row over the ref positions, each row for all pairs and all hyp positions at once.
+    Within a row, the insertion dependency is resolved via a cumulative min.
+
+    :param refs: list of token seqs (any hashable tokens)
+    :param hyps: list of token seqs, same len as refs
+    :param chunk_size: max number of pairs per batch, to limit memory
+    :return: int64 tensor [len(refs)]
+    """
+    import torch
+
+    assert len(refs) == len(hyps)
+    vocab = {}
+    refs = [[vocab.setdefault(w, len(vocab)) for w in ref] for ref in refs]
+    hyps = [[vocab.setdefault(w, len(vocab)) for w in hyp] for hyp in hyps]
+    # Sort by length, such that chunks have similar lengths and padding is small.
+    order = sorted(range(len(refs)), key=lambda i: (len(refs[i]), len(hyps[i])))
+    res = torch.zeros((len(refs),), dtype=torch.int64)
+    for start in range(0, len(order), chunk_size):
+        idx = order[start : start + chunk_size]
+        res[idx] = _edit_distance_padded(
+            _pad([refs[i] for i in idx], pad_value=-1), _pad([hyps[i] for i in idx], pad_value=-2)
+        )
+    return res
+
+
+def _edit_distance_padded(refs: Tuple[torch.Tensor, torch.Tensor], hyps: Tuple[torch.Tensor, torch.Tensor]):
+    """
+    :param refs: (tokens [B,R], lens [B])
+    :param hyps: (tokens [B,H], lens [B])
+    :return: [B]
+    """
+    import torch
+
+    ref, ref_lens = refs
+    hyp, hyp_lens = hyps
+    num_hyp_pos = hyp.shape[1] + 1
+    positions = torch.arange(num_hyp_pos)[None, :]  # [1,H+1]
+    row = positions.expand(ref.shape[0], num_hyp_pos)  # [B,H+1], distances for ref prefix len 0
+    res = hyp_lens.clone()  # for ref len 0
+    for i in range(1, ref.shape[1] + 1):
+        sub = row[:, :-1] + (ref[:, i - 1 : i] != hyp).long()  # [B,H]
+        del_ = row[:, 1:] + 1  # [B,H]
+        cand = torch.cat([torch.full_like(row[:, :1], i), torch.minimum(sub, del_)], dim=1)  # [B,H+1]
+        # insertions: row[j] = min_{k<=j} cand[k] + (j - k)
+        row = torch.cummin(cand - positions, dim=1).values + positions
+        res = torch.where(ref_lens == i, row.gather(1, hyp_lens[:, None])[:, 0], res)
+    return res
+
+
+def _pad(seqs: List[List[int]], *, pad_value: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    import torch
+
+    lens = torch.tensor([len(s) for s in seqs], dtype=torch.int64)
+    out = torch.full((len(seqs), max(max(len(s) for s in seqs), 1)), pad_value, dtype=torch.int64)
+    for i, s in enumerate(seqs):
+        out[i, : len(s)] = torch.tensor(s, dtype=torch.int64)
+    return out, lens
+
+
+def _text_to_words(text: str) -> List[str]:
+    return text.replace("@@ ", "").split()
+
+
+def _read_py(filename: Union[str, os.PathLike]) -> Any:
+    filename = os.fspath(filename)
+    with (gzip.open(filename, "rt") if filename.endswith(".gz") else open(filename, "rt")) as f:
+        return eval(f.read(), {"nan": float("nan"), "inf": float("inf")})
+
+
+def _get_nbest_store_reader_cls():
+    try:
+        from i6_experiments.users.zeyer.returnn.nbest_store import NBestStoreReader
+    except ImportError:  # running as standalone script
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "returnn"))
+        from nbest_store import NBestStoreReader
+
+    return NBestStoreReader
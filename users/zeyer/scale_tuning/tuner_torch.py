@@ -2,11 +2,11 @@
 Auto scaling, based on recog output.
 """
 
+import os
 import sys
 import argparse
-import gzip
+import json
 import torch
-import torchaudio
 
 
 def main():
@@ -15,7 +15,9 @@ def main():
     arg_parser.add_argument(
         "recog_output_dir",
         nargs="+",
-        help="from our recog, expect output.py.gz and output_ext.py.gz. assume first entry is ground truth",
+        help="from our recog, expect output.py.gz and output_ext.py.gz, or output.nbest (n-best store),"
+        " or an n-best store file."
+        " assume first entry is ground truth",
     )
     arg_parser.add_argument("--device", default="cpu")
     arg_parser.add_argument("--num-steps", type=int, default=10_000)
@@ -29,71 +31,62 @@ def main():
     arg_parser.add_argument("--train-len-norm", type=int, default=True)
     arg_parser.add_argument("--fix-scale0", type=int, default=True)
     arg_parser.add_argument("--softmax-temperature", type=float, default=10)
+    arg_parser.add_argument("--cache-file", help="n-best data incl error counts. loaded if exists, otherwise stored")
+    arg_parser.add_argument("--multi-start", action="store_true", help="batched multi-start tuning, multi_start.py")
+    arg_parser.add_argument("--num-random-starts", type=int, default=32)
+    arg_parser.add_argument("--held-out-fraction", type=float, default=0.1)
+    arg_parser.add_argument("--output-json")
     args = arg_parser.parse_args()
     device = torch.device(args.device)
     torch.manual_seed(args.random_seed)
 
-    keys = []  # len: scores
-    entries_scores = []  # list of sequences over tensor shape [beam,scores]
-    entries_hyp_num_tokens = []  # list of sequences over tensor shape [beam]
-    entries_num_err = []  # list of sequences over tensor shape [beam]
-    total_num_ref_words = 0
-
-    hyps = {}
-    exts = {}
-    for fn in args.recog_output_dir:
-        print(f"* Reading entries from {fn}...")
-        with gzip.open(fn + "/output.py.gz", "rt") as f:
-            hyps_f = eval(f.read())
-        with gzip.open(fn + "/output_ext.py.gz", "rt") as f:
-            exts_f = eval(f.read())
-        assert isinstance(hyps_f, dict) and isinstance(exts_f, dict) and set(hyps_f) == set(exts_f)
-        assert not set(hyps_f.keys()).intersection(hyps.keys())
-        hyps.update(hyps_f)
-        exts.update(exts_f)
+    nbest_data_mod, multi_start_mod = _import_lib()
+    data = nbest_data_mod.get_nbest_data(args.recog_output_dir, cache_filename=args.cache_file)
 
     print(f"* Processing data...")
-    seq_tags = list(hyps)
-    print("Num seqs:", len(seq_tags))
-    seq_tags = [seq_tags[i] for i in torch.randperm(len(seq_tags))]
+    print("Num seqs:", len(data))
+    data = data.select_seqs(torch.randperm(len(data)))
     if args.seqs_start != 0 or args.seqs_end != 1:
         assert 0 <= args.seqs_start <= 1 and 0 <= args.seqs_end <= 1 and args.seqs_start <= args.seqs_end
-        start = int(args.seqs_start * len(seq_tags))
-        end = int(args.seqs_end * len(seq_tags))
-        seq_tags = seq_tags[start:end]
-        print(f"Selected subset (after shuffling): [{start}:{end}], num seqs: {len(seq_tags)}")
-
-    key_signs = None
-    for seq_tag in seq_tags:
-        hyps_ = hyps[seq_tag]
-        exts_ = exts[seq_tag]
-        assert isinstance(hyps_, list) and isinstance(exts_, list) and len(hyps_) == len(exts_)
-        if not keys:
-            keys = list(exts_[0].keys())
-            print("Score keys:", keys)
-            key_signs = [1.0 if "_neg_" not in key else -1.0 for key in keys]
-            print("Key signs:", key_signs)
-            print("Beam size:", len(hyps_))
-        ref_words = hyps_[0][1].replace("@@ ", "").split()
-        total_num_ref_words += len(ref_words)
-        scores_ls = []
-        hyp_num_tokens_ls = []
-        num_err_ls = []
-        for (_, hyp), ext in zip(hyps_, exts_):
-            hyp_num_tokens = len(hyp.split())
-            hyp_words = hyp.replace("@@ ", "").split()
-            num_errors = torchaudio.functional.edit_distance(ref_words, hyp_words)
-            scores_ls.append(torch.tensor([ext[key] for key in keys]))
-            hyp_num_tokens_ls.append(float(hyp_num_tokens))
-            num_err_ls.append(float(num_errors))
-        entries_scores.append(torch.stack(scores_ls))
-        entries_hyp_num_tokens.append(torch.tensor(hyp_num_tokens_ls))
-        entries_num_err.append(torch.tensor(num_err_ls))
-
-    entries_scores = torch.stack(entries_scores)  # [seqs,beam,scores]
-    entries_hyp_num_tokens = torch.stack(entries_hyp_num_tokens)  # [seqs,beam]
-    entries_num_err = torch.stack(entries_num_err)  # [seqs,beam]
-    entries_num_err /= total_num_ref_words
+        start = int(args.seqs_start * len(data))
+        end = int(args.seqs_end * len(data))
+        data = data.select_seqs(torch.arange(start, end))
+        print(f"Selected subset (after shuffling): [{start}:{end}], num seqs: {len(data)}")
+
+    keys = data.keys  # len: scores
+    key_signs = data.key_signs
+    print("Score keys:", keys)
+    print("Key signs:", key_signs)
+    print("Beam size:", data.scores.shape[1])
+
+    if args.multi_start:
+        print("* Start multi-start training...")
+        res = multi_start_mod.tune_scales(
+            data,
+            num_random_starts=args.num_random_starts,
+            init_scales=[float(s) for s in args.init_scales.split(",")] if args.init_scales else None,
+            init_len_norm=args.init_len_norm,
+            train_len_norm=bool(args.train_len_norm),
+            fix_scale0=bool(args.fix_scale0),
+            softmax_temperature=args.softmax_temperature,
+            opt=args.opt,
+            lr=args.lr,
+            num_steps=args.num_steps,
+            held_out_fraction=args.held_out_fraction,
+            random_seed=args.random_seed,
+            device=args.device,
+        )
+        print("Result:", json.dumps(res, indent=2))
+        if args.output_json:
+            with open(args.output_json, "w") as f:
+                json.dump(res, f, indent=2)
+                f.write("\n")
+        return
+
+    entries_scores = data.scores  # [seqs,beam,scores]
+    entries_hyp_num_tokens = data.hyp_num_tokens  # [seqs,beam]
+    entries_num_err = data.num_err / data.num_ref_words.sum()  # [seqs,beam]
+    entries_hyp_mask = data.hyp_mask.to(device)  # [seqs,beam]
 
     key_signs = torch.tensor(key_signs, device=device)  # [scores]
     entries_scores = entries_scores.to(device)
@@ -115,13 +108,14 @@ def main():
     print("Fix scale0:", bool(args.fix_scale0))
 
     def _logits():
-        return torch.einsum(
+        logits = torch.einsum(
             "s,s,abs,ab->ab",
             scales,
             key_signs,
             entries_scores,
             torch.reciprocal(entries_hyp_num_tokens + 1) ** len_norm_scale,
         )  # [seqs,beam]
+        return logits.masked_fill(~entries_hyp_mask, float("-inf"))  # padded hyps, if beam sizes differ
 
     def _loss():
         seq_scores = _logits()  # [seqs,beam]
@@ -203,6 +197,17 @@ def batch_gather(values: torch.Tensor, *, indices: torch.Tensor) -> torch.Tensor
     return out
 
 
+def _import_lib():
+    try:
+        from i6_experiments.users.zeyer.scale_tuning import nbest_data, multi_start
+    except ImportError:  # running as standalone script
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import nbest_data
+        import multi_start
+
+    return nbest_data, multi_start
+
+
 def _setup():
     print("PyTorch:", torch.__version__)
 